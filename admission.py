@@ -0,0 +1,146 @@
+# 价值优先的发送队列：给待转发消息打分，按价值和新鲜度排序，超出容量或过期时确定性地丢弃
+import asyncio
+import heapq
+import math
+import re
+
+from clock import SystemClock
+
+# 联系方式：@用户名、t.me链接、邮箱、微信/VX、手机号
+CONTACT_PATTERN = re.compile(
+    r'(@[A-Za-z][A-Za-z0-9_]{4,}|t\.me/|[\w.+-]+@[\w-]+\.[\w.]+|微信|vx|wx|联系|1[3-9]\d{9})',
+    re.IGNORECASE)
+
+
+class PostScorer:
+    """根据关键词命中、频道权重和是否包含联系方式给消息打分（分数 > 0）"""
+
+    def __init__(self, config):
+        self.config = config
+        keywords = [k for k in config.PRIORITY_KEYWORDS if k]
+        self.keyword_pattern = re.compile("|".join(map(re.escape, keywords)), re.IGNORECASE) if keywords else None
+
+    def score(self, text, channel):
+        text = text or ""
+        hits = 0
+        if self.keyword_pattern:
+            hits = len({match.group(0).lower() for match in self.keyword_pattern.finditer(text)})
+        score = 1.0 + self.config.KEYWORD_WEIGHT * min(hits, self.config.MAX_KEYWORD_HITS)
+        if CONTACT_PATTERN.search(text):
+            score += self.config.CONTACT_BONUS
+        return score * self.config.CHANNEL_WEIGHTS.get(channel, 1.0)
+
+
+class AdmissionQueue:
+    """有界优先队列
+    优先级 = log(分数) + 发布时间 * ln2 / 半衰期，等价于 分数 * 0.5^(年龄/半衰期)，
+    且所有消息按同一速度衰减，排序不随时间变化，堆始终有效
+    """
+
+    def __init__(self, capacity=100, max_age=4 * 3600, half_life=3600, clock=None):
+        self.capacity = capacity
+        self.max_age = max_age
+        self.decay = math.log(2) / half_life
+        self.clock = clock if clock is not None else SystemClock()
+        self._heap = []  # (-优先级, 序号, 发布时间, job)
+        self._seq = 0
+        self._not_empty = asyncio.Event()
+        self.stats = {'queued': 0, 'sent': 0, 'shed': 0, 'expired': 0}
+
+    def __len__(self):
+        return len(self._heap)
+
+    def priority(self, score, created_at):
+        return math.log(max(score, 1e-6)) + created_at * self.decay
+
+    def push(self, job, score, created_at):
+        """加入队列，返回因容量不足被丢弃的消息列表（可能包括刚加入的这条）"""
+        self._seq += 1
+        heapq.heappush(self._heap, (-self.priority(score, created_at), self._seq, created_at, job))
+        self.stats['queued'] += 1
+        shed = []
+        while len(self._heap) > self.capacity:
+            # 丢弃优先级最低的一条，同优先级时丢弃较晚加入的
+            lowest = max(range(len(self._heap)), key=lambda i: self._heap[i][:2])
+            shed.append(self._heap[lowest][3])
+            self._heap[lowest] = self._heap[-1]
+            self._heap.pop()
+            heapq.heapify(self._heap)
+        self.stats['shed'] += len(shed)
+        self._not_empty.set()
+        return shed
+
+    def would_admit(self, score, created_at):
+        """现在加入时是否会留在队列中（不会被立即丢弃）"""
+        if len(self._heap) < self.capacity:
+            return True
+        lowest = max(entry[0] for entry in self._heap)
+        return -self.priority(score, created_at) < lowest
+
+    def purge_expired(self):
+        """移除超过最长等待时间的消息并返回"""
+        cutoff = self.clock.time() - self.max_age
+        expired = [entry[3] for entry in self._heap if entry[2] < cutoff]
+        if expired:
+            self._heap = [entry for entry in self._heap if entry[2] >= cutoff]
+            heapq.heapify(self._heap)
+            self.stats['expired'] += len(expired)
+        self._update_event()
+        return expired
+
+    def pop(self):
+        """取出当前价值最高的消息，队列为空时返回 None"""
+        if not self._heap:
+            return None
+        job = heapq.heappop(self._heap)[3]
+        self.stats['sent'] += 1
+        self._update_event()
+        return job
+
+    def peek(self, predicate):
+        """不取出，返回满足 predicate(job) 的价值最高的消息，没有时返回 None"""
+        for entry in sorted(self._heap):
+            if predicate(entry[3]):
+                return entry[3]
+        return None
+
+    def top(self, limit):
+        """不取出，按优先级从高到低返回前 limit 条消息"""
+        return [entry[3] for entry in heapq.nsmallest(limit, self._heap)]
+
+    def jobs(self):
+        """队列中的全部消息（不取出）"""
+        return [entry[3] for entry in self._heap]
+
+    def take(self, predicate, limit):
+        """按优先级从高到低取出最多 limit 条满足 predicate(job) 的消息"""
+        taken = []
+        for entry in sorted(self._heap):
+            if len(taken) >= limit:
+                break
+            if predicate(entry[3]):
+                taken.append(entry)
+        if taken:
+            ids = {id(entry) for entry in taken}
+            self._heap = [entry for entry in self._heap if id(entry) not in ids]
+            heapq.heapify(self._heap)
+            self.stats['sent'] += len(taken)
+            self._update_event()
+        return [entry[3] for entry in taken]
+
+    def drain(self):
+        """取出全部消息（关闭时写检查点）"""
+        jobs = [entry[3] for entry in sorted(self._heap)]
+        self._heap = []
+        self._update_event()
+        return jobs
+
+    async def wait(self):
+        """等待队列非空"""
+        await self._not_empty.wait()
+
+    def _update_event(self):
+        if self._heap:
+            self._not_empty.set()
+        else:
+            self._not_empty.clear()
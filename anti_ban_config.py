@@ -1,10 +1,9 @@
 # 防封配置文件
 from loguru import logger
 import random
-import time
-from datetime import datetime
-import pytz
-from datetime import timedelta
+from collections import deque
+from clock import SystemClock
+from schedule_engine import ScheduleBook
 
 
 class AntiBanConfig:
@@ -30,6 +29,46 @@ class AntiBanConfig:
     SUCCESS_REDUCE_FACTOR = 0.95  # 成功时减少延迟的因子
     ERROR_INCREASE_FACTOR = 2.5  # 错误时增加延迟的因子
 
+    # 时间窗口（按整点计，包含结束小时）
+    TIMEZONE = "Asia/Shanghai"
+    WORK_HOURS = (9, 18)  # 工作时间
+    SAFE_HOURS = (7, 23)  # 安全时间
+    WEEKDAY_WORK_RATIO = 1.0  # 工作日工作时间处理比例
+    WEEKEND_WORK_RATIO = 0.5  # 周末工作时间处理比例
+    OFF_HOURS_RATIO = 0.3  # 非工作时间处理比例
+    # 按频道覆盖时间窗口，例如 {"@remote_cn": {"WORK_HOURS": (8, 22)}}
+    CHANNEL_SCHEDULES = {}
+
+    # 价值优先的发送队列（处理比例按比例缩减每小时额度，不再随机跳过）
+    ADMISSION_QUEUE_SIZE = 100  # 待发送队列容量，超出时丢弃价值最低的消息
+    ADMISSION_MAX_AGE = 4 * 3600  # 消息最长等待时间（秒）
+    SEND_MAX_ATTEMPTS = 3  # 发送失败（频率限制、临时错误）后放回队列重试，最多尝试的次数
+    FRESHNESS_HALF_LIFE = 3600  # 新鲜度半衰期（秒）
+    PRIORITY_KEYWORDS = ["招聘", "远程", "岗位", "职位", "薪资", "月薪", "年薪", "待遇", "全职",
+                         "工程师", "开发", "运营", "设计", "hiring", "remote", "developer", "engineer"]
+    KEYWORD_WEIGHT = 0.5  # 每命中一个关键词加分
+    MAX_KEYWORD_HITS = 6  # 关键词加分上限
+    CONTACT_BONUS = 1.0  # 包含联系方式加分
+    CHANNEL_WEIGHTS = {}  # 频道权重，例如 {"@remote_cn": 1.5}
+
+    # 摘要模式：价值低于阈值的消息不单独发送，按窗口合并为摘要（每条摘要消息只占一次发送额度）
+    DIGEST_ENABLED = False
+    DIGEST_SCORE_THRESHOLD = 2.0  # 价值低于该值的消息进入摘要
+    DIGEST_WINDOW = 1800  # 摘要收集窗口（秒）
+    DIGEST_MAX_POSTS = 200  # 单个窗口最多收集的消息数，达到后提前打包
+    DIGEST_SUMMARY_LINES = 3  # 每条消息保留的行数
+
+    # 合并转发：同一源频道发布时间相近的排队消息一次 forward_messages 转发（原样转发，只占一次发送额度）
+    BATCH_FORWARD_ENABLED = False
+    BATCH_FORWARD_WINDOW = 60  # 发布时间相差不超过该秒数的消息可以合并
+    BATCH_FORWARD_MAX = 10  # 单次合并的最多消息数
+
+    # 链接检查的域名策略（按后缀匹配，子域名同样生效；t.me 链接通过Telegram客户端检查）
+    DOMAIN_ALLOW = ["linkedin.com", "github.com", "zhipin.com", "lagou.com", "liepin.com", "51job.com",
+                    "indeed.com", "glassdoor.com", "google.com", "feishu.cn", "notion.site"]
+    DOMAIN_DENY = []  # 已知垃圾域名，直接标注为访问受限
+    DOMAIN_SKIP_CHECK = ["bit.ly", "t.cn"]  # 不检查也不标注（例如短链接）
+
     # 危险错误关键词
     DANGEROUS_ERRORS = [
         "PEER_FLOOD", "FLOOD_WAIT", "AUTH_KEY_DUPLICATED", "SESSION_REVOKED",
@@ -37,6 +76,9 @@ class AntiBanConfig:
         "FORBIDDEN", "403"
     ]
 
+    # 永久性发送错误关键词：重试也不会成功，直接记为失败不放回队列
+    PERMANENT_SEND_ERRORS = ["FORBIDDEN", "BANNED", "USER_DEACTIVATED", "SESSION_REVOKED", "AUTH_KEY"]
+
     # 垃圾消息关键词
     SPAM_KEYWORDS = ["广告", "推广", "代理", "刷单", "兼职", "加微信"]
 
@@ -56,17 +98,74 @@ class AntiBanConfig:
 class AntiBanStrategies:
     """防封策略集合"""
 
-    def __init__(self):
+    def __init__(self, config=None, clock=None, rng=None):
         self.message_count = {'minute': 0, 'hour': 0, 'day': 0}
         self.last_reset = {'minute': 0, 'hour': 0, 'day': 0}
         self.consecutive_errors = 0
         self.current_delay_multiplier = 1.0
         self.last_message_time = 0
-        self.config = AntiBanConfig()  # 创建配置实例
+        self.config = config if config is not None else AntiBanConfig()  # 创建配置实例
+        # 时钟和随机数源可注入，便于模拟器在虚拟时间中运行
+        self.clock = clock if clock is not None else SystemClock()
+        self.rng = rng if rng is not None else random
+        # 时间窗口预编译一次，窗口边界前直接复用
+        self.schedules = ScheduleBook(self.config, self.clock)
+        # 最近一天内的发送时间和冷却截止时间，写入账本以便重启后恢复
+        self.send_history = deque()
+        self.cooldown_until = 0
+        self.ledger = None
+
+    def attach_ledger(self, ledger):
+        """绑定状态账本，并恢复上次运行留下的限流和退避状态"""
+        self.ledger = ledger
+        state = ledger.load(self.clock.time())
+        if state:
+            self.restore(state)
+        return state
+
+    def restore(self, state):
+        """从账本状态恢复计数器（窗口从窗口内最早一次发送开始计算）"""
+        now = self.clock.time()
+        self.send_history = deque(sorted(state['sends']))
+        for window, span in (('minute', 60), ('hour', 3600), ('day', 86400)):
+            recent = [t for t in self.send_history if now - t < span]
+            self.message_count[window] = len(recent)
+            self.last_reset[window] = recent[0] if recent else now
+        self.last_message_time = self.send_history[-1] if self.send_history else 0
+        self.consecutive_errors = state['consecutive_errors']
+        self.current_delay_multiplier = state['multiplier']
+        self.cooldown_until = state['cooldown_until']
+
+    def export_state(self):
+        """导出当前状态（用于压缩账本）"""
+        return {
+            'sends': list(self.send_history),
+            'consecutive_errors': self.consecutive_errors,
+            'multiplier': self.current_delay_multiplier,
+            'cooldown_until': self.cooldown_until,
+        }
+
+    def _append_ledger(self, record):
+        if self.ledger is None:
+            return
+        self.ledger.append(record)
+        if self.ledger.needs_compaction():
+            self.ledger.compact(self.export_state())
+
+    def start_cooldown(self, seconds):
+        """进入冷却（频率限制/严重错误），截止时间写入账本"""
+        until = self.clock.time() + seconds
+        if until > self.cooldown_until:
+            self.cooldown_until = until
+            self._append_ledger({'e': 'cooldown', 'u': until})
+
+    def cooldown_remaining(self):
+        """剩余冷却秒数"""
+        return max(0.0, self.cooldown_until - self.clock.time())
 
     def reset_counters(self):
         """重置计数器"""
-        current_time = time.time()
+        current_time = self.clock.time()
 
         if current_time - self.last_reset['minute'] >= 60:
             self.message_count['minute'] = 0
@@ -80,22 +179,39 @@ class AntiBanStrategies:
             self.message_count['day'] = 0
             self.last_reset['day'] = current_time
 
-    def can_send_message(self):
+    def _limits(self, ratio=1.0):
+        """各窗口的额度，ratio 按时间窗口的处理比例缩减每小时额度"""
+        return {
+            'minute': self.config.MAX_MESSAGES_PER_MINUTE,
+            'hour': max(1, int(self.config.MAX_MESSAGES_PER_HOUR * ratio)),
+            'day': self.config.MAX_MESSAGES_PER_DAY,
+        }
+
+    def can_send_message(self, ratio=1.0):
         """检查是否可以发送消息"""
         self.reset_counters()
-        return (self.message_count['minute'] < self.config.MAX_MESSAGES_PER_MINUTE and
-                self.message_count['hour'] < self.config.MAX_MESSAGES_PER_HOUR and
-                self.message_count['day'] < self.config.MAX_MESSAGES_PER_DAY)
+        limits = self._limits(ratio)
+        return all(self.message_count[window] < limits[window] for window in limits)
+
+    def seconds_until_slot(self, ratio=1.0):
+        """距离下一个可用发送额度的秒数（当前可发送时为0）"""
+        self.reset_counters()
+        now = self.clock.time()
+        spans = {'minute': 60, 'hour': 3600, 'day': 86400}
+        limits = self._limits(ratio)
+        waits = [self.last_reset[window] + spans[window] - now
+                 for window in limits if self.message_count[window] >= limits[window]]
+        return max(0.0, max(waits)) if waits else 0.0
 
     def get_adaptive_delay(self):
         """获取自适应延迟"""
-        base_delay = random.uniform(self.config.MIN_DELAY, self.config.MAX_DELAY)
+        base_delay = self.rng.uniform(self.config.MIN_DELAY, self.config.MAX_DELAY)
 
         if self.config.ADAPTIVE_DELAY:
             base_delay *= self.current_delay_multiplier
 
         # 连续发送消息增加额外延迟
-        if time.time() - self.last_message_time < 10:
+        if self.clock.time() - self.last_message_time < 10:
             base_delay += self.config.BURST_DELAY
 
         return base_delay
@@ -106,12 +222,17 @@ class AntiBanStrategies:
         self.message_count['hour'] += 1
         self.message_count['day'] += 1
         self.consecutive_errors = 0
-        self.last_message_time = time.time()
+        self.last_message_time = self.clock.time()
 
         if self.config.ADAPTIVE_DELAY:
             self.current_delay_multiplier = max(0.5,
                                                 self.current_delay_multiplier * self.config.SUCCESS_REDUCE_FACTOR)
 
+        self.send_history.append(self.last_message_time)
+        while self.send_history and self.last_message_time - self.send_history[0] >= 86400:
+            self.send_history.popleft()
+        self._append_ledger({'e': 'send', 't': self.last_message_time, 'm': self.current_delay_multiplier})
+
     def record_error(self, error_msg=""):
         """记录错误"""
         self.consecutive_errors += 1
@@ -119,20 +240,13 @@ class AntiBanStrategies:
         if self.config.ADAPTIVE_DELAY:
             self.current_delay_multiplier *= self.config.ERROR_INCREASE_FACTOR
 
+        self._append_ledger({'e': 'error', 't': self.clock.time(), 'c': self.consecutive_errors,
+                             'm': self.current_delay_multiplier})
+
         if self.config.EXPONENTIAL_BACKOFF:
             return self.config.COOLDOWN_TIME * (2 ** min(self.consecutive_errors - 1, 5))
         return self.config.COOLDOWN_TIME
 
-    def should_skip_message(self, message_text):
-        """检查是否应该跳过消息"""
-        if not message_text or len(message_text.strip()) < 10:
-            return True
-
-        # 检查垃圾消息关键词
-        text_lower = message_text.lower()
-        spam_count = sum(1 for keyword in self.config.SPAM_KEYWORDS if keyword in text_lower)
-        return spam_count >= 2
-
     def get_error_action(self, error_msg):
         """根据错误消息获取建议操作"""
         error_msg = error_msg.upper()
@@ -148,63 +262,34 @@ class AntiBanStrategies:
         else:
             return "未知错误，建议谨慎处理"
 
-    @staticmethod
-    def is_work_time():
+    def is_work_time(self, channel=None, window=None):
         """检查消息是否应该被处理
         - 工作日9:00-18:00：100%处理
         - 周末9:00-18:00：50%处理
         - 其他时间：30%处理
+        传入 window 时复用同一个时间窗口，保证一条消息内的判断一致
         """
         try:
-            beijing_tz = pytz.timezone("Asia/Shanghai")
-            current_time = datetime.now(beijing_tz)
-            current_hour = current_time.hour
-            is_weekend = current_time.weekday() >= 5
-
-            # 检查是否在9:00-18:00之间
-            in_work_hours = 9 <= current_hour <= 18
-
-            # 如果不在9:00-18:00之间，30%概率处理
-            if not in_work_hours:
-                return random.random() < 0.3
-
-            # 在9:00-18:00之间
-            if is_weekend:
-                # 周末工作时间，50%概率处理
-                return random.random() < 0.5
-            else:
-                # 工作日工作时间，100%处理
+            if window is None:
+                window = self.schedules.window(channel)
+            if window.work_ratio >= 1:
                 return True
-
+            return self.rng.random() < window.work_ratio
         except Exception:
             return True  # 出错时默认为工作时间
 
-    @staticmethod
-    def is_safe_time():
+    def is_safe_time(self, channel=None, window=None):
         """检查是否在安全时间范围内（7:00-23:00）"""
         try:
-            beijing_tz = pytz.timezone("Asia/Shanghai")
-            current_time = datetime.now(beijing_tz)
-            current_hour = current_time.hour
-            return 7 <= current_hour <= 23
+            if window is None:
+                window = self.schedules.window(channel)
+            return window.is_safe
         except Exception:
             return True  # 出错时默认为安全时间
 
-    @staticmethod
-    def get_next_work_time():
+    def get_next_work_time(self, channel=None):
         """获取下一个工作时间"""
-        beijing_tz = pytz.timezone("Asia/Shanghai")
-        current_time = datetime.now(beijing_tz)
-
-        # 如果当前小时小于9点，设置为今天9点
-        if current_time.hour < 9:
-            next_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-        else:
-            # 否则设置为明天9点
-            next_time = current_time.replace(hour=9, minute=0, second=0, microsecond=0)
-            next_time = next_time + timedelta(days=1)
-
-        return next_time
+        return self.schedules.window(channel).next_work_time
 
 
 if __name__ == "__main__":
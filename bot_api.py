@@ -0,0 +1,185 @@
+# Bot HTTP API 发送端：用一个复用连接的 aiohttp 会话调用 Bot API，接口与转发器用到的 TelegramClient 方法一致，可替换 MTProto Bot客户端
+import json
+import os
+from collections import namedtuple
+
+import aiohttp
+from telethon.errors import FloodWaitError, RPCError
+from telethon.extensions import markdown
+from telethon.tl import types
+
+DEFAULT_API_URL = "https://api.telegram.org"
+
+# 与 TelegramClient 一致：不传 parse_mode 时按 Markdown 解析
+_DEFAULT = object()
+
+# Telethon 消息实体 -> Bot API 实体类型
+ENTITY_TYPES = {
+    types.MessageEntityBold: "bold",
+    types.MessageEntityItalic: "italic",
+    types.MessageEntityUnderline: "underline",
+    types.MessageEntityStrike: "strikethrough",
+    types.MessageEntitySpoiler: "spoiler",
+    types.MessageEntityCode: "code",
+    types.MessageEntityPre: "pre",
+    types.MessageEntityTextUrl: "text_link",
+    types.MessageEntityBlockquote: "blockquote",
+}
+
+BotUser = namedtuple("BotUser", ["id", "first_name", "username"])
+SentMessage = namedtuple("SentMessage", ["id", "chat_id", "date"])
+
+
+class BotApiError(RPCError):
+    """Bot API 返回的错误（沿用 RPCError，错误处理与 MTProto 客户端一致）"""
+
+    def __init__(self, method, code, description):
+        super().__init__(request=None, message=description, code=code)
+        self.method = method
+        self.description = description
+
+    def __str__(self):
+        return f"{self.description} (caused by {self.method})"
+
+
+def convert_entities(entities):
+    """Telethon 消息实体转换为 Bot API 的 JSON 实体，不支持的类型忽略"""
+    converted = []
+    for entity in entities or []:
+        kind = ENTITY_TYPES.get(type(entity))
+        if kind is None:
+            continue
+        item = {'type': kind, 'offset': entity.offset, 'length': entity.length}
+        if kind == "pre" and entity.language:
+            item['language'] = entity.language
+        elif kind == "text_link":
+            item['url'] = entity.url
+        converted.append(item)
+    return converted
+
+
+class BotApiClient:
+    """通过 Bot HTTP API 发送消息
+    只实现转发器用到的 start/get_me/send_message/send_file/edit_message/connect/disconnect/is_connected，
+    所有请求共用一个 aiohttp 会话（连接池 + keep-alive），省去 MTProto 客户端的加密握手和更新处理
+    """
+
+    def __init__(self, token=None, base_url=DEFAULT_API_URL, timeout=30, pool_size=4):
+        self.token = token
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        self.pool_size = pool_size  # 连接池大小（同一时间只有一个发送任务，留少量余量给日志和状态报告）
+        self._session = None
+        self.stats = {'requests': 0, 'errors': 0, 'flood_waits': 0}
+
+    def is_connected(self):
+        return self._session is not None and not self._session.closed
+
+    async def connect(self):
+        if self.is_connected():
+            return
+        connector = aiohttp.TCPConnector(limit=self.pool_size, keepalive_timeout=60)
+        self._session = aiohttp.ClientSession(connector=connector,
+                                              timeout=aiohttp.ClientTimeout(total=self.timeout))
+
+    async def disconnect(self):
+        if self._session is not None:
+            await self._session.close()
+            self._session = None
+
+    async def start(self, bot_token=None):
+        """打开会话并用 getMe 验证令牌"""
+        if bot_token:
+            self.token = bot_token
+        if not self.token:
+            raise ValueError("需要设置 BOT_TOKEN")
+        await self.connect()
+        await self.get_me()
+        return self
+
+    async def _call(self, method, payload=None, data=None):
+        """调用一个 Bot API 方法，返回 result；429 转换为 FloodWaitError，其他错误抛出 BotApiError"""
+        if not self.is_connected():
+            await self.connect()
+        self.stats['requests'] += 1
+        url = f"{self.base_url}/bot{self.token}/{method}"
+        async with self._session.post(url, json=payload if data is None else None, data=data) as response:
+            try:
+                body = await response.json(content_type=None)
+            except (json.JSONDecodeError, aiohttp.ContentTypeError):
+                body = {'ok': False, 'error_code': response.status, 'description': f"HTTP {response.status}"}
+        if body.get('ok'):
+            return body['result']
+
+        self.stats['errors'] += 1
+        code = body.get('error_code', response.status)
+        retry_after = (body.get('parameters') or {}).get('retry_after')
+        if code == 429 and retry_after is not None:
+            self.stats['flood_waits'] += 1
+            raise FloodWaitError(request=None, capture=int(retry_after))
+        raise BotApiError(method, code, body.get('description', f"HTTP {code}"))
+
+    @staticmethod
+    def _text_fields(text, parse_mode, key="text"):
+        """按 TelegramClient 的规则处理格式：默认 Markdown，parse_mode=None 为纯文本"""
+        if parse_mode is _DEFAULT or parse_mode in ("md", "markdown"):
+            text, entities = markdown.parse(text)
+            fields = {key: text}
+            entities = convert_entities(entities)
+            if entities:
+                fields['caption_entities' if key == "caption" else 'entities'] = entities
+            return fields
+        if parse_mode is None:
+            return {key: text}
+        return {key: text, 'parse_mode': parse_mode}
+
+    @staticmethod
+    def _message(result):
+        return SentMessage(result['message_id'], result['chat']['id'], result.get('date'))
+
+    async def get_me(self):
+        result = await self._call("getMe")
+        return BotUser(result['id'], result.get('first_name'), result.get('username'))
+
+    async def send_message(self, entity, message, parse_mode=_DEFAULT, link_preview=True, formatting_entities=None):
+        if formatting_entities is not None:
+            # 显式给出实体时（包括空列表）不再解析格式
+            payload = {'chat_id': entity, 'text': message, 'entities': convert_entities(formatting_entities)}
+        else:
+            payload = {'chat_id': entity, **self._text_fields(message, parse_mode)}
+        if not link_preview:
+            payload['link_preview_options'] = {'is_disabled': True}
+        return self._message(await self._call("sendMessage", payload))
+
+    async def edit_message(self, entity, message, text, parse_mode=_DEFAULT, link_preview=True):
+        payload = {'chat_id': entity, 'message_id': message, **self._text_fields(text, parse_mode)}
+        if not link_preview:
+            payload['link_preview_options'] = {'is_disabled': True}
+        result = await self._call("editMessageText", payload)
+        return self._message(result) if isinstance(result, dict) else result
+
+    async def send_file(self, entity, file, caption=None, parse_mode=_DEFAULT, force_document=False):
+        """上传文件：file 为本地路径或可读的文件对象（预取的媒体缓冲区）
+        Bot API 无法直接引用用户账号下的 MTProto 媒体对象，这类调用抛出 BotApiError，由调用方回退
+        """
+        method, field = ("sendDocument", "document") if force_document else ("sendPhoto", "photo")
+        if isinstance(file, str):
+            name = os.path.basename(file)
+            content = open(file, "rb")
+        elif hasattr(file, "read"):
+            name = os.path.basename(getattr(file, "name", "") or "") or field
+            content = file
+        else:
+            raise BotApiError(method, 400, f"Bot API 无法上传 {type(file).__name__} 对象")
+
+        try:
+            data = aiohttp.FormData()
+            data.add_field("chat_id", str(entity))
+            if caption:
+                for key, value in self._text_fields(caption, parse_mode, key="caption").items():
+                    data.add_field(key, value if isinstance(value, str) else json.dumps(value))
+            data.add_field(field, content, filename=name)
+            return self._message(await self._call(method, data=data))
+        finally:
+            if isinstance(file, str):
+                content.close()
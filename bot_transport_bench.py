@@ -0,0 +1,174 @@
+# 发送端传输方式基准：比较 Bot HTTP API 客户端和 MTProto Bot客户端的内存占用、启动耗时和发送延迟
+# HTTP 客户端对本地的 Bot API 替身服务测量；MTProto 客户端离线时只测构造开销，提供凭据时对真实服务器测量
+import argparse
+import asyncio
+import json
+import os
+import resource
+import statistics
+import subprocess
+import sys
+import time
+import tracemalloc
+
+TOKEN = "123456:bench"
+
+
+async def start_stand_in(latency):
+    """本地 Bot API 替身：getMe/sendMessage/sendPhoto/sendDocument 返回固定格式的结果，每次请求等待 latency 秒"""
+    from aiohttp import web
+
+    counter = {'message_id': 0}
+
+    async def handle(request):
+        await asyncio.sleep(latency)
+        method = request.match_info['method']
+        if method == "getMe":
+            return web.json_response({'ok': True, 'result': {'id': 123456, 'is_bot': True, 'first_name': "bench",
+                                                              'username': "bench_bot"}})
+        if request.content_type == "application/json":
+            await request.json()
+        else:
+            await request.read()
+        counter['message_id'] += 1
+        return web.json_response({'ok': True, 'result': {'message_id': counter['message_id'], 'date': int(time.time()),
+                                                          'chat': {'id': -100123, 'type': "channel"}}})
+
+    app = web.Application()
+    app.router.add_post(f"/bot{TOKEN}/{{method}}", handle)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    site = web.TCPSite(runner, "127.0.0.1", 0)
+    await site.start()
+    port = site._server.sockets[0].getsockname()[1]
+    return runner, f"http://127.0.0.1:{port}"
+
+
+def percentile(values, q):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(q * len(values)))] if values else 0.0
+
+
+def latency_summary(latencies):
+    return {
+        'sends': len(latencies),
+        'mean_ms': round(statistics.mean(latencies) * 1000, 2) if latencies else None,
+        'p50_ms': round(percentile(latencies, 0.5) * 1000, 2),
+        'p95_ms': round(percentile(latencies, 0.95) * 1000, 2),
+    }
+
+
+async def bench_http(sends, latency):
+    """在子进程中运行：导入、启动 BotApiClient 并连续发送"""
+    runner, base_url = await start_stand_in(latency)
+    started = time.perf_counter()
+    tracemalloc.start()
+    from bot_api import BotApiClient
+    imported = time.perf_counter()
+    client = BotApiClient(TOKEN, base_url=base_url)
+    await client.start()
+    ready = time.perf_counter()
+    latencies = []
+    text = "🔄 转发自: @bench\n\n" + "招聘 远程 Python 后端开发 " * 20
+    for _ in range(sends):
+        sent_at = time.perf_counter()
+        await client.send_message("@bench_target", text, parse_mode=None, link_preview=False)
+        latencies.append(time.perf_counter() - sent_at)
+    traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    await client.disconnect()
+    await runner.cleanup()
+    return {
+        'import_ms': round((imported - started) * 1000, 1),
+        'startup_ms': round((ready - imported) * 1000, 1),
+        'traced_kb': round(traced[0] / 1024),
+        'peak_kb': round(traced[1] / 1024),
+        **latency_summary(latencies),
+    }
+
+
+async def bench_mtproto(sends, chat):
+    """在子进程中运行：导入并构造 Telethon Bot客户端；提供 API_ID/API_HASH/BOT_TOKEN 和 chat 时登录并发送"""
+    started = time.perf_counter()
+    tracemalloc.start()
+    from telethon import TelegramClient
+    imported = time.perf_counter()
+    client = TelegramClient(None, int(os.getenv("API_ID", 1)), os.getenv("API_HASH", "0" * 32),
+                            device_model="Windows 10", system_version="Windows 10", app_version="1.0",
+                            lang_code="zh-CN", system_lang_code="zh-CN")
+    latencies = []
+    live = bool(chat and os.getenv("BOT_TOKEN") and os.getenv("API_ID"))
+    if live:
+        await client.start(bot_token=os.getenv("BOT_TOKEN"))
+    ready = time.perf_counter()
+    if live:
+        for i in range(sends):
+            sent_at = time.perf_counter()
+            await client.send_message(chat, f"transport bench {i}", parse_mode=None, link_preview=False)
+            latencies.append(time.perf_counter() - sent_at)
+        await client.disconnect()
+    traced = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return {
+        'live': live,
+        'import_ms': round((imported - started) * 1000, 1),
+        'startup_ms': round((ready - imported) * 1000, 1),
+        'traced_kb': round(traced[0] / 1024),
+        'peak_kb': round(traced[1] / 1024),
+        **(latency_summary(latencies) if live else {}),
+    }
+
+
+def worker(args):
+    if args.worker == "http":
+        result = asyncio.run(bench_http(args.sends, args.latency_ms / 1000))
+    else:
+        result = asyncio.run(bench_mtproto(args.sends, args.chat))
+    # ru_maxrss 在 Linux 上单位为 KB
+    result['max_rss_kb'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    print(json.dumps(result))
+
+
+def run_worker(transport, args):
+    command = [sys.executable, os.path.abspath(__file__), "--worker", transport, "--sends", str(args.sends),
+               "--latency-ms", str(args.latency_ms)]
+    if args.chat:
+        command += ["--chat", args.chat]
+    result = subprocess.run(command, capture_output=True, text=True, cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"{transport} 基准失败:\n{result.stderr[-2000:]}")
+    return json.loads(result.stdout.strip().splitlines()[-1])
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="Bot 发送端传输方式基准")
+    parser.add_argument("--sends", type=int, default=200, help="连续发送次数")
+    parser.add_argument("--latency-ms", type=float, default=0, help="替身服务每次请求的模拟处理时间（毫秒）")
+    parser.add_argument("--chat", help="MTProto 实测时发送到的聊天（需要 API_ID/API_HASH/BOT_TOKEN）")
+    parser.add_argument("--json", action="store_true", help="输出JSON")
+    parser.add_argument("--worker", choices=["http", "mtproto"], help=argparse.SUPPRESS)
+    args = parser.parse_args(argv)
+
+    if args.worker:
+        worker(args)
+        return
+
+    results = {transport: run_worker(transport, args) for transport in ("http", "mtproto")}
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"Bot 发送端基准（{args.sends} 次发送，替身服务延迟 {args.latency_ms:g} ms）")
+    labels = [("import_ms", "导入耗时 ms"), ("startup_ms", "启动耗时 ms"), ("traced_kb", "Python 内存 KB"),
+              ("peak_kb", "内存峰值 KB"), ("max_rss_kb", "进程 RSS KB"), ("p50_ms", "发送 p50 ms"),
+              ("p95_ms", "发送 p95 ms")]
+    print(f"  {'':<16}{'HTTP':>12}{'MTProto':>12}")
+    for key, label in labels:
+        values = [results[transport].get(key, "-") for transport in ("http", "mtproto")]
+        print(f"  {label:<16}{values[0]!s:>12}{values[1]!s:>12}")
+    if not results['mtproto']['live']:
+        print("  MTProto 未登录：只包含导入和客户端构造，启动和发送需用 --chat 并提供凭据实测")
+
+
+if __name__ == "__main__":
+    main()
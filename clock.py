@@ -0,0 +1,40 @@
+# 时钟抽象：生产环境使用系统时钟，模拟器中注入虚拟时钟
+import time
+from datetime import datetime
+
+
+class SystemClock:
+    """系统时钟"""
+
+    def time(self):
+        """当前Unix时间戳（秒）"""
+        return time.time()
+
+    def monotonic(self):
+        """单调时钟（秒），用于计算耗时"""
+        return time.monotonic()
+
+    def now(self, tz=None):
+        """当前时间（可指定时区）"""
+        return datetime.fromtimestamp(self.time(), tz)
+
+
+class VirtualClock(SystemClock):
+    """虚拟时钟，只有调用 advance/set 时时间才会前进"""
+
+    def __init__(self, start=0.0):
+        self._now = float(start)
+
+    def time(self):
+        return self._now
+
+    def monotonic(self):
+        return self._now
+
+    def advance(self, seconds):
+        """向前推进指定秒数"""
+        self._now += max(0.0, float(seconds))
+
+    def set(self, timestamp):
+        """跳转到指定时间戳（不允许倒退）"""
+        self._now = max(self._now, float(timestamp))
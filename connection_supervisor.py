@@ -0,0 +1,94 @@
+# 连接监控：每个客户端一个监控任务，等待客户端的断线事件（不轮询），断线后按带抖动的指数退避重连，
+# 断线期间阻塞发送，记录断线时长和重连耗时
+import asyncio
+import random
+from collections import deque
+
+from loguru import logger
+
+from clock import SystemClock
+
+
+class ConnectionSupervisor:
+    """监控一个 Telethon 客户端的连接状态
+    client.disconnected 是断线时完成的 Future（Telethon 自身的自动重连用尽后才会完成）
+    """
+
+    def __init__(self, name, client, base_delay=1.0, max_delay=60.0, rng=None, clock=None):
+        self.name = name
+        self.client = client
+        self.clock = clock if clock is not None else SystemClock()
+        self.base_delay = base_delay  # 首次重连前的最长等待（秒）
+        self.max_delay = max_delay  # 重连等待上限（秒）
+        self.rng = rng if rng is not None else random
+        self._up = asyncio.Event()
+        self._up.set()
+        self.down_since = None
+        self.stats = {'disconnects': 0, 'attempts': 0, 'downtime': 0.0, 'max_downtime': 0.0}
+        self.recoveries = deque(maxlen=50)  # 最近的 (断线时长, 最后一次重连耗时)
+
+    @property
+    def is_up(self):
+        return self._up.is_set()
+
+    async def wait_up(self):
+        """等待连接恢复"""
+        await self._up.wait()
+
+    def _backoff(self, attempt):
+        """第 attempt 次重连前的等待：0 ~ min(上限, 基数 * 2^attempt) 之间随机（full jitter）"""
+        return self.rng.uniform(0, min(self.max_delay, self.base_delay * (2 ** attempt)))
+
+    async def run(self):
+        """等待断线事件，断线后重连"""
+        while True:
+            if self.client.is_connected():
+                try:
+                    await self.client.disconnected
+                except asyncio.CancelledError:
+                    raise
+                except Exception as e:
+                    # 因错误断开时 Future 带有异常
+                    logger.warning(f"{self.name} 断线原因: {e}")
+                if self.client.is_connected():
+                    continue
+            await self._recover()
+
+    async def _recover(self):
+        self._up.clear()
+        self.down_since = self.clock.monotonic()
+        self.stats['disconnects'] += 1
+        logger.warning(f"🔌 {self.name} 连接已断开，开始重连")
+        attempt = 0
+        latency = 0.0
+        while not self.client.is_connected():
+            await asyncio.sleep(self._backoff(attempt))
+            attempt += 1
+            self.stats['attempts'] += 1
+            started = self.clock.monotonic()
+            try:
+                await self.client.connect()
+            except Exception as e:
+                logger.warning(f"{self.name} 第 {attempt} 次重连失败: {e}")
+                continue
+            latency = self.clock.monotonic() - started
+
+        downtime = self.clock.monotonic() - self.down_since
+        self.down_since = None
+        self.stats['downtime'] += downtime
+        self.stats['max_downtime'] = max(self.stats['max_downtime'], downtime)
+        self.recoveries.append((round(downtime, 2), round(latency, 2)))
+        self._up.set()
+        logger.success(f"🔌 {self.name} 已重连，断线 {downtime:.1f} 秒，重连 {attempt} 次")
+
+    def snapshot(self):
+        """连接状态和恢复统计"""
+        downtimes = sorted(downtime for downtime, _ in self.recoveries)
+        latencies = sorted(latency for _, latency in self.recoveries)
+        return {
+            'up': self.is_up,
+            'down_for': round(self.clock.monotonic() - self.down_since, 1) if self.down_since else 0.0,
+            **{key: round(value, 2) if isinstance(value, float) else value for key, value in self.stats.items()},
+            'median_downtime': downtimes[len(downtimes) // 2] if downtimes else 0.0,
+            'median_reconnect': latencies[len(latencies) // 2] if latencies else 0.0,
+        }
@@ -0,0 +1,78 @@
+# 按源频道缓存媒体投递方式的可用性，跳过注定失败的转发/上传尝试
+from telethon.errors import RPCError
+
+from clock import SystemClock
+
+# 媒体投递方式（默认尝试顺序）
+FORWARD = "forward"  # 用户客户端直接转发原消息
+UPLOAD = "upload"  # Bot客户端重新上传媒体
+DELIVERY_METHODS = (FORWARD, UPLOAD)
+
+# 说明频道本身不支持该投递方式的错误（内容保护、禁止转发/发送媒体）
+CAPABILITY_ERROR_KEYWORDS = ("RESTRICTED", "FORBIDDEN", "NOFORWARDS", "CAN'T BE FORWARDED")
+
+
+def is_capability_error(error):
+    """是否为频道能力问题（应写入缓存）；超时、断线、本地错误等临时失败返回 False"""
+    if not isinstance(error, RPCError):
+        return False
+    if getattr(error, 'code', None) == 403:
+        return True
+    # Telethon 的具体错误类型名（如 ChatForwardsRestrictedError）比 message 更具体，一并检查
+    text = f"{type(error).__name__} {getattr(error, 'message', '')} {error}".upper()
+    return any(keyword in text for keyword in CAPABILITY_ERROR_KEYWORDS)
+
+
+class DeliveryCapabilityCache:
+    """记录每个源频道各投递方式最近一次的结果，结果在 ttl 秒后过期重新探测"""
+
+    def __init__(self, ttl=6 * 3600, clock=None):
+        self.ttl = ttl
+        self.clock = clock if clock is not None else SystemClock()
+        self._entries = {}  # chat_id -> {method: (可用, 过期时间)}
+        self.saved_round_trips = 0  # 因已知不可用而跳过的请求数
+
+    def record(self, chat_id, method, ok):
+        """记录一次投递结果"""
+        self._entries.setdefault(chat_id, {})[method] = (ok, self.clock.time() + self.ttl)
+
+    def observe_noforwards(self, chat_id, noforwards):
+        """频道开启了内容保护时直接标记转发不可用"""
+        if noforwards:
+            self.record(chat_id, FORWARD, False)
+
+    def status(self, chat_id, method):
+        """返回 True/False（已知可用/不可用），未知或已过期返回 None"""
+        entry = self._entries.get(chat_id, {}).get(method)
+        if entry is None:
+            return None
+        ok, expires_at = entry
+        if self.clock.time() >= expires_at:
+            del self._entries[chat_id][method]
+            return None
+        return ok
+
+    def plan(self, chat_id, methods=DELIVERY_METHODS):
+        """返回 (按优先级排序的可尝试方式, 已知不可用而跳过的方式)
+        已知可用的排在最前，未知的保持默认顺序
+        """
+        known_good, unknown, skipped = [], [], []
+        for method in methods:
+            ok = self.status(chat_id, method)
+            if ok is None:
+                unknown.append(method)
+            elif ok:
+                known_good.append(method)
+            else:
+                skipped.append(method)
+        return known_good + unknown, skipped
+
+    def note_skipped(self, count):
+        """累计节省的请求数"""
+        self.saved_round_trips += count
+
+    def snapshot(self):
+        """统计信息（用于状态报告）"""
+        blocked = sum(1 for chat_id, methods in list(self._entries.items())
+                      for method in list(methods) if self.status(chat_id, method) is False)
+        return {'channels': len(self._entries), 'blocked': blocked, 'saved': self.saved_round_trips}
@@ -0,0 +1,116 @@
+# 摘要模式：把低价值消息压缩为摘要（来源、时间、前几行、链接），按Telegram长度限制合并成尽量少的消息
+import re
+
+import pytz
+
+from clock import SystemClock
+
+beijing_tz = pytz.timezone("Asia/Shanghai")
+
+URL_PATTERN = re.compile(r'https?://[^\s<>"\'）)]+')
+MESSAGE_LIMIT = 4096  # Telegram单条消息长度上限（按UTF-16计）
+
+
+def tg_len(text):
+    """按Telegram的计数方式（UTF-16代码单元）计算长度"""
+    return len(text.encode("utf-16-le")) // 2
+
+
+def tg_truncate(text, limit):
+    """截断到不超过 limit 个UTF-16代码单元（末尾加省略号），不会切开代理对"""
+    if tg_len(text) <= limit:
+        return text
+    return text.encode("utf-16-le")[:(limit - 1) * 2].decode("utf-16-le", errors="ignore") + "…"
+
+
+def summarize(text, source, posted_at, link=None, media=None, max_lines=3, line_chars=160):
+    """生成一条消息的摘要"""
+    lines = []
+    for line in (text or "").splitlines():
+        line = URL_PATTERN.sub("", line)
+        line = re.sub(r"\s+", " ", "".join(c for c in line if c.isprintable())).strip()
+        if line:
+            lines.append(line if len(line) <= line_chars else line[:line_chars - 1] + "…")
+        if len(lines) >= max_lines:
+            break
+    if not lines:
+        lines.append(f"（{media}）" if media else "（无文本内容）")
+    elif media:
+        lines[-1] += f" [{media}]"
+
+    posted = posted_at.astimezone(beijing_tz).strftime("%m-%d %H:%M")
+    parts = [f"• {source} {posted}"]
+    parts.extend(f"  {line}" for line in lines)
+    links = list(dict.fromkeys(URL_PATTERN.findall(text or "")))[:2]
+    if link:
+        links.insert(0, link)
+    parts.extend(f"  🔗 {url}" for url in links)
+    return "\n".join(parts)
+
+
+def pack(summaries, limit=MESSAGE_LIMIT, title="📰 消息摘要"):
+    """按时间顺序把摘要依次装入消息，当前消息放不下时开始新的一条（下一个适应，保持时间顺序），
+    返回 [(文本, 摘要下标列表)]"""
+    header_room = tg_len(f"{title} (99/99)\n\n")
+    budget = limit - header_room
+    bins = []  # [已用长度, 下标列表]
+    for index, summary in enumerate(summaries):
+        size = tg_len(summary)
+        if size > budget:
+            summary = summaries[index] = tg_truncate(summary, budget)
+            size = tg_len(summary)
+        if bins and bins[-1][0] + size + 2 <= budget:
+            bins[-1][0] += size + 2
+            bins[-1][1].append(index)
+        else:
+            bins.append([size, [index]])
+
+    messages = []
+    for number, (_, indexes) in enumerate(bins, 1):
+        heading = f"{title} ({number}/{len(bins)})" if len(bins) > 1 else title
+        body = "\n\n".join(summaries[i] for i in indexes)
+        messages.append((f"{heading}\n\n{body}", indexes))
+    return messages
+
+
+class DigestBuffer:
+    """按目标频道收集低价值消息，窗口到期后打包"""
+
+    def __init__(self, window=1800, max_posts=200, clock=None):
+        self.window = window  # 收集窗口（秒），从第一条消息进入算起
+        self.max_posts = max_posts  # 单个窗口最多收集的消息数，达到后提前打包
+        self.clock = clock if clock is not None else SystemClock()
+        self._pending = {}  # 目标 -> {'opened': 时间, 'entries': [...]}
+        self.stats = {'collected': 0, 'digests': 0, 'packed': 0}
+
+    def __len__(self):
+        return sum(len(bucket['entries']) for bucket in self._pending.values())
+
+    def add(self, target, entry):
+        """加入一条摘要（jobs.DigestEntry）"""
+        bucket = self._pending.setdefault(target, {'opened': self.clock.time(), 'entries': []})
+        bucket['entries'].append(entry)
+        self.stats['collected'] += 1
+
+    def due(self):
+        """返回窗口已到期（或已满）的目标"""
+        now = self.clock.time()
+        return [target for target, bucket in self._pending.items()
+                if now - bucket['opened'] >= self.window or len(bucket['entries']) >= self.max_posts]
+
+    def take(self, target, limit=MESSAGE_LIMIT):
+        """取出某个目标的全部摘要并打包，返回 [(文本, 条目列表)]"""
+        bucket = self._pending.pop(target, None)
+        if not bucket:
+            return []
+        entries = bucket['entries']
+        packed = pack([entry.summary for entry in entries], limit)
+        self.stats['digests'] += len(packed)
+        self.stats['packed'] += len(entries)
+        return [(text, [entries[i] for i in indexes]) for text, indexes in packed]
+
+    def drain(self):
+        """取出全部未打包的条目（关闭时写检查点）"""
+        entries = [entry for bucket in self._pending.values() for entry in bucket['entries']]
+        self._pending = {}
+        return entries
@@ -0,0 +1,385 @@
+# 故障注入：用按计划抛出频率限制、PEER_FLOOD、断线、慢响应和实体错误的替身客户端驱动真实的发送流程，
+# 在虚拟时间中测量每个场景的恢复时间、丢失和重复的消息数，用于比较退避策略的改动
+import argparse
+import asyncio
+import atexit
+import json
+import os
+import random
+import re
+import shutil
+import sys
+import tempfile
+from collections import Counter, namedtuple
+from datetime import datetime, timezone
+
+# 转发器在导入时读取环境变量：状态文件写入临时目录，不影响正式数据
+os.environ["DATA_DIR"] = tempfile.mkdtemp(prefix="fault_injection_")
+atexit.register(shutil.rmtree, os.environ["DATA_DIR"], ignore_errors=True)
+os.environ.setdefault("API_ID", "1")
+os.environ.setdefault("API_HASH", "0" * 32)
+os.environ.setdefault("BOT_TOKEN", "0:fault")
+
+import pytz
+from loguru import logger
+from telethon.errors import (EntityBoundsInvalidError, FloodWaitError, PeerFloodError, RPCError,
+                             UserBannedInChannelError)
+from telethon.tl.types import Message, PeerChannel
+
+import forward_bot
+from clock import SystemClock
+
+beijing_tz = pytz.timezone("Asia/Shanghai")
+
+# 场景开始时间：工作日上午，处于工作和安全时间内
+START = beijing_tz.localize(datetime(2024, 5, 7, 10, 0)).timestamp()
+
+SOURCE_CHAT_ID = 1001
+SOURCE_CHANNEL = "@fault_source"
+MARKER = re.compile(r"#(\d+)\b")
+
+# 故障类型：slow 只延迟响应，其余在请求时抛出对应错误；disconnect 到时立即断线 seconds 秒
+FAULT_KINDS = ("flood", "peer_flood", "disconnect", "slow", "invalid_bounds", "banned", "forbidden")
+
+# at: 相对场景开始的秒数；seconds: 频率限制/断线/慢响应的秒数；count: 连续影响的请求数
+Fault = namedtuple("Fault", ["at", "kind", "seconds", "count"])
+
+SCENARIOS = {
+    'baseline': [],
+    'flood_30': [Fault(1800, "flood", 30, 1)],
+    'flood_600': [Fault(1800, "flood", 600, 1)],
+    'flood_repeat': [Fault(1800, "flood", 60, 3)],
+    'peer_flood': [Fault(1800, "peer_flood", 0, 1)],
+    'disconnect_120': [Fault(1800, "disconnect", 120, 1)],
+    'disconnect_900': [Fault(1800, "disconnect", 900, 1)],
+    'slow_20': [Fault(1800, "slow", 20, 5)],
+    'invalid_bounds': [Fault(1800, "invalid_bounds", 0, 1)],
+    'banned': [Fault(1800, "banned", 0, 1)],
+    'forbidden': [Fault(1800, "forbidden", 0, 1)],
+}
+
+
+def parse_fault(spec):
+    """kind[:seconds][@at][xcount]，例如 flood:30@1800、slow:20@600x5"""
+    match = re.fullmatch(r"(\w+)(?::(\d+(?:\.\d+)?))?(?:@(\d+(?:\.\d+)?))?(?:x(\d+))?", spec)
+    if not match or match.group(1) not in FAULT_KINDS:
+        raise argparse.ArgumentTypeError(f"无法解析故障: {spec}（类型: {', '.join(FAULT_KINDS)}）")
+    kind, seconds, at, count = match.groups()
+    return Fault(float(at or 1800), kind, float(seconds or 0), int(count or 1))
+
+
+class _InstantSelector:
+    """select 不真正等待，而是把虚拟时间推进到下一个定时器"""
+
+    def __init__(self, selector, loop):
+        self._selector = selector
+        self._loop = loop
+
+    def select(self, timeout=None):
+        if timeout:
+            self._loop.advance(timeout)
+        return self._selector.select(0)
+
+    def __getattr__(self, name):
+        return getattr(self._selector, name)
+
+
+class VirtualTimeLoop(asyncio.SelectorEventLoop):
+    """虚拟时间事件循环：没有就绪任务时直接跳到下一个定时器，几小时的退避在几秒内跑完"""
+
+    def __init__(self, start):
+        super().__init__()
+        self._now = float(start)
+        self._selector = _InstantSelector(self._selector, self)
+        # Unix 时间戳量级下浮点精度约 1e-7 秒，默认的纳秒级分辨率会让到期的定时器永远取不出来
+        self._clock_resolution = 1e-3
+
+    def time(self):
+        return self._now
+
+    def advance(self, seconds):
+        self._now += seconds
+
+
+class LoopClock(SystemClock):
+    """以事件循环时间为准的时钟，注入转发器后限流、冷却和队列都在虚拟时间中运行"""
+
+    def __init__(self, loop):
+        self.loop = loop
+
+    def time(self):
+        return self.loop.time()
+
+    def monotonic(self):
+        return self.loop.time()
+
+
+class SourceChat:
+    def __init__(self, chat_id, username):
+        self.id = chat_id
+        self.username = username
+        self.noforwards = False
+
+
+class SentMessage:
+    def __init__(self, msg_id):
+        self.id = msg_id
+
+
+class FaultyClient:
+    """替身 Telegram 客户端：按计划注入故障，记录每次成功投递"""
+
+    def __init__(self, loop):
+        self.loop = loop
+        self.connected = True
+        self.down_until = 0.0
+        self._disconnected = loop.create_future()  # 与 Telethon 一样，断线时完成
+        self._armed = []  # [[类型, 秒数, 剩余次数]]
+        self.fired = []  # (时间, 类型)
+        self.delivered = []  # (时间, 文本)
+        self._next_id = 1
+
+    def arm(self, kind, seconds, count):
+        self._armed.append([kind, seconds, count])
+
+    def drop(self, seconds):
+        """断线 seconds 秒，期间 connect() 失败"""
+        self.down_until = self.loop.time() + seconds
+        self.fired.append((self.loop.time(), "disconnect"))
+        self._set_disconnected()
+
+    def _set_disconnected(self):
+        self.connected = False
+        if not self._disconnected.done():
+            self._disconnected.set_result(None)
+
+    @property
+    def disconnected(self):
+        return asyncio.shield(self._disconnected)
+
+    def is_connected(self):
+        return self.connected
+
+    async def connect(self):
+        if self.loop.time() < self.down_until:
+            raise ConnectionError("模拟断线中")
+        self.connected = True
+        if self._disconnected.done():
+            self._disconnected = self.loop.create_future()
+
+    async def disconnect(self):
+        self._set_disconnected()
+
+    async def _request(self, plain=False):
+        """一次请求：断线时失败，否则触发下一个待注入的故障"""
+        if not self.connected:
+            raise ConnectionError("连接已断开")
+        if not self._armed:
+            return
+        kind, seconds, _ = fault = self._armed[0]
+        if kind == "invalid_bounds" and plain:
+            # 纯文本重试不带实体，不会再遇到实体边界错误
+            return
+        fault[2] -= 1
+        if fault[2] <= 0:
+            self._armed.pop(0)
+        self.fired.append((self.loop.time(), kind))
+        if kind == "slow":
+            await asyncio.sleep(seconds)
+        elif kind == "flood":
+            raise FloodWaitError(request=None, capture=int(seconds))
+        elif kind == "peer_flood":
+            raise PeerFloodError(request=None)
+        elif kind == "invalid_bounds":
+            raise EntityBoundsInvalidError(request=None)
+        elif kind == "banned":
+            raise UserBannedInChannelError(request=None)
+        elif kind == "forbidden":
+            raise RPCError(request=None, message="CHAT_WRITE_FORBIDDEN", code=403)
+
+    def _deliver(self, text):
+        self.delivered.append((self.loop.time(), text))
+        self._next_id += 1
+        return SentMessage(self._next_id)
+
+    async def send_message(self, entity, message, formatting_entities=None, **kwargs):
+        await self._request(plain=formatting_entities == [])
+        return self._deliver(message)
+
+    async def send_file(self, entity, file, caption=None, **kwargs):
+        await self._request()
+        return self._deliver(caption or "")
+
+    async def forward_messages(self, entity, messages, from_peer=None):
+        await self._request()
+        ids = messages if isinstance(messages, list) else [messages]
+        return [self._deliver(f"#{msg_id}") for msg_id in ids]
+
+    async def edit_message(self, entity, message, text, **kwargs):
+        await self._request()
+        return SentMessage(message)
+
+    async def get_input_entity(self, entity):
+        return entity
+
+    async def get_messages(self, entity, ids=None, **kwargs):
+        return []
+
+    async def download_media(self, message, file=None):
+        return file
+
+
+class FaultInjectionForwarder(forward_bot.MessageForwarder):
+    """使用替身客户端的转发器"""
+
+    def __init__(self, user_client, bot_client, clock):
+        self._stand_ins = (user_client, bot_client)
+        self.pauses = 0
+        super().__init__(clock=clock)
+
+    def _setup_clients(self):
+        self.user_client, self.bot_client = self._stand_ins
+
+    def pause_until_work_time(self):
+        self.pauses += 1
+        super().pause_until_work_time()
+
+
+def make_message(number, timestamp):
+    text = f"招聘 远程 Python 开发工程师 #{number} 全职 薪资面议 联系 @hr_{number}"
+    message = Message(id=number, peer_id=PeerChannel(SOURCE_CHAT_ID),
+                      date=datetime.fromtimestamp(timestamp, timezone.utc), message=text)
+    message.text = text
+    chat = SourceChat(SOURCE_CHAT_ID, SOURCE_CHANNEL[1:])
+
+    async def get_chat():
+        return chat
+
+    message.get_chat = get_chat
+    return message
+
+
+def reset_data_dir():
+    """每个场景从空的状态文件开始（不恢复上一个场景的限流账本）"""
+    for name in os.listdir(forward_bot.DATA_DIR):
+        path = os.path.join(forward_bot.DATA_DIR, name)
+        shutil.rmtree(path) if os.path.isdir(path) else os.remove(path)
+
+
+async def run_scenario(faults, messages, interval, horizon, seed):
+    loop = asyncio.get_running_loop()
+    start = loop.time()
+    reset_data_dir()
+    user, bot = FaultyClient(loop), FaultyClient(loop)
+    forwarder = FaultInjectionForwarder(user, bot, LoopClock(loop))
+    rng = random.Random(seed)
+    forwarder.anti_ban_strategies.rng = rng
+    for supervisor in forwarder.supervisors:
+        supervisor.rng = rng
+
+    for fault in faults:
+        if fault.kind == "disconnect":
+            loop.call_at(start + fault.at, bot.drop, fault.seconds)
+        else:
+            loop.call_at(start + fault.at, bot.arm, fault.kind, fault.seconds, fault.count)
+
+    forwarder.sender_task = loop.create_task(forwarder._send_loop())
+    tasks = [forwarder.sender_task, *[loop.create_task(supervisor.run()) for supervisor in forwarder.supervisors]]
+
+    arrivals = []
+    for number in range(1, messages + 1):
+        at = start + (number - 1) * interval + rng.uniform(0, interval / 2)
+        arrivals.append(at)
+        await asyncio.sleep(max(0.0, at - loop.time()))
+        forwarder._spawn_accept(make_message(number, loop.time()), SOURCE_CHANNEL)
+
+    # 所有消息都已投递或到达观察期结束
+    while loop.time() < start + horizon:
+        delivered = {int(m) for _, text in bot.delivered + user.delivered for m in MARKER.findall(text)}
+        if len(delivered) >= messages and not forwarder.admission_queue and forwarder.delivering is None:
+            break
+        await asyncio.sleep(60)
+
+    for task in tasks:
+        task.cancel()
+    await asyncio.gather(*tasks, *forwarder.resume_tasks, return_exceptions=True)
+    forwarder.journal.close()
+    forwarder.stats_store.close()
+    if forwarder.anti_ban_strategies.ledger:
+        forwarder.anti_ban_strategies.ledger.close()
+
+    deliveries = sorted((at, int(number)) for at, text in bot.delivered + user.delivered
+                        for number in MARKER.findall(text))
+    counts = Counter(number for _, number in deliveries)
+    fired = sorted(bot.fired)
+    recovery = None
+    if fired:
+        # 第一次故障发生到所有故障发生后的第一次成功投递
+        after = [at for at, _ in deliveries if at >= fired[-1][0]]
+        recovery = round(after[0] - fired[0][0], 1) if after else None
+    return {
+        'faults_fired': len(fired),
+        'recovery_s': recovery,
+        'delivered': len(counts),
+        'lost': messages - len(counts),
+        'duplicated': sum(count - 1 for count in counts.values()),
+        'drain_s': round(deliveries[-1][0] - start, 1) if deliveries else None,
+        'max_latency_s': round(max((at - arrivals[number - 1] for at, number in deliveries), default=0), 1),
+        'failed_events': sum(count for (_, event), count in forwarder.journal.counts.items() if event == 'failed'),
+        'delay_multiplier': round(forwarder.anti_ban_strategies.current_delay_multiplier, 2),
+        'paused': forwarder.pauses > 0,
+        'gate_closed_s': round(forwarder.send_gate.stats['closed_seconds'] + forwarder.send_gate.remaining(), 1),
+    }
+
+
+def run(faults, messages, interval, horizon, seed):
+    """在新的虚拟时间事件循环中运行一个场景"""
+    loop = VirtualTimeLoop(START)
+    try:
+        return loop.run_until_complete(run_scenario(faults, messages, interval, horizon, seed))
+    finally:
+        loop.close()
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="发送流程故障注入")
+    parser.add_argument("--scenario", action="append", choices=list(SCENARIOS),
+                        help="运行的内置场景（可重复，默认全部）")
+    parser.add_argument("--fault", action="append", type=parse_fault, default=[],
+                        help="自定义场景的故障 kind[:seconds][@at][xcount]（可重复，组成一个场景）")
+    parser.add_argument("--messages", type=int, default=30, help="每个场景的源消息数")
+    parser.add_argument("--interval", type=float, default=360, help="消息平均到达间隔（秒）")
+    parser.add_argument("--horizon", type=float, default=24 * 3600, help="每个场景的最长观察时间（秒）")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="输出JSON")
+    parser.add_argument("--verbose", action="store_true", help="输出转发器日志")
+    args = parser.parse_args(argv)
+
+    logger.remove()
+    if args.verbose:
+        logger.add(sys.stderr, level="INFO")
+
+    scenarios = {name: SCENARIOS[name] for name in args.scenario or ([] if args.fault else SCENARIOS)}
+    if args.fault:
+        scenarios['custom'] = args.fault
+
+    results = {name: run(faults, args.messages, args.interval, args.horizon, args.seed)
+               for name, faults in scenarios.items()}
+
+    if args.json:
+        print(json.dumps(results, ensure_ascii=False, indent=2))
+        return
+    print(f"{args.messages} 条消息，平均间隔 {args.interval:g} 秒，观察 {args.horizon / 3600:g} 小时（虚拟时间）")
+    header = (f"{'场景':<16}{'故障':>5}{'恢复(秒)':>10}{'投递':>6}{'丢失':>6}{'重复':>6}"
+              f"{'排空(秒)':>10}{'最大延迟':>10}{'失败':>6}{'延迟倍数':>9}{'暂停':>6}{'闸门关闭(秒)':>12}")
+    print(header)
+    for name, result in results.items():
+        print(f"{name:<16}{result['faults_fired']:>5}{result['recovery_s'] if result['recovery_s'] is not None else '-':>10}"
+              f"{result['delivered']:>6}{result['lost']:>6}{result['duplicated']:>6}"
+              f"{result['drain_s'] if result['drain_s'] is not None else '-':>10}{result['max_latency_s']:>10}"
+              f"{result['failed_events']:>6}{result['delay_multiplier']:>9}{'是' if result['paused'] else '否':>6}"
+              f"{result['gate_closed_s']:>12}")
+
+
+if __name__ == "__main__":
+    main()
@@ -13,12 +13,29 @@ from loguru import logger
 from dotenv import load_dotenv
 from telethon.errors import FloodWaitError, PeerFloodError
 from anti_ban_config import AntiBanConfig, AntiBanStrategies
+from clock import SystemClock
+from message_map import MessageMap, text_hash
+from media_prefetch import MediaPrefetcher
+from delivery_cache import DeliveryCapabilityCache, FORWARD, is_capability_error
+from rate_ledger import RateLedger
+from pending_store import PendingCheckpoint
+from journal import ForwardJournal
+from tracing import StageTracer
+from admission import AdmissionQueue, PostScorer
+from jobs import PostJob, DigestJob, DigestEntry, BatchJob
+from digest import DigestBuffer, summarize
+from pipeline import FilterPipeline, COST_CPU, COST_CACHE, COST_NETWORK
+from gap_tracker import GapTracker
+from polling import PollingIngestor
+from connection_supervisor import ConnectionSupervisor
+from scheduler import TimerScheduler
+from spam_classifier import SpamClassifier
+from send_gate import SendGate
+from stats_store import StatsStore, CounterDeltas, ALL_CHANNELS, RESOLUTIONS, parse_time
+from link_policy import DomainPolicyIndex, TelegramLinkResolver, telegram_username, ALLOW, DENY, SKIP_CHECK
 import queue
 import threading
-from flask import Flask, jsonify
 import nest_asyncio
-from waitress import serve
-import aiohttp
 import random
 import json
 from urllib.parse import urlparse
@@ -42,89 +59,166 @@ SOURCE_CHANNELS = ['@CHATROOMA777', '@bqs666',
                    "@remote_cn", "@yuanchenggongzuoOB", "@taiwanjobstreet", "@MLXYZP"
                    ]
 
+# 轮询拉取的源频道（账号无需加入，不走推送），逗号分隔，例如 "@remote_cn,@yuancheng_job"
+POLL_CHANNELS = [channel.strip() for channel in os.getenv("POLL_CHANNELS", "").split(",") if channel.strip()]
+POLL_REQUESTS_PER_HOUR = int(os.getenv("POLL_REQUESTS_PER_HOUR", 120))
+
 TARGET_CHANNEL = ["@CHATROOMA999"]
 KEYWORDS_CHANNEL_1 = ["@miaowu333"]
 KEYWORDS_CHANNEL_2 = ["@yuancheng5551"]
 LOGS_CHANNEL = ["@logsme333"]
 
-# Flask 应用
-app = Flask(__name__)
-app.config.update(
-    ENV='production',
-    DEBUG=False,
-    TESTING=False,
-    SECRET_KEY=os.urandom(24)
-)
-
+# 本地状态文件目录
+DATA_DIR = os.getenv("DATA_DIR", "data")
+MESSAGE_MAP_FILE = os.path.join(DATA_DIR, "message_map.json")
+RATE_LEDGER_FILE = os.path.join(DATA_DIR, "rate_ledger.jsonl")
+PENDING_FILE = os.path.join(DATA_DIR, "pending.json")
+POLL_STATE_FILE = os.path.join(DATA_DIR, "poll_watermarks.json")
+JOURNAL_DIR = os.path.join(DATA_DIR, "journal")
+STATS_DB_FILE = os.path.join(DATA_DIR, "stats.sqlite3")
+# 垃圾消息分类模型（spam_classifier.py train 生成，文件更新后自动重新加载）
+SPAM_MODEL_FILE = os.path.join(DATA_DIR, "spam_model.json")
+
+# 历史统计采样间隔（秒）
+STATS_INTERVAL = float(os.getenv("STATS_INTERVAL", 60))
+
+# 收到SIGTERM后的最长关闭时间（秒），Render 默认给30秒
+SHUTDOWN_DEADLINE = float(os.getenv("SHUTDOWN_DEADLINE", 20))
+
+# 单条消息处理耗时（不含排队等待）超过该值（秒）时输出阶段明细
+SLOW_MESSAGE_THRESHOLD = float(os.getenv("SLOW_MESSAGE_THRESHOLD", 180))
+
+# 分阶段耗时统计（状态接口和转发器共用）
+stage_tracer = StageTracer(slow_threshold=SLOW_MESSAGE_THRESHOLD)
+
+# 发现消息ID缺口后等待多久再补拉（秒），以及单个缺口最多补拉的消息数
+GAP_FILL_DELAY = float(os.getenv("GAP_FILL_DELAY", 5))
+GAP_FILL_MAX = int(os.getenv("GAP_FILL_MAX", 100))
+
+# 媒体预取内存上限（字节），超出部分落盘；落盘总上限（字节）；只为队列中价值最高的前 N 条消息预取
+MEDIA_PREFETCH_MAX_MEMORY = int(os.getenv("MEDIA_PREFETCH_MAX_MEMORY", 32 * 1024 * 1024))
+MEDIA_PREFETCH_MAX_SPILL = int(os.getenv("MEDIA_PREFETCH_MAX_SPILL", 256 * 1024 * 1024))
+MEDIA_PREFETCH_TOP_N = int(os.getenv("MEDIA_PREFETCH_TOP_N", 5))
+
+# 发送端传输方式：mtproto 使用 Telethon Bot客户端，http 使用 Bot HTTP API（BOT_API_URL 可指向自建的 Bot API 服务）
+BOT_TRANSPORT = os.getenv("BOT_TRANSPORT", "mtproto").lower()
+BOT_API_URL = os.getenv("BOT_API_URL")  # 不设置时使用官方 Bot API
+
+
+def create_app():
+    """创建 Flask 应用（Flask 只在启动Web服务时导入，不拖慢冷启动）"""
+    from flask import Flask, jsonify, request
+
+    app = Flask(__name__)
+    app.config.update(
+        ENV='production',
+        DEBUG=False,
+        TESTING=False,
+        SECRET_KEY=os.urandom(24)
+    )
 
-@app.route('/')
-def home():
-    from flask import jsonify
-    return jsonify({
-        'status': 'success',
-        'message': 'Telegram Bot is running!',
-        'timestamp': datetime.now(beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
-    }), 200
+    @app.route('/')
+    def home():
+        return jsonify({
+            'status': 'success',
+            'message': 'Telegram Bot is running!',
+            'timestamp': datetime.now(beijing_tz).strftime('%Y-%m-%d %H:%M:%S')
+        }), 200
+
+    @app.route('/stats/stages')
+    def stage_stats():
+        """各处理阶段耗时的 p50/p95/p99 和最近的慢消息"""
+        return jsonify({
+            'stages': stage_tracer.percentiles(),
+            'slow_messages': list(stage_tracer.slow_messages),
+        }), 200
+
+    # 历史统计的只读连接：首次查询时打开（数据库由转发器创建），之后各请求加锁复用
+    stats_reader = {}
+    stats_lock = threading.Lock()
+
+    @app.route('/stats/series')
+    def stats_series():
+        """历史统计时间序列：?channel=@x&metric=sent&since=2024-05-01&until=...&resolution=hour"""
+        args = request.args
+        try:
+            since = parse_time(args.get('since')) if args.get('since') else time.time() - 86400
+            until = parse_time(args.get('until'))
+            resolution = RESOLUTIONS.get(args.get('resolution'))
+        except ValueError as e:
+            return jsonify({'status': 'error', 'message': str(e)}), 400
+        if not os.path.exists(STATS_DB_FILE):
+            return jsonify({'channel': args.get('channel', ALL_CHANNELS), 'series': {}}), 200
+        with stats_lock:
+            if 'store' not in stats_reader:
+                stats_reader['store'] = StatsStore(STATS_DB_FILE, readonly=True)
+            series = stats_reader['store'].series(args.get('channel', ALL_CHANNELS), args.get('metric'),
+                                                  since, until, resolution)
+        return jsonify({'channel': args.get('channel', ALL_CHANNELS), 'series': series}), 200
+
+    return app
 
 
 def run_flask():
     """运行生产级别的 Flask 服务器"""
+    app = create_app()
+    # 使用环境变量中的端口，如果没有则默认使用3000
+    port = int(os.getenv('PORT', 3000))
     try:
-        # 使用环境变量中的端口，如果没有则默认使用3000
-        port = int(os.getenv('PORT', 3000))
+        from waitress import serve
         serve(app, host='0.0.0.0', port=port, threads=2)
     except Exception as e:
         logger.error(f"Flask 服务器启动失败: {e}")
         # 如果 waitress 失败，回退到开发服务器
-        port = int(os.getenv('PORT', 3000))
         app.run(host='0.0.0.0', port=port)
 
 
 def patcher(record):
-    beijing_now = datetime.now(
-        pytz.timezone("Asia/Shanghai")).strftime("%m-%d %H:%M:%S")
+    beijing_now = datetime.now(beijing_tz).strftime("%m-%d %H:%M:%S")
     record["extra"]["beijing_time"] = beijing_now
 
 
-# 清除默认 logger
-logger.remove()
+def setup_logging():
+    """配置控制台和文件日志（在 main 中调用，导入模块时不创建日志目录和写入线程）"""
+    # 清除默认 logger
+    logger.remove()
 
-# 设置 patcher（动态注入北京时间）
-logger = logger.patch(patcher)
+    # 设置 patcher（动态注入北京时间，对所有模块的日志生效）
+    logger.configure(patcher=patcher)
 
-try:
-    # 控制台日志输出
-    logger.add(
-        sys.stderr,
-        format="<green>{extra[beijing_time]}</green> | <level>{level:<8}</level> | "
-               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
-        level="INFO",
-        enqueue=True,
-        catch=True,
-        diagnose=True
-    )
+    try:
+        # 控制台日志输出
+        logger.add(
+            sys.stderr,
+            format="<green>{extra[beijing_time]}</green> | <level>{level:<8}</level> | "
+                   "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>",
+            level="INFO",
+            enqueue=True,
+            catch=True,
+            diagnose=True
+        )
+
+        # 创建日志文件夹
+        os.makedirs("logs", exist_ok=True)
+
+        # 文件日志输出（转发记录以结构化流水为准，文本日志默认只写INFO）
+        logger.add(
+            "logs/hrbot_{time:YYYY-MM-DD}.log",
+            rotation="00:00",
+            retention="3 days",
+            compression="gz",
+            level=os.getenv("LOG_FILE_LEVEL", "INFO"),
+            encoding="utf-8",
+            enqueue=True,
+            catch=True,
+            diagnose=False,
+            format="<green>{extra[beijing_time]}</green> | <level>{level:<8}</level> | "
+                   "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
+        )
+    except Exception as e:
+        print(f"日志配置出错: {e}")
+        logger.add(sys.stderr, level="INFO", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
 
-    # 创建日志文件夹
-    os.makedirs("logs", exist_ok=True)
-    beijing_now_str = datetime.now(
-        pytz.timezone("Asia/Shanghai")).strftime("%m-%d//%H:%M")
-
-    # 文件日志输出
-    logger.add(
-        f"logs/hrbot_{beijing_now_str}.log",
-        rotation="300 MB",
-        retention="3 days",
-        level="DEBUG",
-        encoding="utf-8",
-        enqueue=True,
-        catch=True,
-        diagnose=True,
-        format="<green>{extra[beijing_time]}</green> | <level>{level:<8}</level> | "
-               "<cyan>{name}</cyan>:<cyan>{function}</cyan>:<cyan>{line}</cyan> - <level>{message}</level>"
-    )
-except Exception as e:
-    print(f"日志配置出错: {e}")
-    logger.add(sys.stderr, level="INFO", format="{time:YYYY-MM-DD HH:mm:ss} | {level} | {message}")
 
 # 全局日志处理器实例
 telegram_log_handler = None
@@ -141,47 +235,35 @@ def telegram_log_sink(message):
 
 # 自定义Telegram日志处理器
 class TelegramLogHandler:
-    def __init__(self, client, channel):
+    def __init__(self, client, channel, gate=None, scheduler=None):
         self.client = client  # Bot客户端
         self.channel = channel
+        self.gate = gate  # 发送闸门，关闭期间日志留在批次中
+        self.scheduler = scheduler  # 批量发送和队列清理都注册为定时任务，没有日志时不唤醒
         self.log_queue = queue.Queue()
         self.is_running = False
         self.batch_size = 5  # 每次发送的最大日志条数
         self.batch_timeout = 3  # 批量发送超时时间（秒）
-        self.last_send_time = time.time()
-        self.cleaner_thread = None
-        self.last_cleanup_time = time.time()
+        self.max_retry_delay = 300  # 发送失败后指数退避的上限（秒）
+        self.failures = 0  # 连续发送失败次数
+        self.retry_at = 0.0  # 退避结束前不再尝试发送
+        self.loop = None
+        self.flush_task = None  # 正在进行的批量发送（停止时先等待其结束）
+        self.batch_logs = []  # 当前批次（停止时由 stop() 发送）
 
     async def start(self):
         """启动日志发送器"""
         try:
             self.is_running = True
+            self.loop = asyncio.get_running_loop()
 
-            # 启动日志发送任务
-            asyncio.create_task(self._send_logs())
-
-            # 启动清理线程
-            self.cleaner_thread = threading.Thread(target=self._run_cleaner, daemon=True)
-            self.cleaner_thread.start()
+            # 每4小时清理一次日志队列
+            self.scheduler.every('log_cleanup', 14400, self._cleanup_old_logs)
 
             # logger.info("Telegram日志处理器启动成功")
         except Exception as e:
             logger.error(f"启动Telegram日志处理器失败: {e}")
 
-    def _run_cleaner(self):
-        """定期清理日志队列"""
-        while self.is_running:
-            try:
-                current_time = time.time()
-                # 每4小时清理一次
-                if current_time - self.last_cleanup_time > 14400:
-                    self._cleanup_old_logs()
-                    self.last_cleanup_time = current_time
-                time.sleep(600)  # 每10分钟检查一次
-            except Exception as e:
-                logger.error(f"日志清理器出错: {e}")
-                time.sleep(600)
-
     def _cleanup_old_logs(self):
         """清理队列中的旧日志"""
         try:
@@ -203,54 +285,86 @@ class TelegramLogHandler:
         except Exception as e:
             logger.error(f"清理日志队列时出错: {e}")
 
-    async def _send_logs(self):
-        """发送日志消息到Telegram频道"""
-        logger.debug("日志发送任务已启动")
-        batch_logs = []
-        while self.is_running:
+    def _drain_queue(self):
+        """把队列中的日志移入当前批次"""
+        while True:
             try:
-                # 尝试从队列获取消息
-                try:
-                    # 立即获取所有可用的消息
-                    while True:
-                        message = self.log_queue.get_nowait()
-                        batch_logs.append(message)
-                        logger.debug(f"从队列获取到消息，当前批次大小: {len(batch_logs)}")
-                except queue.Empty:
-                    # 队列为空时继续处理
-                    if batch_logs:
-                        logger.debug(f"队列为空，当前批次中有 {len(batch_logs)} 条消息待发送")
-                    pass
-
-                current_time = time.time()
-                # 如果有日志且(达到批次大小或超过超时时间)，则发送
-                if batch_logs and (len(batch_logs) >= self.batch_size or
-                                   current_time - self.last_send_time > self.batch_timeout):
-                    try:
-                        logger.debug(f"准备发送 {len(batch_logs)} 条日志消息")
-                        # 组合日志消息
-                        combined_message = "📋 **系统日志**\n```\n"
-                        combined_message += "\n".join(batch_logs)
-                        combined_message += "\n```"
-
-                        if self.client and self.client.is_connected():
-                            await self.client.send_message(self.channel, combined_message)
-                            logger.debug(f"成功发送了 {len(batch_logs)} 条日志消息")
-                            self.last_send_time = current_time
-                            batch_logs = []
-                    except Exception as e:
-                        logger.error(f"发送日志到Telegram失败: {e}")
-                        await asyncio.sleep(2)
-
-                # 短暂等待后继续检查
-                await asyncio.sleep(0.5)
+                self.batch_logs.append(self.log_queue.get_nowait())
+            except queue.Empty:
+                return
 
-            except Exception as e:
-                logger.error(f"日志处理器出错: {e}")
-                await asyncio.sleep(2)
+    @staticmethod
+    def _split_batches(logs):
+        """按Telegram消息长度限制分批"""
+        batches, current = [], []
+        for log in logs:
+            if current and sum(len(line) + 1 for line in current) + len(log) > 3900:
+                batches.append(current)
+                current = []
+            current.append(log[:3900])
+        if current:
+            batches.append(current)
+        return batches
+
+    def _request_flush(self):
+        """安排一次批量发送：攒够一批立即发送，否则等待 batch_timeout 秒合并后发送"""
+        if not self.is_running:
+            return
+        now = self.scheduler.clock.time()
+        if self.gate and not self.gate.is_open:
+            # 闸门关闭期间日志继续累积，重新打开时再发
+            when = self.gate.deadline or now + self.batch_timeout
+        elif not (self.client and self.client.is_connected()):
+            # 断线期间每隔 batch_timeout 秒检查一次，不立即重试
+            when = now + self.batch_timeout
+        elif self.log_queue.qsize() + len(self.batch_logs) >= self.batch_size:
+            when = now
+        else:
+            when = now + self.batch_timeout
+        # 发送失败后的退避期内，新日志不会让发送提前
+        self.scheduler.at('log_flush', max(when, self.retry_at), self._flush)
+
+    async def _flush(self):
+        """发送当前批次的日志到Telegram频道"""
+        if self.flush_task is not None and not self.flush_task.done():
+            return  # 上一次发送还没结束，结束后会重新安排
+        if self.gate and not self.gate.is_open:
+            self._request_flush()
+            return
+        self.flush_task = asyncio.current_task()
+        try:
+            self._drain_queue()
+            if self.batch_logs and self.client and self.client.is_connected():
+                logger.debug(f"准备发送 {len(self.batch_logs)} 条日志消息")
+                for batch in self._split_batches(self.batch_logs):
+                    combined_message = "📋 **系统日志**\n```\n"
+                    combined_message += "\n".join(batch)
+                    combined_message += "\n```"
+                    await self.client.send_message(self.channel, combined_message)
+                    del self.batch_logs[:len(batch)]
+                self.failures, self.retry_at = 0, 0.0
+                logger.debug("日志消息发送完成")
+        except FloodWaitError as e:
+            logger.error(f"发送日志到Telegram遇到频率限制: {e}")
+            if self.gate:
+                self.gate.hold(e.seconds, 'flood_wait')
+            self._back_off(e.seconds)
+        except Exception as e:
+            logger.error(f"发送日志到Telegram失败: {e}")
+            self._back_off()
+        finally:
+            self.flush_task = None
+        if self.batch_logs or not self.log_queue.empty():
+            self._request_flush()
+
+    def _back_off(self, min_delay=0):
+        """发送失败：按连续失败次数指数退避（2、4、8…秒，不超过 max_retry_delay）"""
+        self.failures += 1
+        delay = max(min_delay, min(2 ** self.failures, self.max_retry_delay))
+        self.retry_at = self.scheduler.clock.time() + delay
 
     def send_log(self, message):
-        """添加日志消息到队列"""
+        """添加日志消息到队列，并安排批量发送（可能从 Flask 线程调用）"""
         try:
             # 格式化日志消息
             formatted_message = message.rstrip('\n')
@@ -258,47 +372,62 @@ class TelegramLogHandler:
             logger.debug(f"日志已加入队列，当前队列大小: {self.log_queue.qsize()}")
         except queue.Full:
             logger.error("日志队列已满，消息丢失")
+            return
+        if self.loop is not None and not self.loop.is_closed():
+            self.loop.call_soon_threadsafe(self._request_flush)
 
-    def stop(self):
-        """停止日志发送器"""
+    async def stop(self, timeout=5):
+        """停止日志发送器，并在当前事件循环中发送剩余日志"""
         self.is_running = False
-        if self.cleaner_thread and self.cleaner_thread.is_alive():
-            self.cleaner_thread.join(timeout=1)
+        self.scheduler.cancel('log_flush')
+        self.scheduler.cancel('log_cleanup')
+        if self.flush_task and not self.flush_task.done():
+            try:
+                await asyncio.wait_for(self.flush_task, timeout=1)
+            except (asyncio.TimeoutError, asyncio.CancelledError):
+                pass
 
         # 发送剩余的日志
-        if hasattr(self, 'client') and self.client and self.client.is_connected():
-            remaining_logs = []
-            while not self.log_queue.empty():
-                try:
-                    remaining_logs.append(self.log_queue.get_nowait())
-                except queue.Empty:
-                    break
+        self._drain_queue()
+        remaining_logs = list(self.batch_logs)
+        self.batch_logs.clear()
+
+        if not remaining_logs or not self.client or not self.client.is_connected():
+            return
 
-            if remaining_logs:
+        batches = self._split_batches(remaining_logs)
+
+        async def send_final_logs():
+            if self.gate:
+                await self.gate.wait()
+            for batch in batches:
                 combined_message = "📋 **系统日志（最终批次）**\n```\n"
-                combined_message += "\n".join(remaining_logs)
+                combined_message += "\n".join(batch)
                 combined_message += "\n```"
+                await self.client.send_message(self.channel, combined_message)
 
-                async def send_final_logs():
-                    try:
-                        await self.client.send_message(self.channel, combined_message)
-                    except Exception as e:
-                        logger.error(f"发送最终日志批次失败: {e}")
-
-                # 创建新的事件循环来发送最后的日志
-                loop = asyncio.new_event_loop()
-                asyncio.set_event_loop(loop)
-                loop.run_until_complete(send_final_logs())
-                loop.close()
+        try:
+            await asyncio.wait_for(send_final_logs(), timeout)
+        except Exception as e:
+            logger.error(f"发送最终日志批次失败: {e}")
 
 
 class MessageForwarder:
-    def __init__(self):
+    def __init__(self, clock=None):
+        # 限流、队列、缺口补拉和发送调度共用的时钟（故障注入测试中注入虚拟时钟）
+        self.clock = clock if clock is not None else SystemClock()
         self.api_id = int(os.getenv("API_ID"))
         self.api_hash = os.getenv("API_HASH")
         self.bot_token = os.getenv("BOT_TOKEN")
         self.anti_ban_config = AntiBanConfig()
-        self.anti_ban_strategies = AntiBanStrategies()
+        self.anti_ban_strategies = AntiBanStrategies(clock=self.clock)
+        # 发送闸门：频率限制、冷却和暂停期间所有发送方在此等待，截止时间到达时一起恢复
+        self.send_gate = SendGate(self.clock, on_open=self._on_gate_open)
+        # 恢复上次运行的限流和退避状态
+        restored = self.anti_ban_strategies.attach_ledger(RateLedger(RATE_LEDGER_FILE))
+        if restored:
+            logger.info(f"已从账本恢复限流状态: 最近一天发送 {len(restored['sends'])} 条，"
+                        f"延迟倍数 {restored['multiplier']:.2f}，连续错误 {restored['consecutive_errors']}")
         self.source_channels = SOURCE_CHANNELS
         self.target_channel = TARGET_CHANNEL
         self.user_client = None
@@ -309,11 +438,60 @@ class MessageForwarder:
         self.processed_messages = set()
         self.message_lock = asyncio.Lock()
         self.telegram_log_handler = None
-        self.start_time = datetime.now(pytz.timezone("Asia/Shanghai"))
+        self.start_time = datetime.now(beijing_tz)
         self.last_message_received = None
         self.total_messages_processed = 0
         self.running = True
+        self.stopped = asyncio.Event()  # 收到停止信号时设置
         self.tasks = []
+        # 周期任务（状态报告、统计、摘要、缺口补拉、日志发送）统一注册到一个定时器堆
+        self.scheduler = TimerScheduler(self.clock)
+
+        # 源消息到转发消息的映射（用于同步编辑）
+        self.message_map = MessageMap(MESSAGE_MAP_FILE)
+        self.message_map.load()
+        self.edits_synced = 0
+        self.edits_skipped = 0
+
+        # 各源频道媒体投递方式的可用性缓存
+        self.delivery_cache = DeliveryCapabilityCache()
+
+        # 正在处理的消息（用于关闭时排空和写检查点）
+        self.accepting = True
+        self.inflight = {}
+        self.late_arrivals = []
+        self.resume_tasks = set()
+        self.pending_checkpoint = PendingCheckpoint(PENDING_FILE)
+
+        # 源频道消息ID缺口（重连期间丢失的更新）
+        self.gap_tracker = GapTracker(GAP_FILL_DELAY, GAP_FILL_MAX, clock=self.clock)
+        self.cleaned_up = False
+
+        # 发送队列：按消息价值和新鲜度决定发送顺序
+        self.admission_queue = AdmissionQueue(self.anti_ban_config.ADMISSION_QUEUE_SIZE,
+                                              self.anti_ban_config.ADMISSION_MAX_AGE,
+                                              self.anti_ban_config.FRESHNESS_HALF_LIFE, clock=self.clock)
+        self.post_scorer = PostScorer(self.anti_ban_config)
+        self.spam_classifier = SpamClassifier(SPAM_MODEL_FILE, clock=self.clock)
+        self.spam_classifier.maybe_reload()
+        self.pipeline = self._build_pipeline()
+        self.sender_task = None
+        self.delivering = None
+        self.batch_stats = {'batches': 0, 'messages': 0, 'rpc_saved': 0}
+        self.send_attempts = {}  # 任务键 -> 已失败的发送次数（放回队列重试期间）
+
+        # 摘要模式（可选）：低价值消息合并发送
+        self.digest_buffer = (DigestBuffer(self.anti_ban_config.DIGEST_WINDOW, self.anti_ban_config.DIGEST_MAX_POSTS,
+                                           clock=self.clock)
+                              if self.anti_ban_config.DIGEST_ENABLED else None)
+
+        # 结构化转发流水
+        self.journal = ForwardJournal(JOURNAL_DIR)
+        self.tracer = stage_tracer
+
+        # 历史统计（定期采样写入 SQLite）
+        self.stats_store = StatsStore(STATS_DB_FILE)
+        self.stats_deltas = CounterDeltas()
 
         # User-Agent池
         self.user_agents = [
@@ -375,6 +553,26 @@ class MessageForwarder:
 
         self._setup_clients()
 
+        # 媒体预取（用户客户端下载，Bot客户端上传）
+        self.media_prefetcher = MediaPrefetcher(self.user_client, max_memory_bytes=MEDIA_PREFETCH_MAX_MEMORY,
+                                                max_spill_bytes=MEDIA_PREFETCH_MAX_SPILL)
+
+        # 链接检查：域名策略先行，t.me 链接通过用户客户端检查
+        self.domain_policy = DomainPolicyIndex(self.anti_ban_config.DOMAIN_ALLOW,
+                                               self.anti_ban_config.DOMAIN_DENY,
+                                               self.anti_ban_config.DOMAIN_SKIP_CHECK)
+        self.telegram_links = TelegramLinkResolver(self.user_client)
+
+        # 客户端连接监控（断线重连，断线期间暂停发送）；HTTP 传输没有长连接，每次请求独立，不需要监控
+        self.supervisors = [ConnectionSupervisor("用户客户端", self.user_client, clock=self.clock)]
+        if BOT_TRANSPORT != "http":
+            self.supervisors.append(ConnectionSupervisor("Bot客户端", self.bot_client, clock=self.clock))
+
+        # 轮询拉取的源频道，拉到的消息和推送消息走同一处理流程
+        self.poller = PollingIngestor(self.user_client, POLL_CHANNELS, self._spawn_accept,
+                                      state_path=POLL_STATE_FILE, requests_per_hour=POLL_REQUESTS_PER_HOUR)
+        self.link_check_stats = {ALLOW: 0, DENY: 0, SKIP_CHECK: 0, 'telegram': 0, 'http': 0}
+
     def _get_random_headers(self):
         """获取随机的请求头"""
         headers = self.base_headers.copy()
@@ -451,24 +649,30 @@ class MessageForwarder:
             me = self.user_client.get_me()
             logger.info(f"会话验证成功: {me.first_name} (@{me.username})")
 
-            logger.info("正在初始化Bot客户端...")
-            
+            logger.info(f"正在初始化Bot客户端（{BOT_TRANSPORT}）...")
+
             # Bot客户端
-            self.bot_client = TelegramClient(
-                None,  # 不需要会话文件
-                self.api_id,
-                self.api_hash,
-                device_model="Windows 10",
-                system_version="Windows 10",
-                app_version="1.0",
-                lang_code="zh-CN",
-                system_lang_code="zh-CN"
-            )
+            if BOT_TRANSPORT == "http":
+                # 只有 http 传输需要 aiohttp 会话，选用时才导入
+                from bot_api import BotApiClient, DEFAULT_API_URL
+                self.bot_client = BotApiClient(self.bot_token, base_url=BOT_API_URL or DEFAULT_API_URL)
+            else:
+                self.bot_client = TelegramClient(
+                    None,  # 不需要会话文件
+                    self.api_id,
+                    self.api_hash,
+                    device_model="Windows 10",
+                    system_version="Windows 10",
+                    app_version="1.0",
+                    lang_code="zh-CN",
+                    system_lang_code="zh-CN"
+                )
 
             # 设置消息处理器
             @self.user_client.on(events.NewMessage())
             async def debug_message_handler(event: events.NewMessage.Event):
                 try:
+                    trace = self.tracer.start()
                     message = event.message
                     chat = await message.get_chat()
                     channel_name = f"@{chat.username}" if chat.username else str(chat.id)
@@ -477,18 +681,10 @@ class MessageForwarder:
                     logger.debug(f"消息内容: {message.text[:100] if message.text else '无文本'}")
 
                     if channel_name in self.source_channels:
-                        message_id = f"{channel_name}:{message.id}"
-                        async with self.message_lock:
-                            if message_id in self.processed_messages:
-                                logger.info(f"跳过重复消息: {message_id}")
-                                return
-
-                            self.processed_messages.add(message_id)
-                            if len(self.processed_messages) > 1000:
-                                self.processed_messages = set(list(self.processed_messages)[-1000:])
-
-                        logger.success(f"******* 已收到目标频道 {channel_name} 的新消息 *******")
-                        await self._process_message(message, channel_name)
+                        trace.mark('ingest')
+                        self.gap_tracker.observe(message.chat_id, message.id, channel_name)
+                        self._schedule_gap_fill()
+                        await self._accept_message(message, channel_name, trace)
                     else:
                         logger.debug(f"跳过非目标频道的消息: {channel_name}")
 
@@ -497,6 +693,13 @@ class MessageForwarder:
                     import traceback
                     logger.error(f"错误堆栈: {traceback.format_exc()}")
 
+            @self.user_client.on(events.MessageEdited())
+            async def edit_message_handler(event: events.MessageEdited.Event):
+                try:
+                    await self._process_edit(event.message)
+                except Exception as e:
+                    logger.error(f"同步编辑出错: {str(e)}")
+
         except Exception as e:
             logger.error(f"设置客户端时出错: {str(e)}")
             raise
@@ -507,6 +710,22 @@ class MessageForwarder:
             parsed_url = urlparse(url)
             domain = parsed_url.netloc
 
+            # 域名策略命中时不发起网络请求
+            policy = self.domain_policy.lookup(parsed_url.hostname)
+            if policy is not None:
+                self.link_check_stats[policy] += 1
+                if policy == DENY:
+                    logger.warning(f"URL {url} 命中拒绝列表")
+                return policy != DENY
+
+            # Telegram链接：用户名通过客户端检查，邀请链接等不检查
+            username = telegram_username(url)
+            if username is not None:
+                self.link_check_stats['telegram'] += 1
+                return await self.telegram_links.check(username) if username else True
+
+            self.link_check_stats['http'] += 1
+
             # 获取基础请求头配置
             headers = self.browser_profile.copy()
 
@@ -521,7 +740,8 @@ class MessageForwarder:
             logger.debug(f"尝试访问URL: {url}")
             logger.debug(f"使用请求头: {json.dumps(headers, indent=2)}")
 
-            # 配置 aiohttp 客户端选项
+            # 配置 aiohttp 客户端选项（首次检查链接时才导入）
+            import aiohttp
             conn = aiohttp.TCPConnector(ssl=False)  # 禁用SSL验证
             timeout = aiohttp.ClientTimeout(total=30)
 
@@ -549,227 +769,520 @@ class MessageForwarder:
             logger.error(f"URL访问检查过程中发生未知错误: {str(e)}")
             return False
 
-    async def _process_message(self, message, channel_name):
-        """处理消息的统一方法"""
+    async def _accept_message(self, message, channel_name, trace=None):
+        """去重后处理一条源频道消息，并登记为处理中"""
         message_id = f"{channel_name}:{message.id}"
-        try:
-            # 如果消息中包含URL，先检查可访问性
-            if message.text:
-                urls = re.findall(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+',
-                                  message.text)
-                for url in urls:
-                    if not await self.check_url_access(url):
-                        logger.warning(f"URL {url} 不可访问，将在消息中标注")
-                        message.text = message.text.replace(url, f"{url} [⚠️访问受限]")
-
-            # 添加工作时间和安全时间检查的详细日志
-            is_work_time = self.anti_ban_strategies.is_work_time()
-            is_safe_time = self.anti_ban_strategies.is_safe_time()
-            can_send = self.anti_ban_strategies.can_send_message()
-
-            # 获取当前时间用于日志显示
-            current_time = datetime.now(beijing_tz)
-            current_hour = current_time.hour
-            is_weekend = current_time.weekday() >= 5
-            in_work_hours = 9 <= current_hour <= 18
-
-            # 详细记录时间和限制状态
-            logger.info("🕒 消息处理状态检查:")
-            if in_work_hours:
-                if is_weekend:
-                    logger.info("  • 当前是周末工作时间(9:00-18:00): " + (
-                        "✅ 随机通过" if is_work_time else "❌ 随机跳过(50%概率)"))
-                else:
-                    logger.info("  • 当前是工作日工作时间(9:00-18:00): ✅ 正常处理")
-            else:
-                logger.info("  • 当前是非工作时间: " + ("✅ 随机通过" if is_work_time else "❌ 随机跳过(30%概率)"))
-            logger.info(f"  • 安全时间(7:00-23:00): {'✅' if is_safe_time else '❌'}")
-            logger.info(f"  • 发送限制检查: {'✅' if can_send else '❌'}")
-
-            # 跳过系统日志消息
-            if message.text and "📋 **系统日志**" in message.text:
-                logger.info("⚪ [SKIP] 跳过系统日志消息")
+        if not self.accepting:
+            # 正在关闭：不再处理，写入检查点留到下次启动
+            self.late_arrivals.append({'chat_id': message.chat_id, 'msg_id': message.id, 'channel': channel_name})
+            return
+
+        async with self.message_lock:
+            if message_id in self.processed_messages:
+                logger.info(f"跳过重复消息: {message_id}")
                 return
 
-            # 检查是否应该处理这条消息
-            if not is_work_time:
-                if in_work_hours and is_weekend:
-                    logger.info(f"❌ 周末工作时间消息随机跳过，当前时间: {current_time.strftime('%H:%M')}")
-                else:
-                    logger.info(f"❌ 非工作时间消息随机跳过，当前时间: {current_time.strftime('%H:%M')}")
-                return
-
-            if not is_safe_time:
-                logger.warning(f"❌ 不在安全时间范围内(7:00-23:00)，当前时间: {current_time.strftime('%H:%M')}")
-                return
-
-            # 如果所有检查都通过，继续处理消息
-            logger.success("✅ 所有安全检查通过，开始处理消息")
+            self.processed_messages.add(message_id)
+            if len(self.processed_messages) > 1000:
+                self.processed_messages = set(list(self.processed_messages)[-1000:])
+
+        logger.success(f"******* 已收到目标频道 {channel_name} 的新消息 *******")
+        self.total_messages_processed += 1
+        self.last_message_received = datetime.now(beijing_tz)
+        self.journal.record('received', channel_name, message.id, text=message.text,
+                            media=bool(message.media))
+        self.inflight[message_id] = {
+            'task': asyncio.current_task(),
+            'chat_id': message.chat_id,
+            'msg_id': message.id,
+            'channel': channel_name,
+        }
+        try:
+            await self._process_message(message, channel_name, trace)
+        finally:
+            self.inflight.pop(message_id, None)
+
+    async def _resume_pending(self):
+        """重新拉取上次关闭时未完成的消息并处理"""
+        entries = self.pending_checkpoint.take()
+        if not entries:
+            return
+        logger.info(f"恢复上次未完成的 {len(entries)} 条消息")
+        by_chat = defaultdict(list)
+        for entry in entries:
+            by_chat[(entry['chat_id'], entry['channel'])].append(entry['msg_id'])
+        for (chat_id, channel_name), msg_ids in by_chat.items():
+            try:
+                messages = await self.user_client.get_messages(chat_id, ids=msg_ids)
+            except Exception as e:
+                logger.error(f"拉取未完成消息失败 {channel_name}: {e}")
+                continue
+            for message in messages:
+                if message:
+                    self._spawn_accept(message, channel_name)
+
+    def _spawn_accept(self, message, channel_name):
+        """在独立任务中处理补拉/恢复的消息"""
+        # 不放入 self.tasks：关闭时按处理中的消息排空，而不是直接取消
+        task = asyncio.create_task(self._accept_message(message, channel_name))
+        self.resume_tasks.add(task)
+        task.add_done_callback(self.resume_tasks.discard)
+
+    async def _fill_gaps(self):
+        """批量补拉到期的消息ID缺口，补回的消息走正常处理流程；失败的批次退避后重试"""
+        try:
+            for chat_id, channel_name, ids in self.gap_tracker.due():
+                try:
+                    messages = await self.user_client.get_messages(chat_id, ids=ids)
+                except Exception as e:
+                    delay = self.gap_tracker.retry(chat_id, ids, e.seconds if isinstance(e, FloodWaitError) else 0)
+                    logger.warning(f"补拉 {channel_name} 消息ID缺口 {ids[0]}~{ids[-1]} 失败: {e}，{delay:.0f} 秒后重试")
+                    continue
+                self.gap_tracker.resolve(chat_id, ids)
+                # 已删除的消息返回 None，系统消息（置顶、改名等）不转发
+                found = [message for message in messages
+                         if isinstance(message, Message) and (message.text or message.media)]
+                self.gap_tracker.record_fill(len(found), len(ids) - len(found))
+                logger.info(f"🧩 {channel_name} 消息ID缺口 {ids[0]}~{ids[-1]}：补回 {len(found)} 条，"
+                            f"已删除或系统消息 {len(ids) - len(found)} 条")
+                for message in found:
+                    self._spawn_accept(message, channel_name)
+        finally:
+            self._schedule_gap_fill()
+
+    def _schedule_gap_fill(self):
+        """在最早的缺口到期时安排一次补拉（没有缺口时不唤醒）"""
+        due = self.gap_tracker.next_due()
+        if due is not None:
+            self.scheduler.at('gap_fill', due, self._fill_gaps)
+
+    @staticmethod
+    def _build_forward_text(message, source_channel):
+        """构建转发消息文本"""
+        beijing_time = message.date.replace(tzinfo=pytz.UTC).astimezone(beijing_tz)
+
+        # 改进消息文本清理逻辑
+        def clean_text(text):
+            if not text:
+                return ""
+            # 移除不可见字符但保留基本格式
+            text = ''.join(char for char in text if char.isprintable() or char in '\n\t')
+            # 清理多余的空白字符
+            text = re.sub(r'\s+', ' ', text).strip()
+            # 清理URL但保留显示文本
+            text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '',
+                          text)
+            return text
+
+        cleaned_text = clean_text(message.text or '')
+
+        # 构建转发消息，确保文本非空
+        header = (
+            f"🔄 转发自: {source_channel}\n"
+            f"⏰ 时间: {beijing_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
+            f"{'=' * 30}"
+        )
+
+        body = cleaned_text if cleaned_text else "（无文本内容）"
+        forward_text = f"{header}\n\n{body}"
+
+        # 检查消息长度
+        if len(forward_text) > 4096:  # Telegram消息长度限制
+            forward_text = forward_text[:4093] + "..."
+        return forward_text
+
+    async def _process_edit(self, message):
+        """把源消息的编辑同步到已转发的消息（不占用发送额度）"""
+        mapped = self.message_map.get(message.chat_id, message.id)
+        if not mapped:
+            return
+
+        # 比较链接标注前的原文摘要：只改了格式、表情等不影响文本的编辑不必检查链接和重发
+        digest = text_hash(message.text)
+        if digest == mapped.text_hash:
+            self.edits_skipped += 1
+            logger.debug(f"编辑未改变转发内容，跳过: {message.chat_id}:{message.id}")
+            return
+
+        chat = await message.get_chat()
+        source_channel = f"@{chat.username}" if chat.username else str(chat.id)
+        await self._annotate_links(message)  # 保留不可访问链接的标注
+        forward_text = self._build_forward_text(message, source_channel)
+
+        if not self.bot_client.is_connected():
+            logger.error("❌ Bot客户端未连接，无法同步编辑")
+            return
+
+        await self.send_gate.wait()
+        await self.bot_client.edit_message(
+            mapped.target,
+            mapped.target_msg_id,
+            forward_text,
+            parse_mode=None,
+            link_preview=False
+        )
+        self.message_map.update_hash(message.chat_id, message.id, digest)
+        self.edits_synced += 1
+        logger.info(f"✏️ 已同步源消息编辑: {source_channel}:{message.id}")
+
+    def _build_pipeline(self):
+        """消息处理阶段：便宜的检查先执行，需要网络的检查放在最后，被拒绝的消息不再花费网络请求"""
+        return (FilterPipeline()
+                .add('system_log', self._stage_system_log, COST_CPU)
+                .add('spam', self._stage_spam, COST_CPU)
+                .add('score', self._stage_score, COST_CPU)
+                .add('chat', self._stage_chat, COST_CACHE)
+                .add('digest', self._stage_digest, COST_CPU, requires=('score', 'chat'))
+                .add('admission', self._stage_admission, COST_CPU, requires=('score', 'digest'))
+                .add('link_check', self._stage_link_check, COST_NETWORK, requires=('admission',))
+                .add('build_text', self._stage_build_text, COST_CPU, requires=('chat', 'link_check')))
+
+    async def _stage_system_log(self, ctx):
+        """跳过系统日志消息"""
+        message = ctx['message']
+        if message.text and "📋 **系统日志**" in message.text:
+            logger.info("⚪ [SKIP] 跳过系统日志消息")
+            return 'system_log'
+
+    async def _stage_spam(self, ctx):
+        """分类器判定为垃圾/无关的消息直接跳过（没有模型文件时不过滤）"""
+        probability = self.spam_classifier.spam_probability(ctx['message'].text)
+        if probability is not None and probability >= self.spam_classifier.threshold:
+            logger.info(f"⚪ [SKIP] 分类器判定为垃圾/无关消息（概率 {probability:.2f}）")
+            return 'spam'
+
+    async def _stage_score(self, ctx):
+        ctx['score'] = self.post_scorer.score(ctx['message'].text, ctx['channel'])
+
+    async def _stage_chat(self, ctx):
+        message = ctx['message']
+        ctx['chat'] = await message.get_chat()
+        ctx['noforwards'] = bool(getattr(ctx['chat'], 'noforwards', False) or getattr(message, 'noforwards', False))
+        self.delivery_cache.observe_noforwards(message.chat_id, ctx['noforwards'])
+
+    async def _stage_digest(self, ctx):
+        """摘要模式：低价值消息不单独占用发送额度，合并进摘要"""
+        if self.digest_buffer is not None and ctx['score'] < self.anti_ban_config.DIGEST_SCORE_THRESHOLD:
+            self._add_to_digest(ctx['message'], ctx['chat'], ctx['channel'], ctx['score'], ctx['received_at'])
+            return 'digest'
+
+    async def _stage_admission(self, ctx):
+        """队列已满且价值低于队列中最低的消息时，入队也会被立即丢弃，提前结束"""
+        self._drop_jobs(self.admission_queue.purge_expired(), 'expired')
+        if not self.admission_queue.would_admit(ctx['score'], ctx['message'].date.timestamp()):
+            logger.info(f"🗑️ 队列已满且价值较低（{ctx['score']:.2f}），不再处理")
+            return 'shed'
+
+    async def _stage_link_check(self, ctx):
+        """检查消息中URL的可访问性，不可访问的在消息中标注"""
+        ctx['source_hash'] = text_hash(ctx['message'].text)  # 标注前的原文摘要，编辑同步时据此判断内容是否改变
+        ctx['urls'] = await self._annotate_links(ctx['message'])
+
+    async def _annotate_links(self, message):
+        """在消息文本中标注不可访问的URL，返回找到的URL"""
+        if not message.text:
+            return []
+        urls = re.findall(
+            r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', message.text)
+        for url in urls:
+            if not await self.check_url_access(url):
+                logger.warning(f"URL {url} 不可访问，将在消息中标注")
+                message.text = message.text.replace(url, f"{url} [⚠️访问受限]")
+        return urls
+
+    async def _stage_build_text(self, ctx):
+        chat = ctx['chat']
+        source_channel = f"@{chat.username}" if chat.username else str(chat.id)
+        ctx['forward_text'] = self._build_forward_text(ctx['message'], source_channel)
+
+    async def _process_message(self, message, channel_name, trace=None):
+        """处理消息：经过处理流水线后转成发送任务放入发送队列，由发送调度按价值高低发送"""
+        message_id = f"{channel_name}:{message.id}"
+        trace = trace or self.tracer.start()
+        queued = False
+        ctx = {
+            'key': message_id,
+            'message': message,
+            'channel': channel_name,
+            'received_at': self.clock.time(),
+            'trace': trace,
+        }
+        try:
             logger.info(f"🎯 [PROCESSING] 监听频道 {channel_name} 有新消息，开始处理")
-
-            # 获取基本消息信息
-            # logger.info(f"🔔 监听到新消息！消息ID: {message.id}")
-            # logger.info(f"👤 发送者ID: {message.sender_id}")
             logger.info(f"📅 消息时间: {message.date}")
             logger.info(f"📝 消息预览: {(message.text or '无文本')[:20]}...")
 
-            chat = await message.get_chat()
-            source_channel = f"@{chat.username}" if chat.username else str(chat.id)
-            beijing_time = message.date.replace(tzinfo=pytz.UTC).astimezone(beijing_tz)
-
-            # 改进消息文本清理逻辑
-            def clean_text(text):
-                if not text:
-                    return ""
-                # 移除不可见字符但保留基本格式
-                text = ''.join(char for char in text if char.isprintable() or char in '\n\t')
-                # 清理多余的空白字符
-                text = re.sub(r'\s+', ' ', text).strip()
-                # 清理URL但保留显示文本
-                text = re.sub(r'http[s]?://(?:[a-zA-Z]|[0-9]|[$-_@.&+]|[!*\\(\\),]|(?:%[0-9a-fA-F][0-9a-fA-F]))+', '',
-                              text)
-                return text
-
-            cleaned_text = clean_text(message.text or '')
-
-            # 构建转发消息，确保文本非空
-            header = (
-                f"🔄 转发自: {source_channel}\n"
-                f"⏰ 时间: {beijing_time.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"{'=' * 30}"
-            )
-
-            body = cleaned_text if cleaned_text else "（无文本内容）"
-            forward_text = f"{header}\n\n{body}"
-
-            # 检查消息长度
-            if len(forward_text) > 4096:  # Telegram消息长度限制
-                forward_text = forward_text[:4093] + "..."
+            verdict, stage = await self.pipeline.run(ctx, trace)
+            if verdict is not None:
+                if verdict != 'digest':
+                    self.journal.record('skipped', channel_name, message.id, reason=verdict,
+                                        score=round(ctx.get('score', 0), 2))
+                self.media_prefetcher.release(message_id)
+                return
 
-            # 获取自适应延迟
-            delay = self.anti_ban_strategies.get_adaptive_delay()
-            logger.info(f"等待 {delay:.2f} 秒后发送消息")
-            await asyncio.sleep(delay)
-            logger.info("延迟等待完成，开始发送消息")
+            # 只保留发送需要的字段入队，不再持有 Message 对象
+            job = PostJob.from_message(message_id, message, channel_name, ctx['forward_text'], ctx['urls'],
+                                       ctx['source_hash'], ctx['noforwards'], ctx['score'], ctx['received_at'], trace)
+            shed = self.admission_queue.push(job, job.score, job.posted_at)
+            queued = all(dropped is not job for dropped in shed)
+            self._drop_jobs(shed, 'shed')
+            if queued:
+                logger.info(f"📥 消息已入队，价值 {job.score:.2f}，当前队列 {len(self.admission_queue)} 条")
+                self._prefetch_top()
 
+        except Exception as e:
+            logger.error(f"预处理消息失败: {str(e)}")
+            self.journal.record('failed', channel_name, message.id, error=type(e).__name__)
+            self.media_prefetcher.release(message_id)
+        finally:
+            if not queued:
+                self.tracer.finish(trace, message_id)
+
+    def _add_to_digest(self, message, chat, channel_name, score, received_at):
+        """把低价值消息的摘要放入摘要缓冲区"""
+        media = None
+        if isinstance(message.media, MessageMediaPhoto):
+            media = "图片"
+        elif isinstance(message.media, MessageMediaDocument):
+            media = "文件"
+        summary = summarize(
+            message.text,
+            f"@{chat.username}" if chat.username else channel_name,
+            message.date.replace(tzinfo=pytz.UTC),
+            link=f"https://t.me/{chat.username}/{message.id}" if chat.username else None,
+            media=media,
+            max_lines=self.anti_ban_config.DIGEST_SUMMARY_LINES,
+        )
+        self.digest_buffer.add(self.target_channel[0],
+                               DigestEntry(summary, score, message.chat_id, message.id, channel_name, received_at))
+        logger.info(f"📰 低价值消息（价值 {score:.2f}）已加入摘要，待合并 {len(self.digest_buffer)} 条")
+
+    def _pack_digests(self):
+        """摘要窗口到期后打包，作为普通发送任务放入发送队列（价值为所含消息之和）"""
+        for target in self.digest_buffer.due():
+            for number, (text, entries) in enumerate(self.digest_buffer.take(target), 1):
+                now = self.clock.time()
+                trace = self.tracer.start()
+                trace.mark('digest_wait')
+                job = DigestJob(
+                    key=f"digest:{int(now)}:{number}",
+                    entries=tuple(entries),
+                    channel='digest',
+                    forward_text=text,
+                    score=sum(entry.score for entry in entries),
+                    received_at=min(entry.received_at for entry in entries),
+                    trace=trace,
+                )
+                self._drop_jobs(self.admission_queue.push(job, job.score, now), 'shed')
+                logger.info(f"📰 摘要已入队：{len(entries)} 条消息合并为 1 次发送")
+
+    def _prefetch_top(self):
+        """等待发送时隙期间在后台预取媒体，重新上传时不必再下载
+        只预取队列中价值最高的前 N 条：排在后面的消息多半会被挤出队列或过期，提前下载是浪费
+        （该频道直接转发已知可用时不会走到重新上传，无需预取）
+        """
+        for queued in self.admission_queue.top(MEDIA_PREFETCH_TOP_N):
+            if (isinstance(queued, PostJob) and queued.media is not None and
+                    self.delivery_cache.status(queued.chat_id, FORWARD) is not True):
+                self.media_prefetcher.start(queued.key, queued.media)
+
+    def _drop_jobs(self, jobs, reason):
+        """记录被队列丢弃（容量不足/等待过久）的消息"""
+        for job in jobs:
+            logger.info(f"🗑️ 丢弃消息 {job.key}（{reason}），价值 {job.score:.2f}")
+            job.trace.mark('queue_wait')
+            for chat_id, msg_id, channel_name in job.posts():
+                self.journal.record('skipped', channel_name, msg_id, reason=reason, score=round(job.score, 2))
+            self.media_prefetcher.release(job.key)
+            self.send_attempts.pop(job.key, None)
+            self.tracer.finish(job.trace, job.key)
+
+    async def _send_loop(self):
+        """发送调度：每个发送时隙都留给队列中当前价值最高的消息"""
+        while self.running:
+            try:
+                await self.admission_queue.wait()
+
+                # 只发送所在频道处于安全时间的消息（CHANNEL_SCHEDULES 可按频道覆盖时间窗口）
+                schedules = self.anti_ban_strategies.schedules
+
+                def in_safe_window(queued):
+                    return schedules.window(queued.channel).is_safe
+
+                candidate = self.admission_queue.peek(in_safe_window)
+                if candidate is None:
+                    # 队列中所有消息的频道都不在安全时间：等到最早的时间窗口边界
+                    boundary = min(schedules.window(queued.channel).end for queued in self.admission_queue.jobs())
+                    wait = max(1.0, boundary - self.clock.time())
+                    logger.info(f"⏸️ 不在安全时间范围内，{wait:.0f} 秒后再发送（队列 {len(self.admission_queue)} 条）")
+                    await asyncio.sleep(wait)
+                    continue
+                window = schedules.window(candidate.channel)
+
+                # 客户端断线期间不发送，等待重连
+                if not all(supervisor.is_up for supervisor in self.supervisors):
+                    logger.info("🔌 客户端连接断开，等待重连后再发送")
+                    for supervisor in self.supervisors:
+                        await supervisor.wait_up()
+                    continue
+
+                # 频率限制、冷却和暂停期间闸门关闭（包括重启前留下的冷却）
+                if not self.send_gate.is_open:
+                    logger.info(f"🚧 发送闸门关闭（{self.send_gate.reason}），{self.send_gate.remaining():.0f} 秒后发送")
+                    await self.send_gate.wait()
+                    continue
+
+                # 发送额度用完：等到下一个额度（非工作时间按该频道的处理比例缩减每小时额度）
+                wait = self.anti_ban_strategies.seconds_until_slot(window.work_ratio)
+                if wait > 0:
+                    logger.info(f"⏳ 发送额度已用完，{wait:.0f} 秒后再发送（队列 {len(self.admission_queue)} 条）")
+                    await asyncio.sleep(wait)
+                    continue
+
+                # 获取自适应延迟
+                delay = self.anti_ban_strategies.get_adaptive_delay()
+                logger.info(f"等待 {delay:.2f} 秒后发送消息")
+                delay_started = time.monotonic()  # 与消息追踪使用同一单调时钟
+                await asyncio.sleep(delay)
+
+                # 延迟结束时再取出价值最高的消息，等待期间到达的高价值消息可以优先
+                self._drop_jobs(self.admission_queue.purge_expired(), 'expired')
+                taken = self.admission_queue.take(in_safe_window, 1)
+                if not taken:
+                    continue
+                job = taken[0]
+                # 自适应延迟单独记为一个阶段（计入处理耗时），不混在排队等待里
+                job.trace.mark_at('queue_wait', delay_started)
+                job.trace.mark('adaptive_delay')
+                logger.info(f"📤 取出队列中价值最高的消息 {job.key}（价值 {job.score:.2f}，"
+                            f"剩余 {len(self.admission_queue)} 条）")
+                job = self._coalesce(job)
+                self._prefetch_top()  # 队首空出位置，下一批消息开始预取
+
+                self.delivering = job
+                requeued = ()
+                try:
+                    requeued = await self._deliver(job, delay)
+                finally:
+                    self.delivering = None
+                    for member in job.members():
+                        if member.key in requeued:
+                            continue  # 已放回队列，保留预取缓冲和追踪记录
+                        self.media_prefetcher.release(member.key)
+                        self.tracer.finish(member.trace, member.key)
+
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logger.error(f"发送调度出错: {str(e)}")
+                await asyncio.sleep(5)
+
+    def _coalesce(self, job):
+        """合并转发：同一源频道发布时间相近的排队消息与 job 合并，一次多ID转发（只占一次发送额度）"""
+        config = self.anti_ban_config
+        if (not config.BATCH_FORWARD_ENABLED or not isinstance(job, PostJob) or job.noforwards or
+                self.delivery_cache.status(job.chat_id, FORWARD) is False):
+            return job
+
+        def same_burst(other):
+            return (isinstance(other, PostJob) and other.chat_id == job.chat_id and not other.noforwards and
+                    abs(other.posted_at - job.posted_at) <= config.BATCH_FORWARD_WINDOW)
+
+        others = self.admission_queue.take(same_burst, config.BATCH_FORWARD_MAX - 1)
+        if not others:
+            return job
+        members = tuple(sorted([job] + others, key=lambda member: member.msg_id))
+        for member in others:
+            member.trace.mark('queue_wait')
+        logger.info(f"📦 合并同一频道的 {len(members)} 条消息为一次转发")
+        return BatchJob(
+            key=f"batch:{job.key}",
+            jobs=members,
+            channel=job.channel,
+            score=sum(member.score for member in members),
+            received_at=min(member.received_at for member in members),
+            trace=job.trace,
+        )
+
+    def _requeue(self, job):
+        """发送失败的单条任务放回队列（保留原价值和发布时间），闸门重新打开后重试
+        尝试次数用完时返回 False；放回时被挤出队列的按 shed 记录，同样不再记为失败
+        """
+        attempts = self.send_attempts.get(job.key, 0) + 1
+        if attempts >= self.anti_ban_config.SEND_MAX_ATTEMPTS:
+            self.send_attempts.pop(job.key, None)
+            return False
+        self.send_attempts[job.key] = attempts
+        created_at = job.posted_at if isinstance(job, PostJob) else job.received_at
+        self._drop_jobs(self.admission_queue.push(job, job.score, created_at), 'shed')
+        logger.info(f"🔁 消息 {job.key} 放回队列，第 {attempts + 1} 次尝试将在闸门打开后进行")
+        return True
+
+    async def _fail_delivery(self, job, error, retryable):
+        """发送失败：可重试的放回队列，其余记为失败；返回已放回队列（或已被丢弃）的任务键"""
+        handed_off = set()
+        for member in job.members():
+            if retryable and self._requeue(member):
+                handed_off.add(member.key)
+                continue
+            async with self.message_lock:
+                self.processed_messages.discard(member.key)
+            for chat_id, msg_id, channel_name in member.posts():
+                self.journal.record('failed', channel_name, msg_id, error=error,
+                                    latency=round(self.clock.time() - member.received_at, 3))
+        return handed_off
+
+    async def _deliver(self, job, delay):
+        """发送一条已出队的消息，返回放回队列的任务键（发送失败但可以重试时）"""
+        received_at = job.received_at
+        posts = job.posts()
+        requeued = set()
+        try:
             # 检查Bot客户端连接状态
             if not self.bot_client.is_connected():
                 logger.error("❌ Bot客户端未连接，无法发送消息")
-                return
-
-            # 发送主消息
-            try:
-                logger.info(f"开始发送主消息到 {self.target_channel[0]}")
-                # 使用parse_mode=None避免意外的格式化问题
-                await self.bot_client.send_message(
-                    self.target_channel[0],
-                    forward_text,
-                    parse_mode=None,  # 禁用消息格式化
-                    link_preview=False  # 禁用链接预览
-                )
-                logger.success(f"✅ 成功转发消息到 {self.target_channel[0]}")
-            except Exception as e:
-                logger.error(f"❌ 发送主消息失败: {str(e)}")
-                if "invalid bounds" in str(e).lower():
-                    # 如果是实体边界问题，尝试只发送纯文本
-                    try:
-                        logger.info("尝试发送纯文本消息...")
-                        await self.bot_client.send_message(
-                            self.target_channel[0],
-                            forward_text,
-                            parse_mode=None,
-                            formatting_entities=[],
-                            link_preview=False
-                        )
-                        logger.success("✅ 使用纯文本模式成功发送消息")
-                    except Exception as pure_text_error:
-                        logger.error(f"❌ 纯文本发送也失败: {str(pure_text_error)}")
-                        async with self.message_lock:
-                            self.processed_messages.discard(message_id)
-                        raise
-                else:
-                    async with self.message_lock:
-                        self.processed_messages.discard(message_id)
-                    raise
-
-            # 转发媒体消息
-            if message.media and isinstance(message.media, (MessageMediaPhoto, MessageMediaDocument)):
-                try:
-                    logger.info("开始转发媒体消息")
-                    await asyncio.sleep(delay * 0.3)  # 媒体消息额外延迟
-
-                    # 检查媒体类型
-                    media_type = "未知"
-                    if isinstance(message.media, MessageMediaPhoto):
-                        media_type = "图片"
-                    elif isinstance(message.media, MessageMediaDocument):
-                        # 获取文件名和MIME类型
-                        attributes = message.media.document.attributes
-                        file_name = next((attr.file_name for attr in attributes if hasattr(attr, 'file_name')), None)
-                        mime_type = message.media.document.mime_type
-                        media_type = f"文档 (MIME: {mime_type}, 文件名: {file_name})" if file_name else f"文档 (MIME: {mime_type})"
-
-                    logger.info(f"媒体类型: {media_type}")
-
-                    # 尝试直接转发消息而不是重新上传媒体
-                    try:
-                        logger.info("尝试直接转发原始消息...")
-                        await message.forward_to(self.target_channel[0])
-                        logger.success(f"✅ 成功转发媒体消息到 {self.target_channel[0]}")
-                        return
-                    except Exception as forward_error:
-                        logger.warning(f"直接转发失败: {str(forward_error)}, 尝试重新上传...")
-
-                    # 如果直接转发失败，尝试重新上传
-                    try:
-                        await self.bot_client.send_file(
-                            self.target_channel[0],
-                            message.media,
-                            caption=forward_text[:1024],  # Telegram媒体说明长度限制
-                            parse_mode=None,
-                            force_document=isinstance(message.media, MessageMediaDocument)
-                        )
-                        logger.success(f"✅ 成功重新上传媒体消息到 {self.target_channel[0]}")
-                    except Exception as upload_error:
-                        logger.error(f"❌ 重新上传媒体失败: {str(upload_error)}")
-
-                        # 如果都失败了，尝试只发送文本消息
-                        logger.info("尝试只发送文本内容...")
-                        media_info = f"\n\n[注意：原消息包含{media_type}，但由于权限限制无法转发]"
-                        text_only_message = forward_text + media_info
-
-                        await self.bot_client.send_message(
-                            self.target_channel[0],
-                            text_only_message,
-                            parse_mode=None,
-                            link_preview=False
-                        )
-                        logger.info("✅ 已发送包含媒体说明的文本消息")
-
-                except Exception as e:
-                    logger.error(f"❌ 转发媒体消息失败: {str(e)}")
-                    logger.warning("跳过媒体转发，继续处理其他消息")
+                return await self._fail_delivery(job, 'bot_disconnected', retryable=True)
+
+            if isinstance(job, DigestJob):
+                await self._send_digest(job)
+            elif isinstance(job, BatchJob):
+                # 合并转发失败回退为单条时只记录实际发送的消息，其余已放回队列
+                sent = await self._send_batch(job, delay)
+                posts = sent.posts()
+                requeued = {member.key for member in job.members()} - {member.key for member in sent.members()}
+            else:
+                await self._send_post(job, delay)
 
             # 记录成功发送
             self.anti_ban_strategies.record_success()
+            for member in job.members():
+                if member.key not in requeued:
+                    self.send_attempts.pop(member.key, None)
+            for chat_id, msg_id, channel_name in posts:
+                self.journal.record('sent', channel_name, msg_id, target=self.target_channel[0],
+                                    latency=round(self.clock.time() - received_at, 3),
+                                    digest=isinstance(job, DigestJob))
 
             logger.info(
                 f"📈 转发统计 分钟内: {self.anti_ban_strategies.message_count['minute']}, 小时内: {self.anti_ban_strategies.message_count['hour']}")
             logger.success("🎉 消息转发流程完全完成")
+            return requeued
 
         except Exception as e:
-            # 发生错误时从已处理集合中移除消息ID
-            async with self.message_lock:
-                self.processed_messages.discard(message_id)
+            # 频率限制和临时错误放回队列，在闸门后面等待重试；永久性错误（禁止发送、被封禁）直接记为失败
+            permanent = (not isinstance(e, (FloodWaitError, PeerFloodError)) and
+                         (getattr(e, 'code', None) == 403 or
+                          any(keyword in str(e).upper() for keyword in self.anti_ban_config.PERMANENT_SEND_ERRORS)))
+            requeued = await self._fail_delivery(job, type(e).__name__, retryable=not permanent)
 
             if isinstance(e, FloodWaitError):
                 logger.warning(f"遇到频率限制，等待 {e.seconds} 秒")
                 self.anti_ban_strategies.record_error(str(e))
+                self._hold_sends(e.seconds, 'flood_wait')
                 if e.seconds > 300:  # 超过5分钟
                     logger.warning(f"频率限制时间过长({e.seconds}秒)，暂停监听直到工作时间")
                     self.pause_until_work_time()
-                else:
-                    await asyncio.sleep(e.seconds)
+                # 闸门关闭期间所有发送方都不会再发送
             elif isinstance(e, PeerFloodError):
                 logger.error(f"目标频道被限制：{e}")
                 logger.warning("检测到PEER_FLOOD错误，暂停监听直到工作时间")
@@ -784,110 +1297,368 @@ class MessageForwarder:
                 if any(keyword in str(e).upper() for keyword in dangerous_keywords):
                     logger.error("检测到严重错误，暂停监听直到工作时间")
                     self.pause_until_work_time()
-                    return
+                    return requeued
 
                 if any(keyword in str(e).upper() for keyword in self.anti_ban_config.DANGEROUS_ERRORS):
                     logger.error("检测到危险错误，进入长时间冷却")
                     cooldown = self.anti_ban_strategies.record_error(str(e))
+                    self._hold_sends(cooldown, 'dangerous_error')
                     if cooldown > 600:  # 超过10分钟
                         logger.warning("冷却时间过长，暂停监听直到工作时间")
                         self.pause_until_work_time()
-                    else:
-                        await asyncio.sleep(cooldown)
                 else:
                     cooldown = self.anti_ban_strategies.record_error(str(e))
-                    await asyncio.sleep(min(cooldown, 60))  # 最多等待60秒
+                    self.send_gate.hold(min(cooldown, 60), 'error')  # 最多暂停60秒
+            return requeued
+
+    async def _send_post(self, job, delay):
+        """发送单条消息：正文和媒体"""
+        message_id = job.key
+        forward_text = job.forward_text
+        trace = job.trace
+
+        # 发送主消息
+        try:
+            logger.info(f"开始发送主消息到 {self.target_channel[0]}")
+            # 使用parse_mode=None避免意外的格式化问题
+            sent = await self.bot_client.send_message(
+                self.target_channel[0],
+                forward_text,
+                parse_mode=None,  # 禁用消息格式化
+                link_preview=False  # 禁用链接预览
+            )
+            logger.success(f"✅ 成功转发消息到 {self.target_channel[0]}")
+        except Exception as e:
+            logger.error(f"❌ 发送主消息失败: {str(e)}")
+            if "invalid bounds" in str(e).lower():
+                # 如果是实体边界问题，尝试只发送纯文本
+                try:
+                    logger.info("尝试发送纯文本消息...")
+                    sent = await self.bot_client.send_message(
+                        self.target_channel[0],
+                        forward_text,
+                        parse_mode=None,
+                        formatting_entities=[],
+                        link_preview=False
+                    )
+                    logger.success("✅ 使用纯文本模式成功发送消息")
+                except Exception as pure_text_error:
+                    logger.error(f"❌ 纯文本发送也失败: {str(pure_text_error)}")
+                    async with self.message_lock:
+                        self.processed_messages.discard(message_id)
+                    raise
+            else:
+                async with self.message_lock:
+                    self.processed_messages.discard(message_id)
+                raise
+
+        # 记录转发映射，源消息被编辑时可以原地更新
+        self.message_map.add(job.chat_id, job.msg_id, self.target_channel[0], sent.id, job.source_hash)
+        trace.mark('text_send')
+
+        # 转发媒体消息
+        if job.media is not None:
+            try:
+                logger.info("开始转发媒体消息")
+                await asyncio.sleep(delay * 0.3)  # 媒体消息额外延迟
+                trace.mark('media_delay')
+
+                media_type = job.media_type
+                logger.info(f"媒体类型: {media_type}")
+
+                # 按该频道已知可用的投递方式排序，跳过近期确认失败的方式
+                methods, skipped = self.delivery_cache.plan(job.chat_id)
+                if skipped:
+                    self.delivery_cache.note_skipped(len(skipped))
+                    logger.info(f"跳过已知不可用的投递方式: {', '.join(skipped)}")
+
+                delivered = False
+                for method in methods:
+                    # 超时、断线等临时错误原地重试一次且不写入缓存，只有频道能力问题才标记该方式不可用
+                    for _ in range(2):
+                        try:
+                            if method == FORWARD:
+                                # 尝试直接转发消息而不是重新上传媒体
+                                logger.info("尝试直接转发原始消息...")
+                                await self.user_client.forward_messages(self.target_channel[0], job.msg_id,
+                                                                        from_peer=job.chat_id)
+                                logger.success(f"✅ 成功转发媒体消息到 {self.target_channel[0]}")
+                            else:
+                                # 重新上传（优先使用预取的缓冲区）
+                                prefetched = await self.media_prefetcher.get(message_id)
+                                await self.bot_client.send_file(
+                                    self.target_channel[0],
+                                    prefetched.source() if prefetched else job.media,
+                                    caption=forward_text[:1024],  # Telegram媒体说明长度限制
+                                    parse_mode=None,
+                                    force_document=isinstance(job.media, MessageMediaDocument)
+                                )
+                                logger.success(f"✅ 成功重新上传媒体消息到 {self.target_channel[0]}")
+                            self.delivery_cache.record(job.chat_id, method, True)
+                            trace.mark(f'media_{method}')
+                            delivered = True
+                        except FloodWaitError:
+                            # 频率限制与频道能力无关，不写入缓存
+                            raise
+                        except Exception as delivery_error:
+                            logger.warning(f"媒体投递方式 {method} 失败: {str(delivery_error)}")
+                            trace.mark(f'media_{method}')
+                            if is_capability_error(delivery_error):
+                                self.delivery_cache.record(job.chat_id, method, False)
+                                break
+                            continue
+                        break
+                    if delivered:
+                        break
+
+                if not delivered:
+                    # 如果都失败了，尝试只发送文本消息
+                    logger.info("尝试只发送文本内容...")
+                    media_info = f"\n\n[注意：原消息包含{media_type}，但由于权限限制无法转发]"
+                    text_only_message = forward_text + media_info
+
+                    await self.bot_client.send_message(
+                        self.target_channel[0],
+                        text_only_message,
+                        parse_mode=None,
+                        link_preview=False
+                    )
+                    logger.info("✅ 已发送包含媒体说明的文本消息")
+                    trace.mark('media_fallback')
+
+            except Exception as e:
+                logger.error(f"❌ 转发媒体消息失败: {str(e)}")
+                logger.warning("跳过媒体转发，继续处理其他消息")
+
+    async def _send_batch(self, job, delay):
+        """一次 forward_messages 调用转发同一源频道的多条消息，返回实际发送的任务"""
+        members = job.jobs
+        chat_id = members[0].chat_id
+        try:
+            await self.user_client.forward_messages(
+                self.target_channel[0],
+                [member.msg_id for member in members],
+                from_peer=chat_id
+            )
+        except FloodWaitError:
+            raise
+        except Exception as e:
+            # 该频道不允许转发：记入投递缓存，其余消息放回队列，本次只按原方式发送第一条
+            logger.warning(f"合并转发失败，回退为逐条发送: {str(e)}")
+            if is_capability_error(e):
+                self.delivery_cache.record(chat_id, FORWARD, False)
+            first, rest = members[0], members[1:]
+            await self._send_post(first, delay)
+            # 第一条发送成功后再放回其余消息（发送失败时整批由 _deliver 处理）
+            for member in rest:
+                self._drop_jobs(self.admission_queue.push(member, member.score, member.posted_at), 'shed')
+            return first
+
+        self.delivery_cache.record(chat_id, FORWARD, True)
+        job.trace.mark('batch_forward')
+        # 逐条发送时每条消息需要一次文本发送，带媒体的再加一次媒体投递
+        individual = sum(2 if member.media is not None else 1 for member in members)
+        self.batch_stats['batches'] += 1
+        self.batch_stats['messages'] += len(members)
+        self.batch_stats['rpc_saved'] += individual - 1
+        logger.success(f"✅ 合并转发 {len(members)} 条消息到 {self.target_channel[0]}，节省 {individual - 1} 次请求")
+        return job
+
+    async def _send_digest(self, job):
+        """发送一条摘要消息（一次发送包含多条低价值消息）"""
+        logger.info(f"开始发送摘要到 {self.target_channel[0]}，包含 {len(job.entries)} 条消息")
+        await self.bot_client.send_message(
+            self.target_channel[0],
+            job.forward_text,
+            parse_mode=None,
+            link_preview=False
+        )
+        job.trace.mark('digest_send')
+        logger.success(f"✅ 成功发送摘要到 {self.target_channel[0]}")
 
     def pause_until_work_time(self):
         """暂停监听直到工作时间"""
         self.is_listening = False
         next_work_time = self.anti_ban_strategies.get_next_work_time()
         self.pause_until = next_work_time
+        # 暂停期写入账本，重启后继续暂停；闸门在工作时间开始时由定时器重新打开
+        self._hold_sends(next_work_time.timestamp() - self.clock.time(), 'pause')
         logger.warning(f"已暂停监听，将在 {next_work_time.strftime('%Y-%m-%d %H:%M:%S')} 恢复")
 
+    def _hold_sends(self, seconds, reason):
+        """进入冷却（写入账本）并关闭发送闸门直到冷却结束"""
+        self.anti_ban_strategies.start_cooldown(seconds)
+        self.send_gate.close_until(self.anti_ban_strategies.cooldown_until, reason)
+
+    def _on_gate_open(self, reason):
+        """闸门重新打开时结束暂停"""
+        if not self.is_listening:
+            self.resume_listening()
+
     def resume_listening(self):
         """恢复监听"""
         self.is_listening = True
         self.pause_until = None
         logger.info("已恢复消息监听")
 
-    async def check_status(self):
-        """每4分钟检查一次运行状态"""
-        while True:
-            try:
-                current_time = datetime.now(pytz.timezone("Asia/Shanghai"))
-                uptime = current_time - self.start_time
-
-                status_report = [
-                    "🤖 机器人运行状态报告",
-                    f"⏰ 当前时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}",
-                    f"⌛ 已运行时间: {str(uptime).split('.')[0]}",
-                    f"📊 处理消息统计:",
-                    f"  • 总处理消息: {self.total_messages_processed}",
-                    f"  • 最后消息时间: {self.last_message_received.strftime('%Y-%m-%d %H:%M:%S') if self.last_message_received else '无'}",
-                    f"  • 缓存消息数量: {len(self.processed_messages)}",
-                    f"💡 系统状态:",
-                    f"  • 监听状态: {'✅ 正常' if self.is_listening else '⛔ 已暂停'}",
-                    f"  • 暂停时间: {self.pause_until.strftime('%Y-%m-%d %H:%M:%S') if self.pause_until else '无'}",
-                    f"  • 用户客户端: {'✅ 已连接' if self.user_client.is_connected() else '❌ 未连接'}",
-                    f"  • Bot客户端: {'✅ 已连接' if self.bot_client.is_connected() else '❌ 未连接'}",
-                    f"📈 消息限制:",
-                    f"  • 分钟内: {self.anti_ban_strategies.message_count['minute']}/{self.anti_ban_config.MAX_MESSAGES_PER_MINUTE}",
-                    f"  • 小时内: {self.anti_ban_strategies.message_count['hour']}/{self.anti_ban_config.MAX_MESSAGES_PER_HOUR}",
-                    f"  • 今日内: {self.anti_ban_strategies.message_count['day']}/{self.anti_ban_config.MAX_MESSAGES_PER_DAY}",
-                    f"⚙️ 运行参数:",
-                    f"  • 延迟倍数: {self.anti_ban_strategies.current_delay_multiplier:.2f}",
-                    f"  • 连续错误: {self.anti_ban_strategies.consecutive_errors}",
-                    f"  • 工作时间: {'✅' if self.anti_ban_strategies.is_work_time() else '❌'}",
-                    f"  • 安全时间: {'✅' if self.anti_ban_strategies.is_safe_time() else '❌'}"
-                ]
-
-                status_message = "\n".join(status_report)
-                logger.info(status_message)
-
-                # 如果有任何异常状态，添加警告
-                warnings = []
-                if not self.is_listening:
-                    warnings.append("⚠️ 机器人当前不在监听状态")
-                if not self.user_client.is_connected():
-                    warnings.append("⚠️ 用户客户端未连接")
-                if not self.bot_client.is_connected():
-                    warnings.append("⚠️ Bot客户端未连接")
-                if self.anti_ban_strategies.consecutive_errors > 0:
-                    warnings.append(f"⚠️ 存在 {self.anti_ban_strategies.consecutive_errors} 个连续错误")
-
-                if warnings:
-                    logger.warning("\n".join(warnings))
+    def _report_status(self):
+        """输出运行状态报告（定时任务每4分钟运行一次）"""
+        current_time = datetime.now(beijing_tz)
+        uptime = current_time - self.start_time
+        window = self.anti_ban_strategies.schedules.window()
+
+        status_report = [
+            "🤖 机器人运行状态报告",
+            f"⏰ 当前时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"⌛ 已运行时间: {str(uptime).split('.')[0]}",
+            f"📊 处理消息统计:",
+            f"  • 总处理消息: {self.total_messages_processed}",
+            f"  • 最后消息时间: {self.last_message_received.strftime('%Y-%m-%d %H:%M:%S') if self.last_message_received else '无'}",
+            f"  • 缓存消息数量: {len(self.processed_messages)}",
+            f"  • 编辑同步: {self.edits_synced} 条，未变化跳过: {self.edits_skipped} 条",
+            f"  • 媒体预取: {self.media_prefetcher.stats}，占用内存: {self.media_prefetcher.memory_in_use} 字节，"
+            f"落盘: {self.media_prefetcher.spill_in_use} 字节",
+            f"  • 投递方式缓存: {self.delivery_cache.snapshot()}",
+            f"  • 发送队列: {len(self.admission_queue)} 条，{self.admission_queue.stats}",
+            *([f"  • 合并转发: {self.batch_stats}"] if self.anti_ban_config.BATCH_FORWARD_ENABLED else []),
+            *([f"  • 摘要: 待合并 {len(self.digest_buffer)} 条，{self.digest_buffer.stats}"]
+              if self.digest_buffer is not None else []),
+            *([f"  • 轮询频道: {self.poller.snapshot()}，{self.poller.stats}"] if POLL_CHANNELS else []),
+            f"  • 消息ID缺口: {self.gap_tracker.stats}，待补拉 {self.gap_tracker.pending()} 条",
+            f"  • 垃圾消息分类: {self.spam_classifier.snapshot()}",
+            f"  • 链接检查: {self.link_check_stats}，t.me 解析: {self.telegram_links.stats}",
+            "🧮 处理流水线:",
+            *self.pipeline.report_lines(),
+            "⏱️ 阶段耗时:",
+            *self.tracer.report_lines(),
+            f"💡 系统状态:",
+            f"  • 监听状态: {'✅ 正常' if self.is_listening else '⛔ 已暂停'}",
+            f"  • 暂停时间: {self.pause_until.strftime('%Y-%m-%d %H:%M:%S') if self.pause_until else '无'}",
+            f"  • 用户客户端: {'✅ 已连接' if self.user_client.is_connected() else '❌ 未连接'}",
+            f"  • Bot客户端: {'✅ 已连接' if self.bot_client.is_connected() else '❌ 未连接'}",
+            *([f"  • Bot API 请求: {self.bot_client.stats}"] if BOT_TRANSPORT == "http" else []),
+            *[f"  • {supervisor.name}重连: {supervisor.snapshot()}" for supervisor in self.supervisors],
+            f"  • 发送闸门: {self.send_gate.snapshot()}",
+            "⏲️ 定时任务:",
+            *self.scheduler.report_lines(),
+            f"📈 消息限制:",
+            f"  • 分钟内: {self.anti_ban_strategies.message_count['minute']}/{self.anti_ban_config.MAX_MESSAGES_PER_MINUTE}",
+            f"  • 小时内: {self.anti_ban_strategies.message_count['hour']}/{self.anti_ban_config.MAX_MESSAGES_PER_HOUR}",
+            f"  • 今日内: {self.anti_ban_strategies.message_count['day']}/{self.anti_ban_config.MAX_MESSAGES_PER_DAY}",
+            f"⚙️ 运行参数:",
+            f"  • 延迟倍数: {self.anti_ban_strategies.current_delay_multiplier:.2f}",
+            f"  • 连续错误: {self.anti_ban_strategies.consecutive_errors}",
+            f"  • 工作时间: {'✅' if window.in_work_hours else '❌'}",
+            f"  • 安全时间: {'✅' if window.is_safe else '❌'}"
+        ]
 
-            except Exception as e:
-                logger.error(f"状态检查出错: {e}")
+        status_message = "\n".join(status_report)
+        logger.info(status_message)
+
+        # 如果有任何异常状态，添加警告
+        warnings = []
+        if not self.is_listening:
+            warnings.append("⚠️ 机器人当前不在监听状态")
+        if not self.user_client.is_connected():
+            warnings.append("⚠️ 用户客户端未连接")
+        if not self.bot_client.is_connected():
+            warnings.append("⚠️ Bot客户端未连接")
+        if self.anti_ban_strategies.consecutive_errors > 0:
+            warnings.append(f"⚠️ 存在 {self.anti_ban_strategies.consecutive_errors} 个连续错误")
+
+        if warnings:
+            logger.warning("\n".join(warnings))
 
-            # 等待4分钟
-            await asyncio.sleep(240)
 
     async def cleanup(self):
-        """清理资源"""
-        logger.info("开始清理资源...")
+        """在限定时间内优雅关闭：停止接收 -> 排空发送 -> 写检查点 -> 发送剩余日志 -> 保存状态 -> 断开连接"""
+        if self.cleaned_up:
+            return
+        self.cleaned_up = True
+        logger.info(f"开始清理资源（限时 {SHUTDOWN_DEADLINE:.0f} 秒）...")
         self.running = False
+        deadline = time.monotonic() + SHUTDOWN_DEADLINE
+        step_start = time.monotonic()
+
+        def step_done(name):
+            nonlocal step_start
+            now = time.monotonic()
+            logger.info(f"  • {name} 完成，耗时 {now - step_start:.2f} 秒")
+            step_start = now
 
-        # 停止所有任务
+        # 1. 停止接收新消息，停止后台任务
+        self.accepting = False
         for task in self.tasks:
             if not task.done():
                 task.cancel()
-
-        # 等待任务完成
         if self.tasks:
             await asyncio.gather(*self.tasks, return_exceptions=True)
+        await self.scheduler.shutdown()
+        step_done("停止接收")
+
+        # 2. 还在预处理和排队的消息直接写检查点；正在发送的消息等待完成（预留3秒给日志和状态保存）
+        waiting = list(self.inflight.values())
+        for job in waiting:
+            job['task'].cancel()
+        interrupted = []
+        finished = 0
+        if self.sender_task and not self.sender_task.done():
+            delivering = self.delivering
+            if delivering:
+                await asyncio.wait([self.sender_task], timeout=max(0.0, deadline - time.monotonic() - 3))
+                if self.delivering is delivering:
+                    interrupted.append(delivering)
+                else:
+                    finished = 1
+            self.sender_task.cancel()
+            await asyncio.gather(self.sender_task, return_exceptions=True)
+        queued = self.admission_queue.drain()
+        if waiting:
+            await asyncio.sleep(0)  # 让被取消的任务执行清理
+        step_done(f"排空发送（完成 {finished} 条，中断 {len(interrupted)} 条，队列中 {len(queued)} 条）")
+
+        # 3. 写检查点，下次启动继续处理
+        pending = {}
+        for job in waiting:
+            pending[(job['chat_id'], job['msg_id'])] = {
+                'chat_id': job['chat_id'], 'msg_id': job['msg_id'], 'channel': job['channel']}
+        for job in interrupted + queued:
+            for chat_id, msg_id, channel_name in job.posts():
+                pending[(chat_id, msg_id)] = {'chat_id': chat_id, 'msg_id': msg_id, 'channel': channel_name}
+        if self.digest_buffer is not None:
+            for entry in self.digest_buffer.drain():
+                pending[(entry.chat_id, entry.msg_id)] = {
+                    'chat_id': entry.chat_id, 'msg_id': entry.msg_id, 'channel': entry.channel}
+        for entry in self.late_arrivals:
+            pending[(entry['chat_id'], entry['msg_id'])] = entry
+        if pending:
+            self.pending_checkpoint.save(list(pending.values()))
+        step_done(f"写检查点（{len(pending)} 条）")
+
+        # 4. 在当前事件循环中发送剩余日志
+        if self.telegram_log_handler:
+            await self.telegram_log_handler.stop(timeout=max(1.0, deadline - time.monotonic() - 1))
+        step_done("发送剩余日志")
+
+        # 5. 保存消息映射、限流账本和转发流水
+        self.message_map.save()
+        self.poller.save()
+        self.journal.close()
+        try:
+            self.stats_store.record(self._collect_stats())
+        except Exception as e:
+            logger.error(f"写入历史统计失败: {e}")
+        self.stats_store.close()
+        if self.anti_ban_strategies.ledger:
+            self.anti_ban_strategies.ledger.close()
+        step_done("保存状态")
 
-        # 关闭客户端连接
+        # 6. 关闭客户端连接
         if self.user_client:
             await self.user_client.disconnect()
         if self.bot_client:
             await self.bot_client.disconnect()
-
-        # 停止日志处理器
-        if self.telegram_log_handler:
-            self.telegram_log_handler.stop()
+        step_done("断开连接")
 
         logger.info("资源清理完成")
 
@@ -914,7 +1685,8 @@ class MessageForwarder:
 
             # 初始化并启动Telegram日志处理器
             global telegram_log_handler
-            self.telegram_log_handler = TelegramLogHandler(self.bot_client, LOGS_CHANNEL[0])
+            self.telegram_log_handler = TelegramLogHandler(self.bot_client, LOGS_CHANNEL[0], self.send_gate,
+                                                           self.scheduler)
             telegram_log_handler = self.telegram_log_handler
             await self.telegram_log_handler.start()
 
@@ -927,18 +1699,42 @@ class MessageForwarder:
             for i, handler in enumerate(event_handlers):
                 logger.debug(f"  处理器{i + 1}: {handler}")
 
+            # 重启前留下的冷却尚未结束时继续暂停
+            if self.anti_ban_strategies.cooldown_remaining() > 0:
+                self.is_listening = False
+                self.pause_until = datetime.fromtimestamp(self.anti_ban_strategies.cooldown_until, beijing_tz)
+                self.send_gate.close_until(self.anti_ban_strategies.cooldown_until, 'restored')
+                logger.warning(f"上次运行的冷却尚未结束，将在 {self.pause_until.strftime('%Y-%m-%d %H:%M:%S')} 恢复")
+
             logger.info("等待新消息中...")
 
-            # 启动状态监控任务
+            # 处理上次关闭时未完成的消息
+            await self._resume_pending()
+
+            # 启动发送调度（不放入 self.tasks：关闭时先等待正在发送的消息）
+            self.sender_task = self.loop.create_task(self._send_loop())
+
+            # 注册周期任务（抖动错开同时到期的任务）
+            self.scheduler.every('status_log', 240, self._report_status, jitter=5, delay=0)
+            self.scheduler.every('status_post', 1800, self._post_status_report, jitter=30)
+            self.scheduler.every('journal_flush', self.journal.flush_interval, self.journal.flush)
+            self.scheduler.every('message_map_flush', 30, self.message_map.save)
+            if POLL_CHANNELS:
+                # 定期保存轮询水位线，异常退出后不会从旧水位线重复转发
+                self.scheduler.every('poll_state_flush', 30, self.poller.save)
+            self.scheduler.every('stats', STATS_INTERVAL, self._record_stats, jitter=5)
+            self.scheduler.every('spam_model_reload', 60, self.spam_classifier.maybe_reload)
+            if self.digest_buffer is not None:
+                self.scheduler.every('digest', 30, self._pack_digests)
+
             self.tasks.extend([
-                self.loop.create_task(self._monitor_status()),
-                self.loop.create_task(self._periodic_status_check()),
-                self.loop.create_task(self.check_status())
+                self.loop.create_task(self.scheduler.run()),
+                *[self.loop.create_task(supervisor.run()) for supervisor in self.supervisors],
+                self.loop.create_task(self.poller.run()),
             ])
 
             # 运行直到收到停止信号
-            while self.running:
-                await asyncio.sleep(1)
+            await self.stopped.wait()
 
         except Exception as e:
             logger.error(f"启动时出错: {str(e)}")
@@ -952,68 +1748,81 @@ class MessageForwarder:
         """处理系统信号"""
         logger.info(f"收到信号 {sig.name}，准备关闭...")
         self.running = False
+        self.stopped.set()
+
+    def _collect_stats(self):
+        """本周期的统计采样：[(频道, 指标, 值)]，计数类取本周期增量，状态类取当前值"""
+        counters = defaultdict(int)
+        for (channel_name, event), count in self.journal.counts.items():
+            counters[(channel_name, event)] += count
+            counters[(ALL_CHANNELS, event)] += count
+        counters[(ALL_CHANNELS, 'processed')] = self.total_messages_processed
+        counters[(ALL_CHANNELS, 'edits_synced')] = self.edits_synced
+        counters[(ALL_CHANNELS, 'shed')] = self.admission_queue.stats['shed']
+        counters[(ALL_CHANNELS, 'expired')] = self.admission_queue.stats['expired']
+        counters[(ALL_CHANNELS, 'rpc_saved')] = self.batch_stats['rpc_saved']
+        samples = self.stats_deltas.deltas(counters)
+
+        strategies = self.anti_ban_strategies
+        samples.extend((ALL_CHANNELS, metric, value) for metric, value in (
+            ('queue_length', len(self.admission_queue)),
+            ('delay_multiplier', strategies.current_delay_multiplier),
+            ('consecutive_errors', strategies.consecutive_errors),
+            ('cooldown_remaining', strategies.cooldown_remaining()),
+            ('sent_last_hour', strategies.message_count['hour']),
+            ('sent_today', strategies.message_count['day']),
+            ('gap_pending', self.gap_tracker.pending()),
+            ('listening', int(self.is_listening)),
+        ))
+        return samples
+
+    def _record_stats(self):
+        """把统计采样写入历史统计库并汇总"""
+        self.stats_store.record(self._collect_stats())
+        self.stats_store.rollup()
+
+    async def _post_status_report(self):
+        """向日志频道发送系统状态报告（定时任务每30分钟运行一次）"""
+        # 获取当前时间
+        current_time = datetime.now(beijing_tz)
+
+        # 检查工作状态
+        window = self.anti_ban_strategies.schedules.window()
+        is_work_time = window.in_work_hours
+        is_safe_time = window.is_safe
+        can_send = self.anti_ban_strategies.can_send_message()
+
+        # 构建状态报告
+        status_report = [
+            "📊 系统状态报告",
+            f"⏰ 当前时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}",
+            f"🎯 监听状态: {'✅ 正在监听' if self.is_listening else '⏸️ 已暂停'}",
+            f"⌛ 暂停时间: {self.pause_until.strftime('%Y-%m-%d %H:%M:%S') if self.pause_until else '无'}",
+            f"👥 用户客户端: {'✅ 已连接' if self.user_client.is_connected() else '❌ 未连接'}",
+            f"🤖 Bot客户端: {'✅ 已连接' if self.bot_client.is_connected() else '❌ 未连接'}",
+            f"📈 消息统计:",
+            f"  • 分钟内: {self.anti_ban_strategies.message_count['minute']}/{self.anti_ban_config.MAX_MESSAGES_PER_MINUTE}",
+            f"  • 小时内: {self.anti_ban_strategies.message_count['hour']}/{self.anti_ban_config.MAX_MESSAGES_PER_HOUR}",
+            f"  • 今日内: {self.anti_ban_strategies.message_count['day']}/{self.anti_ban_config.MAX_MESSAGES_PER_DAY}",
+            f"⚙️ 系统检查:",
+            f"  • 工作时间: {'✅' if is_work_time else '❌'}",
+            f"  • 安全时间: {'✅' if is_safe_time else '❌'}",
+            f"  • 发送限制: {'✅ 可发送' if can_send else '❌ 已限制'}",
+            f"  • 已处理消息数: {len(self.processed_messages)}",
+            f"  • 延迟倍数: {self.anti_ban_strategies.current_delay_multiplier:.2f}",
+            f"  • 连续错误: {self.anti_ban_strategies.consecutive_errors}"
+        ]
 
-    async def _monitor_status(self):
-        """监控状态，定期检查是否需要恢复监听"""
-        while True:
-            try:
-                if not self.is_listening and self.pause_until:
-                    if datetime.now(beijing_tz) >= self.pause_until and self.anti_ban_strategies.is_work_time():
-                        self.resume_listening()
-                await asyncio.sleep(60)  # 每分钟检查一次
-            except Exception as e:
-                logger.error(f"状态监控出错: {e}")
-                await asyncio.sleep(60)
-
-    async def _periodic_status_check(self):
-        """定期检查系统状态并发送报告"""
-        while True:
-            try:
-                # 每30分钟执行一次状态检查
-                await asyncio.sleep(1800)
-
-                # 获取当前时间
-                current_time = datetime.now(beijing_tz)
-
-                # 检查工作状态
-                is_work_time = self.anti_ban_strategies.is_work_time()
-                is_safe_time = self.anti_ban_strategies.is_safe_time()
-                can_send = self.anti_ban_strategies.can_send_message()
-
-                # 构建状态报告
-                status_report = [
-                    "📊 系统状态报告",
-                    f"⏰ 当前时间: {current_time.strftime('%Y-%m-%d %H:%M:%S')}",
-                    f"🎯 监听状态: {'✅ 正在监听' if self.is_listening else '⏸️ 已暂停'}",
-                    f"⌛ 暂停时间: {self.pause_until.strftime('%Y-%m-%d %H:%M:%S') if self.pause_until else '无'}",
-                    f"👥 用户客户端: {'✅ 已连接' if self.user_client.is_connected() else '❌ 未连接'}",
-                    f"🤖 Bot客户端: {'✅ 已连接' if self.bot_client.is_connected() else '❌ 未连接'}",
-                    f"📈 消息统计:",
-                    f"  • 分钟内: {self.anti_ban_strategies.message_count['minute']}/{self.anti_ban_config.MAX_MESSAGES_PER_MINUTE}",
-                    f"  • 小时内: {self.anti_ban_strategies.message_count['hour']}/{self.anti_ban_config.MAX_MESSAGES_PER_HOUR}",
-                    f"  • 今日内: {self.anti_ban_strategies.message_count['day']}/{self.anti_ban_config.MAX_MESSAGES_PER_DAY}",
-                    f"⚙️ 系统检查:",
-                    f"  • 工作时间: {'✅' if is_work_time else '❌'}",
-                    f"  • 安全时间: {'✅' if is_safe_time else '❌'}",
-                    f"  • 发送限制: {'✅ 可发送' if can_send else '❌ 已限制'}",
-                    f"  • 已处理消息数: {len(self.processed_messages)}",
-                    f"  • 延迟倍数: {self.anti_ban_strategies.current_delay_multiplier:.2f}",
-                    f"  • 连续错误: {self.anti_ban_strategies.consecutive_errors}"
-                ]
-
-                # 发送状态报告
-                status_message = "\n".join(status_report)
-                if self.bot_client and self.bot_client.is_connected():
-                    await self.bot_client.send_message(LOGS_CHANNEL[0], status_message)
-                    logger.info("✅ 已发送状态报告")
-
-            except Exception as e:
-                logger.error(f"状态检查出错: {e}")
-                await asyncio.sleep(300)  # 出错后等待5分钟再试
+        # 发送状态报告
+        status_message = "\n".join(status_report)
+        if self.bot_client and self.bot_client.is_connected() and self.send_gate.is_open:
+            await self.bot_client.send_message(LOGS_CHANNEL[0], status_message)
+            logger.info("✅ 已发送状态报告")
 
 
 def main():
     """主函数"""
+    setup_logging()
     forwarder = None
     try:
         # 启动 Flask 在新线程
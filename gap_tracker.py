@@ -0,0 +1,97 @@
+# 消息ID缺口检测：频道消息ID连续递增，新消息的ID跳号说明中间的更新可能在重连时丢失，稍等后批量补拉
+from clock import SystemClock
+
+# get_messages(ids=[...]) 单次请求最多100个ID
+FETCH_BATCH_SIZE = 100
+
+# 补拉失败后重试的最长等待（秒），频率限制要求的等待更长时以其为准
+MAX_RETRY_DELAY = 600
+
+
+class GapTracker:
+    """记录每个源频道见过的最大消息ID，发现跳号时登记缺失的ID，等待一个短窗口后批量补拉"""
+
+    def __init__(self, fill_delay=5, max_gap=100, clock=None):
+        self.fill_delay = fill_delay  # 发现缺口后等待的秒数（乱序到达的消息在此期间会自行补上）
+        self.max_gap = max_gap  # 单个缺口最多补拉的消息数，更早的视为过旧
+        self.clock = clock if clock is not None else SystemClock()
+        self._last = {}  # chat_id -> 见过的最大消息ID
+        self._missing = {}  # chat_id -> {消息ID: 到期时间}
+        self._fetching = {}  # chat_id -> {正在补拉的消息ID}，成功后移除，失败时放回 _missing
+        self._attempts = {}  # chat_id -> 连续补拉失败次数
+        self._channels = {}  # chat_id -> 频道名
+        self.stats = {'gaps': 0, 'missing': 0, 'late': 0, 'filled': 0, 'empty': 0, 'too_old': 0, 'retries': 0}
+
+    def observe(self, chat_id, msg_id, channel):
+        """记录一条收到的消息，ID跳号时登记缺失的ID"""
+        self._channels[chat_id] = channel
+        missing = self._missing.get(chat_id)
+        if missing and missing.pop(msg_id, None) is not None:
+            # 乱序到达，不再需要补拉
+            self.stats['late'] += 1
+            if not missing:
+                del self._missing[chat_id]
+            return
+
+        last = self._last.get(chat_id)
+        if last is not None and msg_id > last + 1:
+            gap = msg_id - last - 1
+            first = max(last + 1, msg_id - self.max_gap)
+            due = self.clock.time() + self.fill_delay
+            self._missing.setdefault(chat_id, {}).update({i: due for i in range(first, msg_id)})
+            self.stats['gaps'] += 1
+            self.stats['missing'] += msg_id - first
+            self.stats['too_old'] += gap - (msg_id - first)
+        if last is None or msg_id > last:
+            self._last[chat_id] = msg_id
+
+    def due(self):
+        """取出到期的缺口：[(chat_id, 频道名, [消息ID...])]，每批最多 FETCH_BATCH_SIZE 个
+        一个频道有任一缺失ID到期时，该频道已登记的全部缺失ID一起补拉；
+        取出的ID在 resolve（补拉成功）或 retry（失败放回）之前不会再次到期
+        """
+        now = self.clock.time()
+        batches = []
+        for chat_id in [chat_id for chat_id, missing in self._missing.items() if min(missing.values()) <= now]:
+            ids = sorted(self._missing.pop(chat_id))
+            self._fetching.setdefault(chat_id, set()).update(ids)
+            for start in range(0, len(ids), FETCH_BATCH_SIZE):
+                batches.append((chat_id, self._channels[chat_id], ids[start:start + FETCH_BATCH_SIZE]))
+        return batches
+
+    def resolve(self, chat_id, ids):
+        """一批补拉成功，不再跟踪这些ID"""
+        self._attempts.pop(chat_id, None)
+        self._forget(chat_id, ids)
+
+    def retry(self, chat_id, ids, min_delay=0):
+        """一批补拉失败，按连续失败次数指数退避后重新补拉（不短于 min_delay 秒）"""
+        self._forget(chat_id, ids)
+        attempts = self._attempts[chat_id] = self._attempts.get(chat_id, 0) + 1
+        delay = max(min_delay, min(self.fill_delay * 2 ** attempts, MAX_RETRY_DELAY))
+        due = self.clock.time() + delay
+        missing = self._missing.setdefault(chat_id, {})
+        for msg_id in ids:
+            missing.setdefault(msg_id, due)
+        self.stats['retries'] += 1
+        return delay
+
+    def _forget(self, chat_id, ids):
+        fetching = self._fetching.get(chat_id)
+        if fetching:
+            fetching.difference_update(ids)
+            if not fetching:
+                del self._fetching[chat_id]
+
+    def next_due(self):
+        """最早的补拉到期时间，没有缺口时为 None"""
+        return min((min(missing.values()) for missing in self._missing.values()), default=None)
+
+    def pending(self):
+        return (sum(len(missing) for missing in self._missing.values())
+                + sum(len(fetching) for fetching in self._fetching.values()))
+
+    def record_fill(self, filled, empty):
+        """记录一次补拉结果：filled 为补回的消息数，empty 为已删除或系统消息数"""
+        self.stats['filled'] += filled
+        self.stats['empty'] += empty
@@ -0,0 +1,87 @@
+# 冷启动导入耗时检查：用 python -X importtime 测量导入 forward_bot 的耗时，超出预算或提前导入了重型依赖时返回非零
+import argparse
+import json
+import os
+import re
+import statistics
+import subprocess
+import sys
+
+# import time:  self [us] | cumulative | imported package
+IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+# 这些依赖只在首次使用时导入，启动阶段不应出现
+# （aiohttp 不在其中：安装了 aiohttp 时 telethon.client.downloads 会自行导入；bot_api 只在 BOT_TRANSPORT=http 时导入）
+LAZY_MODULES = ["flask", "waitress", "werkzeug", "bot_api"]
+
+
+def measure(module, python=sys.executable):
+    """在新进程中导入 module，返回 {模块: (自身耗时us, 累计耗时us, 层级)}"""
+    env = dict(os.environ, PYTHONDONTWRITEBYTECODE="1")
+    result = subprocess.run([python, "-X", "importtime", "-c", f"import {module}"],
+                            capture_output=True, text=True, env=env,
+                            cwd=os.path.dirname(os.path.abspath(__file__)))
+    if result.returncode != 0:
+        raise RuntimeError(f"导入 {module} 失败:\n{result.stderr[-2000:]}")
+    modules = {}
+    for line in result.stderr.splitlines():
+        match = IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+def summarize(runs, module, top):
+    """多次测量取中位数"""
+    totals = [run[module][1] / 1000 for run in runs]
+    last = runs[-1]
+    top_level = sorted(((name, cumulative / 1000) for name, (_, cumulative, depth) in last.items() if depth == 1),
+                       key=lambda item: item[1], reverse=True)[:top]
+    return {
+        'module': module,
+        'runs': len(runs),
+        'total_ms': round(statistics.median(totals), 1),
+        'min_ms': round(min(totals), 1),
+        'max_ms': round(max(totals), 1),
+        'top_imports': [{'module': name, 'ms': round(ms, 1)} for name, ms in top_level],
+        'eager_lazy_modules': sorted({name.split(".")[0] for name in last} & set(LAZY_MODULES)),
+    }
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="冷启动导入耗时检查")
+    parser.add_argument("--module", default="forward_bot", help="要测量的模块")
+    parser.add_argument("--runs", type=int, default=5, help="测量次数（取中位数）")
+    parser.add_argument("--budget-ms", type=float, default=float(os.getenv("IMPORT_BUDGET_MS", 600)),
+                        help="导入耗时预算（毫秒），中位数超过时失败")
+    parser.add_argument("--top", type=int, default=10, help="列出最慢的顶层导入数")
+    parser.add_argument("--json", action="store_true", help="输出JSON")
+    args = parser.parse_args(argv)
+
+    runs = [measure(args.module) for _ in range(max(1, args.runs))]
+    report = summarize(runs, args.module, args.top)
+    failures = []
+    if report['total_ms'] > args.budget_ms:
+        failures.append(f"导入耗时 {report['total_ms']:.1f}ms 超出预算 {args.budget_ms:.0f}ms")
+    if report['eager_lazy_modules']:
+        failures.append(f"启动时导入了应延迟导入的模块: {', '.join(report['eager_lazy_modules'])}")
+    report['budget_ms'] = args.budget_ms
+    report['failures'] = failures
+
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+    else:
+        print(f"{args.module}: 中位数 {report['total_ms']:.1f}ms（{report['min_ms']:.1f}~{report['max_ms']:.1f}ms，"
+              f"{report['runs']} 次），预算 {args.budget_ms:.0f}ms")
+        for item in report['top_imports']:
+            print(f"  {item['module']:<32} {item['ms']:>8.1f}ms")
+        for failure in failures:
+            print(f"❌ {failure}")
+        if not failures:
+            print("✅ 通过")
+    return 1 if failures else 0
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,97 @@
+# 发送队列内存基准：比较排队期间持有完整 Telethon Message（及 get_chat 结果）和只保留 PostJob 记录的内存占用
+import argparse
+import gc
+import json
+import random
+import time
+import tracemalloc
+from datetime import datetime, timezone
+
+from telethon.tl.types import (Channel, ChatPhotoEmpty, Message, MessageEntityBold, MessageEntityMention,
+                               MessageEntityUrl, MessageMediaPhoto, PeerChannel, Photo, PhotoSize)
+
+from jobs import PostJob
+from tracing import MessageTrace
+
+WORDS = ["招聘", "远程", "Python", "后端", "开发", "工程师", "薪资", "面议", "全职", "岗位", "要求", "经验",
+         "团队", "福利", "简历", "联系", "hiring", "remote", "developer"]
+
+
+def fake_message(rng, chat_id, msg_id, with_media):
+    """构造一条与源频道招聘消息大小相近的 Message（正文约500字符、若干实体，部分带图片）"""
+    text = " ".join(rng.choice(WORDS) for _ in range(120)) + f" https://example.com/jobs/{msg_id} @hr_contact"
+    entities = [MessageEntityBold(0, 10), MessageEntityUrl(len(text) - 45, 33),
+                MessageEntityMention(len(text) - 11, 11)]
+    media = None
+    if with_media:
+        media = MessageMediaPhoto(photo=Photo(
+            id=rng.getrandbits(62), access_hash=rng.getrandbits(62), file_reference=rng.randbytes(32),
+            date=datetime.now(timezone.utc), dc_id=5,
+            sizes=[PhotoSize("m", 320, 320, 24000), PhotoSize("x", 800, 800, 90000)]))
+    return Message(id=msg_id, peer_id=PeerChannel(chat_id), date=datetime.now(timezone.utc), message=text,
+                   entities=entities, media=media, views=rng.randint(10, 5000), post=True)
+
+
+def fake_chat(chat_id):
+    return Channel(id=chat_id, title="远程工作招聘频道", photo=ChatPhotoEmpty(), date=datetime.now(timezone.utc),
+                   username=f"channel{chat_id}", access_hash=chat_id * 7919, broadcast=True)
+
+
+def legacy_job(message, chat):
+    """改动前：排队/等待期间整条 Message 和 get_chat 结果一直被协程持有"""
+    return {'key': f"@channel{chat.id}:{message.id}", 'message': message, 'chat': chat,
+            'channel': f"@channel{chat.id}", 'forward_text': f"🔄 转发自: @{chat.username}\n\n{message.message}",
+            'score': 2.0, 'received_at': time.time(), 'trace': MessageTrace()}
+
+
+def record_job(message, chat):
+    """改动后：入队时只保留发送需要的字段"""
+    return PostJob.from_message(f"@channel{chat.id}:{message.id}", message, f"@channel{chat.id}",
+                                f"🔄 转发自: @{chat.username}\n\n{message.message}",
+                                ["https://example.com/jobs/1"], "0" * 16, False, 2.0, time.time(), MessageTrace())
+
+
+def measure(count, build, seed, media_ratio):
+    """构造 count 条任务，返回任务本身占用的字节数（Message 在构造后即释放，只计任务保留的部分）"""
+    rng = random.Random(seed)
+    gc.collect()
+    tracemalloc.start()
+    before = tracemalloc.get_traced_memory()[0]
+    jobs = []
+    for i in range(count):
+        chat_id = 1000 + i % 24
+        message = fake_message(rng, chat_id, i + 1, rng.random() < media_ratio)
+        jobs.append(build(message, fake_chat(chat_id)))
+        del message
+    gc.collect()
+    used = tracemalloc.get_traced_memory()[0] - before
+    tracemalloc.stop()
+    return used, jobs
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="发送队列内存基准")
+    parser.add_argument("--jobs", type=int, default=10000, help="排队任务数")
+    parser.add_argument("--media-ratio", type=float, default=0.3, help="带图片的消息比例")
+    parser.add_argument("--seed", type=int, default=1)
+    parser.add_argument("--json", action="store_true", help="输出JSON")
+    args = parser.parse_args(argv)
+
+    results = {}
+    for name, build in (("message", legacy_job), ("record", record_job)):
+        used, jobs = measure(args.jobs, build, args.seed, args.media_ratio)
+        results[name] = {'bytes': used, 'per_job': round(used / args.jobs)}
+        del jobs
+    results['saved_ratio'] = round(1 - results['record']['bytes'] / results['message']['bytes'], 3)
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+    print(f"{args.jobs} 条排队任务（{args.media_ratio:.0%} 带图片）")
+    for name, label in (("message", "持有 Message"), ("record", "PostJob 记录")):
+        print(f"  {label:<14} {results[name]['bytes'] / 1024 / 1024:>8.2f} MB  每条 {results[name]['per_job']:>6} 字节")
+    print(f"  节省 {results['saved_ratio']:.1%}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# 发送任务记录：入队时把 Telethon Message 转成只含发送所需字段的不可变小记录，不再持有原消息对象
+from collections import namedtuple
+
+from telethon.tl.types import MessageMediaPhoto, MessageMediaDocument
+
+
+def describe_media(media):
+    """媒体类型说明（用于日志和无法转发媒体时的文字说明）"""
+    if isinstance(media, MessageMediaPhoto):
+        return "图片"
+    if isinstance(media, MessageMediaDocument):
+        attributes = media.document.attributes
+        file_name = next((attr.file_name for attr in attributes if hasattr(attr, 'file_name')), None)
+        mime_type = media.document.mime_type
+        return f"文档 (MIME: {mime_type}, 文件名: {file_name})" if file_name else f"文档 (MIME: {mime_type})"
+    return None
+
+
+class PostJob(namedtuple("PostJob", ["key", "chat_id", "msg_id", "channel", "posted_at", "forward_text", "urls",
+                                     "source_hash", "media", "media_type", "noforwards", "score", "received_at", "trace"])):
+    """一条待发送的源消息
+    media 只保留可转发/重新上传的照片或文档（MessageMedia 对象），其他媒体为 None
+    source_hash 是链接标注前源消息文本的摘要，发送后记入消息映射，用于判断源消息编辑是否改变了内容
+    """
+
+    __slots__ = ()
+
+    @classmethod
+    def from_message(cls, key, message, channel, forward_text, urls, source_hash, noforwards, score, received_at,
+                     trace):
+        media = message.media if isinstance(message.media, (MessageMediaPhoto, MessageMediaDocument)) else None
+        return cls(key, message.chat_id, message.id, channel, message.date.timestamp(), forward_text, tuple(urls),
+                   source_hash, media, describe_media(media), noforwards, score, received_at, trace)
+
+    def posts(self):
+        """包含的源消息 [(chat_id, msg_id, 频道)]"""
+        return [(self.chat_id, self.msg_id, self.channel)]
+
+    def members(self):
+        """占用预取缓冲和追踪记录的单条任务"""
+        return (self,)
+
+
+# 摘要中的一条消息
+DigestEntry = namedtuple("DigestEntry", ["summary", "score", "chat_id", "msg_id", "channel", "received_at"])
+
+
+class DigestJob(namedtuple("DigestJob", ["key", "entries", "channel", "forward_text", "score", "received_at",
+                                         "trace"])):
+    """一条摘要消息，包含多条低价值消息"""
+
+    __slots__ = ()
+
+    def posts(self):
+        return [(entry.chat_id, entry.msg_id, entry.channel) for entry in self.entries]
+
+    def members(self):
+        return (self,)
+
+
+class BatchJob(namedtuple("BatchJob", ["key", "jobs", "channel", "score", "received_at", "trace"])):
+    """同一源频道一次合并转发的多条消息"""
+
+    __slots__ = ()
+
+    def posts(self):
+        return [post for job in self.jobs for post in job.posts()]
+
+    def members(self):
+        return self.jobs
@@ -0,0 +1,186 @@
+# 转发流水日志：结构化JSON行，批量写入，按大小/时间轮转并gzip压缩，附带查询命令行
+import argparse
+import glob
+import gzip
+import json
+import os
+import shutil
+import time
+from collections import defaultdict
+from datetime import datetime
+
+import pytz
+from loguru import logger
+
+beijing_tz = pytz.timezone("Asia/Shanghai")
+
+# 当前写入的文件名，轮转后压缩为 journal-YYYYmmdd-HHMMSS-ffffff.jsonl.gz
+ACTIVE_FILE = "journal.jsonl"
+
+
+class ForwardJournal:
+    """追加写入的转发流水（received/skipped/sent/failed 事件）"""
+
+    def __init__(self, directory, batch_size=50, flush_interval=5, max_bytes=8 * 1024 * 1024,
+                 max_age=86400, keep_files=60, text_chars=512):
+        self.directory = directory
+        self.batch_size = batch_size  # 缓冲条数达到后立即写入
+        self.flush_interval = flush_interval  # 定时写入间隔（秒）
+        self.max_bytes = max_bytes  # 单个文件超过该大小轮转
+        self.max_age = max_age  # 单个文件超过该时长轮转
+        self.keep_files = keep_files  # 保留的压缩文件数
+        self.text_chars = text_chars  # received 事件保留的文本长度
+        self.active_path = os.path.join(directory, ACTIVE_FILE)
+        self._buffer = []
+        self._opened_at = None
+        self.counts = defaultdict(int)  # (频道, 事件) -> 本次运行的累计数（历史统计按周期取增量）
+
+    def record(self, event, channel, msg_id=None, **fields):
+        """记录一条事件（先进入缓冲区）"""
+        entry = {'ts': round(time.time(), 3), 'ev': event, 'ch': channel, 'id': msg_id}
+        self.counts[(channel, event)] += 1
+        if 'text' in fields and fields['text']:
+            fields['text'] = fields['text'][:self.text_chars]
+        entry.update(fields)
+        self._buffer.append(entry)
+        if len(self._buffer) >= self.batch_size:
+            self.flush()
+
+    def flush(self):
+        """把缓冲区写入文件，必要时轮转"""
+        if not self._buffer:
+            return
+        lines = "".join(json.dumps(entry, ensure_ascii=False, separators=(",", ":")) + "\n"
+                        for entry in self._buffer)
+        self._buffer = []
+        try:
+            os.makedirs(self.directory, exist_ok=True)
+            if self._opened_at is None:
+                self._opened_at = (os.path.getmtime(self.active_path)
+                                   if os.path.exists(self.active_path) else time.time())
+            with open(self.active_path, "a", encoding="utf-8") as f:
+                f.write(lines)
+            if (os.path.getsize(self.active_path) >= self.max_bytes or
+                    time.time() - self._opened_at >= self.max_age):
+                self.rotate()
+        except Exception as e:
+            logger.error(f"写入转发流水失败: {e}")
+
+    def rotate(self):
+        """压缩当前文件并开始新文件"""
+        if not os.path.exists(self.active_path):
+            return
+        stamp = datetime.now(beijing_tz).strftime("%Y%m%d-%H%M%S-%f")
+        archive = os.path.join(self.directory, f"journal-{stamp}.jsonl.gz")
+        with open(self.active_path, "rb") as src, gzip.open(archive, "wb") as dst:
+            shutil.copyfileobj(src, dst)
+        os.remove(self.active_path)
+        self._opened_at = None
+
+        archives = sorted(glob.glob(os.path.join(self.directory, "journal-*.jsonl.gz")))
+        for old in archives[:-self.keep_files]:
+            os.remove(old)
+
+    def close(self):
+        self.flush()
+
+
+def journal_files(directory):
+    """按时间顺序列出所有流水文件（压缩文件在前，当前文件在后）"""
+    files = sorted(glob.glob(os.path.join(directory, "journal-*.jsonl.gz")))
+    active = os.path.join(directory, ACTIVE_FILE)
+    if os.path.exists(active):
+        files.append(active)
+    return files
+
+
+def iter_events(directory, since=None, until=None):
+    """逐行流式读取事件，不把整个文件读入内存"""
+    for path in journal_files(directory):
+        opener = gzip.open if path.endswith(".gz") else open
+        with opener(path, "rt", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                if since is not None and entry['ts'] < since:
+                    continue
+                if until is not None and entry['ts'] >= until:
+                    continue
+                yield entry
+
+
+def _match(entry, channel=None, event=None):
+    return (channel is None or entry.get('ch') == channel) and (event is None or entry.get('ev') == event)
+
+
+def _day(ts):
+    return datetime.fromtimestamp(ts, beijing_tz).strftime("%Y-%m-%d")
+
+
+def aggregate(events, group_by):
+    """按频道/日期聚合：各事件数量和发送延迟"""
+    groups = defaultdict(lambda: {'received': 0, 'skipped': 0, 'sent': 0, 'failed': 0, 'latency_sum': 0.0})
+    for entry in events:
+        parts = []
+        for field in group_by:
+            parts.append(_day(entry['ts']) if field == 'day' else str(entry.get('ch')))
+        group = groups[tuple(parts)]
+        if entry['ev'] in group:
+            group[entry['ev']] += 1
+        if entry['ev'] == 'sent' and entry.get('latency') is not None:
+            group['latency_sum'] += entry['latency']
+    return groups
+
+
+def _parse_day(value):
+    return beijing_tz.localize(datetime.strptime(value, "%Y-%m-%d")).timestamp() if value else None
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="转发流水查询")
+    parser.add_argument("--dir", default=os.path.join(os.getenv("DATA_DIR", "data"), "journal"),
+                        help="流水目录")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    query = sub.add_parser("query", help="按条件输出事件")
+    stats = sub.add_parser("stats", help="聚合统计")
+    for p in (query, stats):
+        p.add_argument("--channel", help="只看某个频道，例如 @remote_cn")
+        p.add_argument("--event", choices=["received", "skipped", "sent", "failed"], help="事件类型")
+        p.add_argument("--since", help="开始日期 YYYY-MM-DD（北京时间）")
+        p.add_argument("--until", help="结束日期 YYYY-MM-DD（不含）")
+    query.add_argument("--reason", help="只看某个跳过原因")
+    query.add_argument("--limit", type=int, default=0, help="最多输出条数")
+    stats.add_argument("--by", default="channel,day", help="聚合维度：channel、day 或 channel,day")
+    args = parser.parse_args(argv)
+
+    events = (entry for entry in iter_events(args.dir, _parse_day(args.since), _parse_day(args.until))
+              if _match(entry, args.channel, args.event))
+
+    if args.command == "query":
+        count = 0
+        for entry in events:
+            if args.reason and entry.get('reason') != args.reason:
+                continue
+            print(json.dumps(entry, ensure_ascii=False))
+            count += 1
+            if args.limit and count >= args.limit:
+                break
+        return
+
+    group_by = [field.strip() for field in args.by.split(",") if field.strip()]
+    groups = aggregate(events, group_by)
+    header = f"{' / '.join(group_by):<32} {'收到':>6} {'跳过':>6} {'发送':>6} {'失败':>6} {'平均延迟':>9}"
+    print(header)
+    print("-" * len(header))
+    for key in sorted(groups):
+        group = groups[key]
+        latency = group['latency_sum'] / group['sent'] if group['sent'] else 0.0
+        print(f"{' / '.join(key):<32} {group['received']:>6} {group['skipped']:>6} {group['sent']:>6} "
+              f"{group['failed']:>6} {latency:>8.1f}s")
+
+
+if __name__ == "__main__":
+    main()
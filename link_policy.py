@@ -0,0 +1,100 @@
+# 链接检查策略：按域名后缀匹配允许/拒绝/免检列表，t.me 链接通过已连接的Telegram客户端检查，避免HTTP抓取
+import re
+from urllib.parse import urlparse
+
+from loguru import logger
+from telethon.errors import FloodWaitError
+
+from clock import SystemClock
+
+ALLOW = "allow"  # 已知可访问，不检查
+DENY = "deny"  # 已知垃圾/不可用，直接标注
+SKIP_CHECK = "skip"  # 不检查也不标注
+
+TELEGRAM_HOSTS = ("t.me", "telegram.me", "telegram.dog")
+# t.me/<用户名>[/<消息ID>]，不包括邀请链接（+hash、joinchat）和 c/、s/ 等路径
+TELEGRAM_USERNAME = re.compile(r"^/([A-Za-z][A-Za-z0-9_]{3,31})(?:/\d+)?/?$")
+TELEGRAM_RESERVED = {"joinchat", "addstickers", "addemoji", "share", "proxy", "socks", "login", "iv"}
+
+
+def normalize_host(host):
+    return (host or "").strip().rstrip(".").lower()
+
+
+class DomainPolicyIndex:
+    """域名后缀树：按标签倒序存储（com -> example -> jobs），查询时取最长匹配的策略"""
+
+    def __init__(self, allow=(), deny=(), skip=()):
+        self._root = {}
+        for policy, domains in ((ALLOW, allow), (SKIP_CHECK, skip), (DENY, deny)):
+            for domain in domains:
+                self.add(domain, policy)
+
+    def add(self, domain, policy):
+        node = self._root
+        for label in reversed(normalize_host(domain).lstrip("*.").split(".")):
+            node = node.setdefault(label, {})
+        node[None] = policy  # None 键保存该后缀的策略
+
+    def lookup(self, host):
+        """返回 host 最长匹配后缀的策略，没有匹配时返回 None"""
+        node = self._root
+        policy = None
+        for label in reversed(normalize_host(host).split(".")):
+            node = node.get(label)
+            if node is None:
+                break
+            policy = node.get(None, policy)
+        return policy
+
+
+def telegram_username(url):
+    """t.me/<用户名> 链接返回用户名；其他Telegram链接返回空字符串；非Telegram链接返回 None"""
+    parsed = urlparse(url)
+    if normalize_host(parsed.hostname) not in TELEGRAM_HOSTS:
+        return None
+    match = TELEGRAM_USERNAME.match(parsed.path or "")
+    if not match or match.group(1).lower() in TELEGRAM_RESERVED:
+        return ""
+    return match.group(1).lower()
+
+
+class TelegramLinkResolver:
+    """通过Telegram客户端检查用户名是否存在
+    先查客户端的实体缓存（会话数据库），未命中才解析用户名；结果按TTL缓存
+    """
+
+    def __init__(self, client, ttl=6 * 3600, negative_ttl=3600, clock=None):
+        self.client = client
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.clock = clock if clock is not None else SystemClock()
+        self._cache = {}  # 用户名 -> (是否存在, 过期时间)
+        self.stats = {'cached': 0, 'resolved': 0, 'missing': 0, 'errors': 0}
+
+    async def check(self, username):
+        """用户名存在返回 True，不存在返回 False；无法判断（限流等）时返回 True，不误标"""
+        now = self.clock.time()
+        cached = self._cache.get(username)
+        if cached and cached[1] > now:
+            self.stats['cached'] += 1
+            return cached[0]
+
+        try:
+            await self.client.get_input_entity(username)
+            exists = True
+            self.stats['resolved'] += 1
+        except ValueError:
+            exists = False
+            self.stats['missing'] += 1
+        except FloodWaitError as e:
+            logger.warning(f"解析用户名 @{username} 遇到频率限制（{e.seconds} 秒），跳过检查")
+            self.stats['errors'] += 1
+            return True
+        except Exception as e:
+            logger.warning(f"解析用户名 @{username} 失败: {e}")
+            self.stats['errors'] += 1
+            return True
+
+        self._cache[username] = (exists, now + (self.ttl if exists else self.negative_ttl))
+        return exists
@@ -0,0 +1,163 @@
+# 媒体预取：消息等待发送时隙期间提前下载媒体，重新上传时直接从缓冲区读取
+import asyncio
+import io
+import os
+import tempfile
+
+from loguru import logger
+from telethon.tl.custom.file import File
+
+
+class PrefetchedMedia:
+    """已下载完成的媒体（内存缓冲区或磁盘临时文件）"""
+
+    def __init__(self, file_name, size, buffer=None, path=None):
+        self.file_name = file_name
+        self.size = size
+        self.buffer = buffer
+        self.path = path
+
+    @property
+    def in_memory(self):
+        return self.buffer is not None
+
+    def source(self):
+        """上传用的数据源：内存缓冲区从头读取，磁盘文件直接传路径由客户端分块读取"""
+        if self.buffer is not None:
+            self.buffer.seek(0)
+            return self.buffer
+        return self.path
+
+    def close(self):
+        if self.buffer is not None:
+            self.buffer.close()
+            self.buffer = None
+        if self.path:
+            try:
+                os.remove(self.path)
+            except OSError:
+                pass
+            self.path = None
+
+
+class MediaPrefetcher:
+    """后台预取媒体，限制内存中缓冲的总字节数，超出部分落盘；落盘总字节数也有上限，超出时暂不预取"""
+
+    def __init__(self, client, max_memory_bytes=32 * 1024 * 1024, max_item_memory_bytes=8 * 1024 * 1024,
+                 max_file_bytes=50 * 1024 * 1024, max_spill_bytes=256 * 1024 * 1024, spill_dir=None):
+        self.client = client  # 用于下载的客户端（需要能访问源频道）
+        self.max_memory_bytes = max_memory_bytes  # 内存缓冲总上限
+        self.max_item_memory_bytes = max_item_memory_bytes  # 单个文件超过此大小直接落盘
+        self.max_file_bytes = max_file_bytes  # 超过此大小不预取（Bot上传上限）
+        self.max_spill_bytes = max_spill_bytes  # 落盘临时文件总上限
+        self.spill_dir = spill_dir
+        self.memory_in_use = 0
+        self.spill_in_use = 0
+        self._tasks = {}
+        self._reserved = {}  # key -> (是否在内存, 预留字节数)
+        self.stats = {'prefetched': 0, 'spilled': 0, 'skipped': 0, 'deferred': 0, 'failed': 0}
+
+    def start(self, key, media):
+        """为待发送的照片/文档（MessageMedia）启动后台下载，不阻塞调用方
+        大小未知的媒体不占内存额度，直接落盘并按单文件上限预留落盘额度
+        """
+        if key in self._tasks:
+            return
+        file = File(getattr(media, 'photo', None) or getattr(media, 'document', None))
+        if file.media is None:
+            return
+        size = file.size
+        if size and size > self.max_file_bytes:
+            self.stats['skipped'] += 1
+            logger.debug(f"媒体过大({size} 字节)，不预取: {key}")
+            return
+
+        in_memory = bool(size) and (size <= self.max_item_memory_bytes and
+                                    self.memory_in_use + size <= self.max_memory_bytes)
+        if in_memory:
+            self.memory_in_use += size
+            self._reserved[key] = (True, size)
+        else:
+            reserve = size or self.max_file_bytes
+            if self.spill_in_use + reserve > self.max_spill_bytes:
+                # 落盘额度用完：暂不预取，之后轮到它时再试，或发送时直接下载
+                self.stats['deferred'] += 1
+                return
+            self.spill_in_use += reserve
+            self._reserved[key] = (False, reserve)
+        file_name = file.name or f"media{file.ext or ''}"
+        self._tasks[key] = asyncio.create_task(self._download(key, media, file_name, size, in_memory))
+
+    async def _download(self, key, media, file_name, size, in_memory):
+        path = None
+        try:
+            if in_memory:
+                buffer = io.BytesIO()
+                buffer.name = file_name  # 客户端根据文件名判断媒体类型
+                await self.client.download_media(media, file=buffer)
+                self.stats['prefetched'] += 1
+                return PrefetchedMedia(file_name, size, buffer=buffer)
+
+            suffix = os.path.splitext(file_name)[1]
+            fd, path = tempfile.mkstemp(prefix="prefetch_", suffix=suffix, dir=self.spill_dir)
+            os.close(fd)
+            await self.client.download_media(media, file=path)
+            if not size:
+                # 大小未知时按单文件上限预留，下载完成后改为实际大小
+                size = os.path.getsize(path)
+                self._adjust_spill(key, size)
+            self.stats['prefetched'] += 1
+            self.stats['spilled'] += 1
+            return PrefetchedMedia(file_name, size, path=path)
+        except asyncio.CancelledError:
+            if path:
+                PrefetchedMedia(file_name, size, path=path).close()
+            raise
+        except Exception as e:
+            self.stats['failed'] += 1
+            logger.warning(f"预取媒体失败 {key}: {e}")
+            if path:
+                PrefetchedMedia(file_name, size, path=path).close()
+            self._release_reservation(key)
+            return None
+
+    async def get(self, key, timeout=None):
+        """等待预取完成并返回结果，没有预取或失败时返回 None"""
+        task = self._tasks.get(key)
+        if task is None:
+            return None
+        try:
+            return await asyncio.wait_for(asyncio.shield(task), timeout)
+        except asyncio.TimeoutError:
+            logger.warning(f"等待预取媒体超时: {key}")
+            return None
+
+    def release(self, key):
+        """释放消息的预取缓冲区（处理结束时调用）"""
+        task = self._tasks.pop(key, None)
+        if task is None:
+            return
+        if task.done():
+            self._close_result(task)
+        else:
+            task.cancel()
+            task.add_done_callback(self._close_result)
+        self._release_reservation(key)
+
+    @staticmethod
+    def _close_result(task):
+        if not task.cancelled() and task.result():
+            task.result().close()
+
+    def _adjust_spill(self, key, size):
+        reserved = self._reserved.get(key)
+        if reserved is not None and not reserved[0]:
+            self.spill_in_use += size - reserved[1]
+            self._reserved[key] = (False, size)
+
+    def _release_reservation(self, key):
+        in_memory, size = self._reserved.pop(key, (True, 0))
+        if in_memory:
+            self.memory_in_use -= size
+        else:
+            self.spill_in_use -= size
@@ -0,0 +1,83 @@
+# 源消息到已转发消息的映射，用于把源频道的编辑同步到目标频道
+import hashlib
+import json
+import os
+from collections import OrderedDict, namedtuple
+
+from loguru import logger
+
+# 已转发消息：目标频道、目标消息ID、源消息文本摘要（链接标注前）
+MappedMessage = namedtuple("MappedMessage", ["target", "target_msg_id", "text_hash"])
+
+
+def text_hash(text):
+    """源消息文本的短摘要（blake2b 8字节），用于判断编辑是否改变了内容"""
+    return hashlib.blake2b((text or "").encode("utf-8"), digest_size=8).hexdigest()
+
+
+class MessageMap:
+    """有界的 (源频道, 消息ID) -> (目标频道, 目标消息ID) 映射，超出容量时淘汰最早的记录"""
+
+    def __init__(self, path, max_entries=5000):
+        self.path = path
+        self.max_entries = max_entries
+        self._entries = OrderedDict()
+        self._dirty = False
+
+    @staticmethod
+    def _key(source_chat_id, source_msg_id):
+        return f"{source_chat_id}:{source_msg_id}"
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, source_chat_id, source_msg_id):
+        """查找已转发的消息，没有记录时返回 None"""
+        entry = self._entries.get(self._key(source_chat_id, source_msg_id))
+        return MappedMessage(*entry) if entry else None
+
+    def add(self, source_chat_id, source_msg_id, target, target_msg_id, digest):
+        """记录一条已转发的消息"""
+        key = self._key(source_chat_id, source_msg_id)
+        self._entries[key] = [target, target_msg_id, digest]
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+        self._dirty = True
+
+    def update_hash(self, source_chat_id, source_msg_id, digest):
+        """编辑同步成功后更新文本摘要"""
+        entry = self._entries.get(self._key(source_chat_id, source_msg_id))
+        if entry:
+            entry[2] = digest
+            self._dirty = True
+
+    def load(self):
+        """从文件恢复映射"""
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+            for key, target, target_msg_id, digest in entries[-self.max_entries:]:
+                self._entries[key] = [target, target_msg_id, digest]
+            logger.info(f"已加载 {len(self._entries)} 条消息映射")
+        except Exception as e:
+            logger.error(f"加载消息映射失败: {e}")
+
+    def save(self):
+        """有改动时写回文件（先写临时文件再替换，避免写到一半损坏）
+        由定时任务周期调用并在关闭时调用，不在每次发送/编辑后调用
+        """
+        if not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump([[key] + entry for key, entry in self._entries.items()], f,
+                          ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"保存消息映射失败: {e}")
@@ -0,0 +1,36 @@
+# 未完成消息的检查点：关闭时记录仍在排队的消息，下次启动时重新拉取并处理
+import json
+import os
+
+from loguru import logger
+
+
+class PendingCheckpoint:
+    """保存 {chat_id, msg_id, channel} 列表，启动时取出后即删除文件"""
+
+    def __init__(self, path):
+        self.path = path
+
+    def save(self, entries):
+        """写入检查点（覆盖旧文件）"""
+        try:
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump(entries, f, ensure_ascii=False, separators=(",", ":"))
+            os.replace(tmp_path, self.path)
+        except Exception as e:
+            logger.error(f"保存待处理消息检查点失败: {e}")
+
+    def take(self):
+        """读取并删除检查点，没有时返回空列表"""
+        if not os.path.exists(self.path):
+            return []
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                entries = json.load(f)
+            os.remove(self.path)
+            return entries
+        except Exception as e:
+            logger.error(f"读取待处理消息检查点失败: {e}")
+            return []
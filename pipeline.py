@@ -0,0 +1,105 @@
+# 消息处理流水线：每个阶段声明成本和依赖，按“先跑便宜的、先拒绝”的顺序执行，并统计各阶段的拒绝数和耗时
+import threading
+import time
+
+# 阶段成本（相对值）
+COST_CPU = 1  # 纯计算
+COST_CACHE = 10  # 通常命中本地缓存，偶尔需要网络
+COST_NETWORK = 100  # 每次都需要网络请求
+
+
+class Stage:
+    """一个处理阶段
+    func(ctx) 为协程，返回 None 表示继续，返回字符串表示在此结束（拒绝原因或去向）
+    """
+
+    __slots__ = ("name", "func", "cost", "requires")
+
+    def __init__(self, name, func, cost, requires=()):
+        self.name = name
+        self.func = func
+        self.cost = cost
+        self.requires = frozenset(requires)
+
+
+class FilterPipeline:
+    """按成本排序的过滤/转换阶段"""
+
+    def __init__(self):
+        self.stages = []
+        self._lock = threading.Lock()  # 状态接口在Flask线程中读取
+        self.stats = {}
+
+    def add(self, name, func, cost, requires=()):
+        """注册阶段，注册后重新排序"""
+        self.stages.append(Stage(name, func, cost, requires))
+        self.stats[name] = {'runs': 0, 'stops': 0, 'not_run': 0, 'seconds': 0.0}
+        self.stages = self._order(self.stages)
+        return self
+
+    @staticmethod
+    def _order(stages):
+        """满足依赖的前提下每次选成本最低的阶段（同成本按注册顺序）"""
+        names = {stage.name for stage in stages}
+        for stage in stages:
+            missing = stage.requires - names
+            if missing:
+                raise ValueError(f"阶段 {stage.name} 依赖未注册的阶段: {', '.join(sorted(missing))}")
+        remaining = list(stages)
+        ordered = []
+        done = set()
+        while remaining:
+            ready = [stage for stage in remaining if stage.requires <= done]
+            if not ready:
+                raise ValueError(f"阶段依赖存在循环: {', '.join(stage.name for stage in remaining)}")
+            chosen = min(ready, key=lambda stage: stage.cost)
+            ordered.append(chosen)
+            done.add(chosen.name)
+            remaining.remove(chosen)
+        return ordered
+
+    async def run(self, ctx, trace=None):
+        """依次执行各阶段，返回 (结束原因, 阶段名)；全部通过时返回 (None, None)"""
+        for index, stage in enumerate(self.stages):
+            started = time.monotonic()
+            try:
+                verdict = await stage.func(ctx)
+            finally:
+                elapsed = time.monotonic() - started
+                with self._lock:
+                    stats = self.stats[stage.name]
+                    stats['runs'] += 1
+                    stats['seconds'] += elapsed
+                if trace is not None:
+                    trace.mark(stage.name)
+            if verdict is not None:
+                with self._lock:
+                    self.stats[stage.name]['stops'] += 1
+                    for later in self.stages[index + 1:]:
+                        self.stats[later.name]['not_run'] += 1
+                return verdict, stage.name
+        return None, None
+
+    def snapshot(self):
+        """各阶段统计；saved_seconds 为因前面阶段拒绝而省下的预计耗时（未执行次数 × 平均耗时）"""
+        with self._lock:
+            result = []
+            for stage in self.stages:
+                stats = self.stats[stage.name]
+                mean = stats['seconds'] / stats['runs'] if stats['runs'] else 0.0
+                result.append({
+                    'stage': stage.name,
+                    'cost': stage.cost,
+                    'runs': stats['runs'],
+                    'stops': stats['stops'],
+                    'not_run': stats['not_run'],
+                    'mean_ms': round(mean * 1000, 2),
+                    'saved_seconds': round(stats['not_run'] * mean, 2),
+                })
+            return result
+
+    def report_lines(self):
+        """状态报告中的流水线统计行"""
+        return [f"  • {item['stage']}: 执行 {item['runs']} / 拦截 {item['stops']} / 跳过 {item['not_run']}，"
+                f"平均 {item['mean_ms']:.1f}ms，节省约 {item['saved_seconds']:.1f}s"
+                for item in self.snapshot()]
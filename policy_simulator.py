@@ -0,0 +1,280 @@
+# 防封策略模拟器：在虚拟时间中回放消息到达序列，几秒内评估一组参数一天/一周的表现
+import argparse
+import heapq
+import itertools
+import json
+import random
+from collections import Counter
+from datetime import datetime
+
+import pytz
+
+from admission import AdmissionQueue
+from anti_ban_config import AntiBanConfig, AntiBanStrategies
+from clock import VirtualClock
+
+beijing_tz = pytz.timezone("Asia/Shanghai")
+
+# 北京时间0-23点的相对发帖强度，招聘频道主要在白天发帖
+DIURNAL_PROFILE = [0.2, 0.1, 0.1, 0.1, 0.1, 0.2, 0.4, 0.7, 1.0, 1.4, 1.6, 1.5,
+                   1.2, 1.3, 1.5, 1.5, 1.4, 1.2, 1.0, 0.9, 0.8, 0.7, 0.5, 0.3]
+
+# 事件类型（同一时刻先处理到达，再检查发送条件，最后发送）
+_ARRIVAL = 0
+_WAKE = 1
+_SEND = 2
+
+
+def generate_trace(start, days, rate_per_hour, seed=0, profile=DIURNAL_PROFILE):
+    """生成按小时分段的非齐次泊松到达序列（Unix时间戳列表）"""
+    rng = random.Random(seed)
+    arrivals = []
+    for hour in range(int(days * 24)):
+        hour_start = start + hour * 3600
+        rate = rate_per_hour * profile[datetime.fromtimestamp(hour_start, beijing_tz).hour]
+        if rate <= 0:
+            continue
+        offset = rng.expovariate(rate / 3600.0)
+        while offset < 3600:
+            arrivals.append(hour_start + offset)
+            offset += rng.expovariate(rate / 3600.0)
+    return arrivals
+
+
+def load_trace(path):
+    """读取到达序列：每行一个Unix时间戳，或包含 "t" 字段的JSON行"""
+    arrivals = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if not line:
+                continue
+            if line.startswith("{"):
+                arrivals.append(float(json.loads(line)["t"]))
+            else:
+                arrivals.append(float(line))
+    return sorted(arrivals)
+
+
+def make_config(overrides):
+    """基于 AntiBanConfig 派生一个覆盖了部分参数的配置类"""
+    for key in overrides:
+        if not hasattr(AntiBanConfig, key):
+            raise ValueError(f"未知配置项: {key}")
+    return type("SimulatedConfig", (AntiBanConfig,), dict(overrides))
+
+
+def parse_value(raw):
+    """解析命令行参数值（数字/布尔值按JSON解析，其余按字符串）"""
+    try:
+        return json.loads(raw)
+    except ValueError:
+        return raw
+
+
+def percentile(sorted_values, q):
+    """已排序序列的分位数（最近秩）"""
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class PolicySimulator:
+    """离散事件模拟器，复刻 _stage_admission 和 _send_loop：
+    到达的消息按价值进入有界的待发送队列（队列满时丢弃价值最低的，等待过久的过期），
+    单个发送者在安全时间内、有发送额度时（非工作时间按处理比例缩减每小时额度），
+    等待自适应延迟后取出队列中价值最高的一条发送
+    """
+
+    def __init__(self, config=AntiBanConfig, seed=0, error_rate=0.0):
+        self.config = config
+        self.seed = seed
+        self.error_rate = error_rate  # 每次发送失败的概率
+
+    def _score(self, rng, cfg):
+        """模拟 PostScorer 的分数：关键词命中数大多为0~2个，约一半消息带联系方式"""
+        hits = min(int(rng.expovariate(0.7)), cfg.MAX_KEYWORD_HITS)
+        score = 1.0 + cfg.KEYWORD_WEIGHT * hits
+        if rng.random() < 0.5:
+            score += cfg.CONTACT_BONUS
+        return score
+
+    def run(self, arrivals, duration):
+        """回放到达序列并返回统计报告"""
+        arrivals = sorted(arrivals)
+        start = arrivals[0] if arrivals else 0
+        clock = VirtualClock(start)
+        rng = random.Random(self.seed)
+        cfg = self.config
+        strategies = AntiBanStrategies(config=cfg(), clock=clock, rng=rng)
+        queue = AdmissionQueue(cfg.ADMISSION_QUEUE_SIZE, cfg.ADMISSION_MAX_AGE, cfg.FRESHNESS_HALF_LIFE, clock=clock)
+
+        events = [(t, _ARRIVAL, seq) for seq, t in enumerate(arrivals)]
+        heapq.heapify(events)
+        seq = itertools.count(len(arrivals))
+        drops = Counter()
+        delays = []
+        failed = 0
+        sender_busy = False  # 发送者已安排了下一次检查或发送
+
+        def wake_sender(at):
+            heapq.heappush(events, (at, _WAKE, next(seq)))
+
+        while events:
+            event_time, kind, _ = heapq.heappop(events)
+            if event_time > start + duration:
+                break
+            clock.set(event_time)
+
+            if kind == _ARRIVAL:
+                drops["expired"] += len(queue.purge_expired())
+                score = self._score(rng, cfg)
+                if not queue.would_admit(score, event_time):
+                    drops["shed"] += 1
+                    continue
+                drops["shed"] += len(queue.push(event_time, score, event_time))
+                if not sender_busy:
+                    sender_busy = True
+                    wake_sender(event_time)
+                continue
+
+            if kind == _WAKE:
+                if not len(queue):
+                    sender_busy = False
+                    continue
+                window = strategies.schedules.window()
+                if not window.is_safe:
+                    wake_sender(max(event_time + 1.0, window.end))
+                    continue
+                wait = strategies.seconds_until_slot(window.work_ratio)
+                if wait > 0:
+                    wake_sender(event_time + wait)
+                    continue
+                heapq.heappush(events, (event_time + strategies.get_adaptive_delay(), _SEND, next(seq)))
+                continue
+
+            # 延迟结束时取出价值最高的消息
+            drops["expired"] += len(queue.purge_expired())
+            arrived_at = queue.pop()
+            if arrived_at is None:
+                sender_busy = False
+                continue
+            if self.error_rate and rng.random() < self.error_rate:
+                # 一般错误：闸门关闭 min(冷却, 60) 秒，消息不重试
+                failed += 1
+                wake_sender(event_time + min(strategies.record_error("SIMULATED"), 60))
+                continue
+            strategies.record_success()
+            delays.append(event_time - arrived_at)
+            wake_sender(event_time)
+
+        delays.sort()
+        capacity = min(cfg.MAX_MESSAGES_PER_MINUTE * duration / 60,
+                       cfg.MAX_MESSAGES_PER_HOUR * duration / 3600,
+                       cfg.MAX_MESSAGES_PER_DAY * max(1.0, duration / 86400))
+        total = len(arrivals)
+        return {
+            "arrivals": total,
+            "forwarded": len(delays),
+            "failed": failed,
+            "dropped": dict(drops),
+            "drop_rate": sum(drops.values()) / total if total else 0.0,
+            "queued_at_end": len(queue),
+            "budget_utilization": len(delays) / capacity if capacity else 0.0,
+            "delay_p50": percentile(delays, 0.50),
+            "delay_p95": percentile(delays, 0.95),
+            "delay_p99": percentile(delays, 0.99),
+            "delay_max": delays[-1] if delays else 0.0,
+            "final_multiplier": strategies.current_delay_multiplier,
+        }
+
+
+def format_report(params, report):
+    """单组参数的可读报告"""
+    lines = [
+        f"参数: {params or '默认'}",
+        f"  • 到达消息: {report['arrivals']}",
+        f"  • 成功转发: {report['forwarded']}  失败: {report['failed']}",
+        f"  • 丢弃率: {report['drop_rate']:.1%}  明细: {report['dropped']}  结束时仍在队列: {report['queued_at_end']}",
+        f"  • 额度利用率: {report['budget_utilization']:.1%}",
+        f"  • 排队延迟 p50/p95/p99/max: {report['delay_p50']:.1f}s / {report['delay_p95']:.1f}s / "
+        f"{report['delay_p99']:.1f}s / {report['delay_max']:.1f}s",
+        f"  • 最终延迟倍数: {report['final_multiplier']:.2f}",
+    ]
+    return "\n".join(lines)
+
+
+def format_sweep(rows):
+    """参数扫描结果对比表"""
+    header = f"{'参数':<48} {'转发':>6} {'利用率':>7} {'丢弃率':>7} {'挤掉':>5} {'过期':>5} {'p50':>7} {'p95':>7}"
+    lines = [header, "-" * len(header)]
+    for params, report in rows:
+        label = ", ".join(f"{k}={v}" for k, v in params.items())
+        lines.append(f"{label:<48} {report['forwarded']:>6} {report['budget_utilization']:>7.1%} "
+                     f"{report['drop_rate']:>7.1%} {report['dropped'].get('shed', 0):>5} "
+                     f"{report['dropped'].get('expired', 0):>5} "
+                     f"{report['delay_p50']:>6.0f}s {report['delay_p95']:>6.0f}s")
+    return "\n".join(lines)
+
+
+def _parse_assignments(items):
+    """解析 KEY=VALUE 列表"""
+    result = {}
+    for item in items or []:
+        key, _, value = item.partition("=")
+        result[key.strip()] = value
+    return result
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="防封策略模拟器")
+    parser.add_argument("--days", type=float, default=1, help="模拟天数（默认1天）")
+    parser.add_argument("--rate", type=float, default=30, help="平均每小时到达消息数")
+    parser.add_argument("--start", default="2024-01-01", help="起始日期（北京时间，默认周一）")
+    parser.add_argument("--trace", help="到达序列文件（替代随机生成）")
+    parser.add_argument("--seed", type=int, default=0, help="随机种子")
+    parser.add_argument("--set", action="append", metavar="KEY=VALUE", help="覆盖单个配置项")
+    parser.add_argument("--sweep", action="append", metavar="KEY=V1,V2",
+                        help="扫描配置项的多个取值，可重复指定做笛卡尔积")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="模拟发送失败概率")
+    parser.add_argument("--json", action="store_true", help="以JSON输出")
+    args = parser.parse_args(argv)
+
+    start = beijing_tz.localize(datetime.strptime(args.start, "%Y-%m-%d")).timestamp()
+    duration = args.days * 86400
+    if args.trace:
+        arrivals = load_trace(args.trace)
+        if arrivals:
+            duration = max(duration, arrivals[-1] - arrivals[0])
+    else:
+        arrivals = generate_trace(start, args.days, args.rate, seed=args.seed)
+
+    base = {k: parse_value(v) for k, v in _parse_assignments(args.set).items()}
+    sweep = {k: [parse_value(v) for v in values.split(",")]
+             for k, values in _parse_assignments(args.sweep).items()}
+
+    configs = []
+    for combo in itertools.product(*sweep.values()):
+        params = dict(base)
+        params.update(zip(sweep.keys(), combo))
+        try:
+            configs.append((params, make_config(params)))
+        except ValueError as e:
+            parser.error(f"{e}（--set/--sweep 的 KEY 必须是 AntiBanConfig 中的配置项）")
+
+    rows = []
+    for params, config in configs:
+        simulator = PolicySimulator(config, seed=args.seed, error_rate=args.error_rate)
+        rows.append((params, simulator.run(arrivals, duration)))
+
+    if args.json:
+        print(json.dumps([{"params": p, "report": r} for p, r in rows], ensure_ascii=False, indent=2))
+    elif sweep:
+        print(format_sweep(rows))
+    else:
+        print(format_report(*rows[0]))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,188 @@
+# 轮询拉取：未加入的源频道按水位线定期拉取新消息，各频道间隔随发帖频率自适应，总请求数受全局预算限制
+import asyncio
+import heapq
+import json
+import os
+
+from loguru import logger
+from telethon.errors import FloodWaitError
+
+from clock import SystemClock
+
+
+class ChannelPoll:
+    """单个频道的轮询状态"""
+
+    __slots__ = ("channel", "watermark", "interval", "rate", "last_poll", "polls", "messages", "errors")
+
+    def __init__(self, channel, watermark, interval):
+        self.channel = channel
+        self.watermark = watermark  # 已拉取的最大消息ID，None 表示尚未初始化
+        self.interval = interval  # 当前轮询间隔（秒）
+        self.rate = None  # 发帖速率估计（条/秒，指数平滑）
+        self.last_poll = None
+        self.polls = 0
+        self.messages = 0
+        self.errors = 0
+
+
+class PollingIngestor:
+    """按频道水位线轮询新消息
+    间隔 = 每次期望拉到的消息数 / 发帖速率，限制在 [min_interval, max_interval]；
+    所有频道的请求速率之和超出预算时按比例拉长间隔，另有令牌桶保证总请求数不超预算
+    """
+
+    def __init__(self, client, channels, on_message, state_path=None, min_interval=60, max_interval=1800,
+                 requests_per_hour=120, batch_size=50, target_per_poll=2, smoothing=0.3, clock=None):
+        self.client = client
+        self.on_message = on_message  # on_message(message, channel)
+        self.state_path = state_path
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.requests_per_hour = requests_per_hour
+        self.batch_size = batch_size
+        self.target_per_poll = target_per_poll
+        self.smoothing = smoothing
+        self.clock = clock if clock is not None else SystemClock()
+        watermarks = self._load_watermarks()
+        self.channels = {channel: ChannelPoll(channel, watermarks.get(channel), min_interval) for channel in channels}
+        self._tokens = float(max(1, len(self.channels)))
+        self._tokens_at = self.clock.time()
+        self._paused_until = 0.0
+        self._dirty = False  # 水位线有变化、尚未写回文件
+        self.stats = {'requests': 0, 'messages': 0, 'throttled': 0, 'flood_waits': 0}
+
+    def _load_watermarks(self):
+        if not self.state_path or not os.path.exists(self.state_path):
+            return {}
+        try:
+            with open(self.state_path, encoding="utf-8") as f:
+                return json.load(f)
+        except Exception as e:
+            logger.error(f"读取轮询水位线失败: {e}")
+            return {}
+
+    def save(self):
+        """水位线有变化时写回文件，重启后从水位线继续拉取（定时任务周期调用，关闭时再调用一次）"""
+        if not self.state_path or not self._dirty:
+            return
+        try:
+            os.makedirs(os.path.dirname(self.state_path) or ".", exist_ok=True)
+            tmp_path = f"{self.state_path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                json.dump({poll.channel: poll.watermark for poll in self.channels.values()
+                           if poll.watermark is not None}, f)
+            os.replace(tmp_path, self.state_path)
+            self._dirty = False
+        except Exception as e:
+            logger.error(f"保存轮询水位线失败: {e}")
+
+    def _adapt(self, poll, fetched, elapsed):
+        """根据本次拉到的消息数更新发帖速率和下次间隔"""
+        if elapsed > 0:
+            observed = fetched / elapsed
+            poll.rate = observed if poll.rate is None else (
+                self.smoothing * observed + (1 - self.smoothing) * poll.rate)
+        if fetched >= self.batch_size:
+            # 一批没拉完，尽快继续
+            poll.interval = self.min_interval
+        elif poll.rate:
+            poll.interval = min(self.max_interval, max(self.min_interval, self.target_per_poll / poll.rate))
+        else:
+            poll.interval = min(self.max_interval, poll.interval * 2)
+
+    def budget_factor(self):
+        """所有频道按当前间隔轮询时的请求速率与预算之比（>1 时需要拉长间隔）"""
+        demand = sum(3600 / poll.interval for poll in self.channels.values())
+        return max(1.0, demand / self.requests_per_hour)
+
+    def _take_token(self):
+        """令牌桶：成功取到返回0，否则返回需要等待的秒数"""
+        now = self.clock.time()
+        rate = self.requests_per_hour / 3600
+        capacity = max(1.0, float(len(self.channels)))
+        self._tokens = min(capacity, self._tokens + (now - self._tokens_at) * rate)
+        self._tokens_at = now
+        if self._tokens >= 1:
+            self._tokens -= 1
+            return 0.0
+        return (1 - self._tokens) / rate
+
+    async def poll(self, poll):
+        """拉取一个频道水位线之后的新消息，返回拉到的条数"""
+        now = self.clock.time()
+        self.stats['requests'] += 1
+        poll.polls += 1
+        if poll.watermark is None:
+            # 首次轮询只记录当前最新消息ID，不转发历史消息
+            latest = await self.client.get_messages(poll.channel, limit=1)
+            poll.watermark = latest[0].id if latest else 0
+            poll.last_poll = now
+            self._dirty = True
+            return 0
+
+        # reverse=True 从水位线开始由旧到新拉取：积压超过一批时下一次轮询接着拉，不会跳过较早的消息
+        messages = await self.client.get_messages(poll.channel, min_id=poll.watermark, limit=self.batch_size,
+                                                  reverse=True)
+        messages = sorted((message for message in messages if message.id > poll.watermark), key=lambda m: m.id)
+        for message in messages:
+            self.on_message(message, poll.channel)
+        if messages:
+            poll.watermark = messages[-1].id
+            self._dirty = True
+        elapsed = now - poll.last_poll if poll.last_poll is not None else 0
+        poll.last_poll = now
+        poll.messages += len(messages)
+        self.stats['messages'] += len(messages)
+        self._adapt(poll, len(messages), elapsed)
+        return len(messages)
+
+    async def run(self):
+        """按各频道下次轮询时间依次拉取"""
+        if not self.channels:
+            return
+        now = self.clock.time()
+        # 首次轮询错开，避免同时发出请求
+        spread = self.min_interval / len(self.channels)
+        schedule = [(now + i * spread, poll.channel) for i, poll in enumerate(self.channels.values())]
+        heapq.heapify(schedule)
+        while True:
+            due, channel = schedule[0]
+            wait = max(due, self._paused_until) - self.clock.time()
+            if wait > 0:
+                await asyncio.sleep(wait)
+                continue
+            wait = self._take_token()
+            if wait > 0:
+                self.stats['throttled'] += 1
+                await asyncio.sleep(wait)
+                continue
+
+            heapq.heappop(schedule)
+            poll = self.channels[channel]
+            try:
+                await self.poll(poll)
+            except FloodWaitError as e:
+                self.stats['flood_waits'] += 1
+                poll.errors += 1
+                self._paused_until = self.clock.time() + e.seconds
+                logger.warning(f"轮询 {channel} 遇到频率限制，暂停全部轮询 {e.seconds} 秒")
+            except Exception as e:
+                poll.errors += 1
+                poll.interval = self.max_interval
+                logger.error(f"轮询 {channel} 失败: {e}")
+            heapq.heappush(schedule, (self.clock.time() + poll.interval * self.budget_factor(), channel))
+
+    def snapshot(self):
+        """各频道的轮询间隔、速率和拉取数"""
+        factor = self.budget_factor()
+        return {
+            poll.channel: {
+                'interval': round(poll.interval * factor),
+                'rate_per_hour': round((poll.rate or 0) * 3600, 2),
+                'polls': poll.polls,
+                'messages': poll.messages,
+                'errors': poll.errors,
+            }
+            for poll in self.channels.values()
+        }
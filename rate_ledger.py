@@ -0,0 +1,81 @@
+# 限流与退避状态账本：每次发送/错误追加一行JSON，启动时回放，重启后不会重置发送额度
+import json
+import os
+
+from loguru import logger
+
+# 账本只需保留最长限流窗口（一天）内的发送记录
+LEDGER_RETENTION = 86400
+
+
+class RateLedger:
+    """追加写入的状态账本，行数过多时压缩成一行快照"""
+
+    def __init__(self, path, compact_every=500):
+        self.path = path
+        self.compact_every = compact_every
+        self._file = None
+        self._lines = 0
+
+    def load(self, now):
+        """回放账本，返回上次运行的状态；没有账本时返回 None"""
+        if not os.path.exists(self.path):
+            return None
+        state = {'sends': [], 'consecutive_errors': 0, 'multiplier': 1.0, 'cooldown_until': 0}
+        try:
+            with open(self.path, encoding="utf-8") as f:
+                for line in f:
+                    self._lines += 1
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue  # 崩溃时可能只写了半行
+                    event = record.get('e')
+                    if event == 'state':
+                        state = {key: record[key] for key in state}
+                    elif event == 'send':
+                        state['sends'].append(record['t'])
+                        state['consecutive_errors'] = 0
+                        state['multiplier'] = record['m']
+                    elif event == 'error':
+                        state['consecutive_errors'] = record['c']
+                        state['multiplier'] = record['m']
+                    elif event == 'cooldown':
+                        state['cooldown_until'] = max(state['cooldown_until'], record['u'])
+        except Exception as e:
+            logger.error(f"读取限流账本失败: {e}")
+            return None
+        state['sends'] = [t for t in state['sends'] if now - t < LEDGER_RETENTION]
+        return state
+
+    def append(self, record):
+        """追加一条记录（行缓冲，不做fsync）"""
+        try:
+            if self._file is None:
+                os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                self._file = open(self.path, "a", encoding="utf-8", buffering=1)
+            self._file.write(json.dumps(record, separators=(",", ":")) + "\n")
+            self._lines += 1
+        except Exception as e:
+            logger.error(f"写入限流账本失败: {e}")
+
+    def needs_compaction(self):
+        return self._lines >= self.compact_every
+
+    def compact(self, state):
+        """用一行快照替换整个账本"""
+        try:
+            self.close()
+            os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+            tmp_path = f"{self.path}.tmp"
+            with open(tmp_path, "w", encoding="utf-8") as f:
+                f.write(json.dumps(dict(state, e='state'), separators=(",", ":")) + "\n")
+            os.replace(tmp_path, self.path)
+            self._lines = 1
+        except Exception as e:
+            logger.error(f"压缩限流账本失败: {e}")
+
+    def close(self):
+        if self._file is not None:
+            self._file.close()
+            self._file = None
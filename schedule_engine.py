@@ -0,0 +1,120 @@
+# 时间窗口调度：把工作/安全时间预编译成一周168个小时槽，当前窗口缓存到下一个边界
+from collections import namedtuple
+from datetime import datetime, timedelta
+
+import pytz
+
+from clock import SystemClock
+
+# 当前所处的时间窗口，start/end 为Unix时间戳，窗口内所有判断结果一致
+ScheduleWindow = namedtuple("ScheduleWindow", [
+    "in_work_hours", "is_weekend", "is_safe", "work_ratio", "start", "end", "next_work_time"
+])
+
+
+def _in_hours(hour, hours):
+    """小时是否落在 (开始, 结束) 区间内（包含结束小时，支持跨午夜）"""
+    start, end = hours
+    if start <= end:
+        return start <= hour <= end
+    return hour >= start or hour <= end
+
+
+class WorkSchedule:
+    """单个频道的时间窗口"""
+
+    def __init__(self, work_hours=(9, 18), safe_hours=(7, 23), weekday_ratio=1.0,
+                 weekend_ratio=0.5, off_hours_ratio=0.3, timezone="Asia/Shanghai", clock=None):
+        self.tz = pytz.timezone(timezone)
+        self.clock = clock if clock is not None else SystemClock()
+        self.work_start_hour = work_hours[0]
+
+        # 每个小时槽的状态：(工作时间, 周末, 安全时间, 处理比例)
+        self._slots = []
+        for slot in range(168):
+            weekday, hour = divmod(slot, 24)
+            is_weekend = weekday >= 5
+            in_work_hours = _in_hours(hour, work_hours)
+            if in_work_hours:
+                ratio = weekend_ratio if is_weekend else weekday_ratio
+            else:
+                ratio = off_hours_ratio
+            self._slots.append((in_work_hours, is_weekend, _in_hours(hour, safe_hours), ratio))
+
+        # 每个小时槽距离下一次状态变化的小时数
+        self._run_length = []
+        for slot in range(168):
+            length = 1
+            while length < 168 and self._slots[(slot + length) % 168] == self._slots[slot]:
+                length += 1
+            self._run_length.append(length)
+
+        self._window = None
+
+    @classmethod
+    def from_config(cls, config, clock=None, overrides=None):
+        """根据 AntiBanConfig 创建，overrides 可覆盖单个频道的配置项"""
+        values = {
+            "WORK_HOURS": config.WORK_HOURS,
+            "SAFE_HOURS": config.SAFE_HOURS,
+            "WEEKDAY_WORK_RATIO": config.WEEKDAY_WORK_RATIO,
+            "WEEKEND_WORK_RATIO": config.WEEKEND_WORK_RATIO,
+            "OFF_HOURS_RATIO": config.OFF_HOURS_RATIO,
+            "TIMEZONE": config.TIMEZONE,
+        }
+        values.update(overrides or {})
+        return cls(work_hours=values["WORK_HOURS"], safe_hours=values["SAFE_HOURS"],
+                   weekday_ratio=values["WEEKDAY_WORK_RATIO"],
+                   weekend_ratio=values["WEEKEND_WORK_RATIO"],
+                   off_hours_ratio=values["OFF_HOURS_RATIO"],
+                   timezone=values["TIMEZONE"], clock=clock)
+
+    def window(self):
+        """当前时间窗口（窗口结束前直接返回缓存）"""
+        now = self.clock.time()
+        window = self._window
+        if window is None or not (window.start <= now < window.end):
+            window = self._window = self._compile_window(now)
+        return window
+
+    def is_open(self):
+        """当前是否在工作时间内"""
+        return self.window().in_work_hours
+
+    def next_open_at(self):
+        """下一个工作时间开始的时刻"""
+        return self.window().next_work_time
+
+    def _compile_window(self, timestamp):
+        local = datetime.fromtimestamp(timestamp, self.tz)
+        slot = local.weekday() * 24 + local.hour
+        in_work_hours, is_weekend, is_safe, ratio = self._slots[slot]
+        start = timestamp - (local.minute * 60 + local.second + local.microsecond / 1e6)
+        end = start + self._run_length[slot] * 3600
+
+        # 当前小时早于工作开始时间则为今天，否则为明天
+        next_work_time = local.replace(hour=self.work_start_hour, minute=0, second=0, microsecond=0)
+        if local.hour >= self.work_start_hour:
+            next_work_time += timedelta(days=1)
+        next_work_time = self.tz.normalize(next_work_time)
+        # 状态相同的小时槽可能连续一整周，窗口最晚在下一个工作开始时刻结束，之后重新计算 next_work_time
+        end = min(end, next_work_time.timestamp())
+
+        return ScheduleWindow(in_work_hours, is_weekend, is_safe, ratio, start, end, next_work_time)
+
+
+class ScheduleBook:
+    """按频道管理时间窗口，未单独配置的频道共用默认窗口"""
+
+    def __init__(self, config, clock=None):
+        self.default = WorkSchedule.from_config(config, clock)
+        self._by_channel = {
+            channel: WorkSchedule.from_config(config, clock, overrides)
+            for channel, overrides in getattr(config, "CHANNEL_SCHEDULES", {}).items()
+        }
+
+    def get(self, channel=None):
+        return self._by_channel.get(channel, self.default)
+
+    def window(self, channel=None):
+        return self.get(channel).window()
@@ -0,0 +1,175 @@
+# 定时任务调度：所有周期任务注册到一个按到期时间排序的堆上，只在最近的任务到期时唤醒，支持抖动、防重叠和运行统计
+import asyncio
+import heapq
+import itertools
+import random
+
+from loguru import logger
+
+from clock import SystemClock
+
+
+class ScheduledJob:
+    """一个注册的定时任务（interval 为 None 时只运行一次）"""
+
+    __slots__ = ("name", "func", "interval", "jitter", "scheduled", "next_run", "task", "cancelled", "stats")
+
+    def __init__(self, name, func, interval, jitter, next_run):
+        self.name = name
+        self.func = func  # 同步函数或协程函数
+        self.interval = interval
+        self.jitter = jitter  # 每次到期时间额外推迟 0~jitter 秒，避免多个任务同时唤醒
+        self.scheduled = next_run  # 不含抖动的原定时间，下一周期从这里推算，抖动不会累积
+        self.next_run = next_run
+        self.task = None
+        self.cancelled = False
+        self.stats = {'runs': 0, 'overruns': 0, 'errors': 0, 'total': 0.0, 'max': 0.0, 'last': 0.0}
+
+
+class TimerScheduler:
+    """堆式定时器队列
+    任务在独立的 asyncio 任务中运行，慢任务不会推迟其他任务；
+    上一次运行还没结束时本次到期直接跳过（记为 overrun），错过的周期不补跑
+    """
+
+    def __init__(self, clock=None, rng=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.rng = rng if rng is not None else random
+        self.jobs = {}
+        self._heap = []
+        self._seq = itertools.count()
+        self._wake = asyncio.Event()
+        self._timer = None
+        self._oneshots = set()  # 正在运行的一次性任务：它们已从 jobs 中移除，关闭时单独取消
+
+    def every(self, name, interval, func, jitter=0.0, delay=None):
+        """注册周期任务：delay 秒后第一次运行（默认一个周期后），之后每 interval 秒运行一次"""
+        self.cancel(name)
+        first = self.clock.time() + (interval if delay is None else delay)
+        job = self.jobs[name] = ScheduledJob(name, func, interval, jitter, first)
+        self._push(job)
+        return job
+
+    def at(self, name, when, func):
+        """注册一次性任务；同名任务已在等待时保留较早的到期时间"""
+        job = self.jobs.get(name)
+        if job is not None and job.interval is None and not job.cancelled:
+            job.func = func
+            if when < job.next_run:
+                job.scheduled = job.next_run = when
+                self._push(job)
+            return job
+        job = self.jobs[name] = ScheduledJob(name, func, None, 0.0, when)
+        self._push(job)
+        return job
+
+    def cancel(self, name):
+        job = self.jobs.get(name)
+        if job is not None:
+            job.cancelled = True
+
+    def _push(self, job):
+        heapq.heappush(self._heap, (job.next_run, next(self._seq), job))
+        if self._heap[0][2] is job:
+            # 新的最早到期时间：重新设置唤醒定时器
+            self._wake.set()
+
+    def _arm(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._wake.set)
+
+    async def run(self):
+        """调度循环：只在最近的任务到期或有新任务注册时唤醒"""
+        try:
+            while True:
+                self._wake.clear()
+                now = self.clock.time()
+                while self._heap:
+                    when, _, job = self._heap[0]
+                    if job.cancelled or when != job.next_run:
+                        heapq.heappop(self._heap)  # 已取消或已改期的旧条目
+                        continue
+                    if when > now:
+                        break
+                    heapq.heappop(self._heap)
+                    self._dispatch(job, now)
+                if self._heap:
+                    self._arm(self._heap[0][0] - now)
+                await self._wake.wait()
+        finally:
+            if self._timer is not None:
+                self._timer.cancel()
+
+    def _dispatch(self, job, now):
+        if job.task is not None and not job.task.done():
+            job.stats['overruns'] += 1
+            logger.warning(f"⏱️ 定时任务 {job.name} 上次运行尚未结束，跳过本次")
+        else:
+            job.task = asyncio.create_task(self._run_job(job))
+            if job.interval is None:
+                self._oneshots.add(job.task)
+                job.task.add_done_callback(self._oneshots.discard)
+
+        if job.interval is None:
+            if self.jobs.get(job.name) is job:
+                del self.jobs[job.name]
+            return
+        # 按原定节奏排下一次，错过的周期直接跳过
+        scheduled = job.scheduled + job.interval
+        if scheduled <= now:
+            scheduled = now + job.interval
+        job.scheduled = scheduled
+        job.next_run = scheduled + (self.rng.uniform(0, job.jitter) if job.jitter else 0.0)
+        self._push(job)
+
+    async def _run_job(self, job):
+        started = self.clock.monotonic()
+        try:
+            result = job.func()
+            if asyncio.iscoroutine(result):
+                await result
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            job.stats['errors'] += 1
+            logger.error(f"定时任务 {job.name} 出错: {e}")
+        finally:
+            elapsed = self.clock.monotonic() - started
+            job.stats['runs'] += 1
+            job.stats['total'] += elapsed
+            job.stats['last'] = elapsed
+            job.stats['max'] = max(job.stats['max'], elapsed)
+
+    async def shutdown(self):
+        """取消所有任务和正在运行的任务"""
+        running = [job.task for job in self.jobs.values() if job.task is not None and not job.task.done()]
+        running.extend(task for task in self._oneshots if not task.done())
+        for job in self.jobs.values():
+            job.cancelled = True
+        for task in running:
+            task.cancel()
+        if running:
+            await asyncio.gather(*running, return_exceptions=True)
+
+    def snapshot(self):
+        """各任务的下次运行时间和运行统计"""
+        now = self.clock.time()
+        return {
+            job.name: {
+                'interval': job.interval,
+                'next_in': round(job.next_run - now, 1),
+                'runs': job.stats['runs'],
+                'overruns': job.stats['overruns'],
+                'errors': job.stats['errors'],
+                'avg': round(job.stats['total'] / job.stats['runs'], 3) if job.stats['runs'] else 0.0,
+                'max': round(job.stats['max'], 3),
+            }
+            for job in self.jobs.values() if not job.cancelled
+        }
+
+    def report_lines(self):
+        """状态报告中的定时任务行"""
+        return [f"  • {name}: 运行 {stats['runs']} 次，平均 {stats['avg']:.3f}s / 最长 {stats['max']:.3f}s，"
+                f"跳过 {stats['overruns']}，出错 {stats['errors']}，{stats['next_in']:.0f}s 后再运行"
+                for name, stats in self.snapshot().items()]
@@ -0,0 +1,94 @@
+# 全局发送闸门：频率限制、冷却和暂停关闭闸门直到确切的截止时间，到时由一个定时器重新打开，所有发送方一起暂停和恢复
+import asyncio
+
+from loguru import logger
+
+from clock import SystemClock
+
+
+class SendGate:
+    """所有发送（转发、编辑、日志、状态报告）前等待闸门打开
+    关闭时只记录截止时间并安排一个定时器，不轮询；多次关闭取最晚的截止时间
+    """
+
+    def __init__(self, clock=None, on_open=None):
+        self.clock = clock if clock is not None else SystemClock()
+        self.on_open = on_open  # on_open(reason)：闸门重新打开时调用
+        self._open = asyncio.Event()
+        self._open.set()
+        self._timer = None
+        self.deadline = None
+        self.reason = None
+        self.stats = {'closures': 0, 'extended': 0, 'closed_seconds': 0.0}
+        self._closed_at = None
+
+    @property
+    def is_open(self):
+        return self._open.is_set()
+
+    def remaining(self):
+        """距离重新打开的秒数"""
+        return max(0.0, self.deadline - self.clock.time()) if self.deadline is not None else 0.0
+
+    async def wait(self):
+        """等待闸门打开"""
+        await self._open.wait()
+
+    def hold(self, seconds, reason):
+        """关闭闸门 seconds 秒"""
+        self.close_until(self.clock.time() + seconds, reason)
+
+    def close_until(self, deadline, reason):
+        """关闭闸门直到 deadline（Unix时间戳）；已关闭且截止更晚时保持不变"""
+        now = self.clock.time()
+        if deadline <= now:
+            return
+        if self.deadline is not None and deadline <= self.deadline:
+            return
+        if self.is_open:
+            self.stats['closures'] += 1
+            self._closed_at = now
+            self._open.clear()
+        else:
+            self.stats['extended'] += 1
+        self.deadline = deadline
+        self.reason = reason
+        self._schedule(deadline - now)
+        logger.warning(f"🚧 发送闸门关闭（{reason}），{deadline - now:.0f} 秒后重新打开")
+
+    def _schedule(self, delay):
+        if self._timer is not None:
+            self._timer.cancel()
+        self._timer = asyncio.get_running_loop().call_later(delay, self._on_timer)
+
+    def _on_timer(self):
+        self._timer = None
+        remaining = self.remaining()
+        if remaining > 0:
+            # 事件循环时钟和系统时钟有偏差时补足剩余时间
+            self._schedule(remaining)
+            return
+        self.reopen()
+
+    def reopen(self):
+        """重新打开闸门（截止时间到达或手动恢复）"""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self.is_open:
+            return
+        reason = self.reason
+        self.stats['closed_seconds'] += self.clock.time() - self._closed_at
+        self.deadline = self.reason = self._closed_at = None
+        self._open.set()
+        logger.info(f"🚦 发送闸门已重新打开（{reason}）")
+        if self.on_open:
+            self.on_open(reason)
+
+    def snapshot(self):
+        return {
+            'open': self.is_open,
+            'reason': self.reason,
+            'remaining': round(self.remaining(), 1),
+            **{key: round(value, 1) if isinstance(value, float) else value for key, value in self.stats.items()},
+        }
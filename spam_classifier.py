@@ -0,0 +1,383 @@
+# 垃圾/无关消息分类：字符 n-gram 哈希到固定大小的特征空间，用朴素贝叶斯线性模型打分
+# 模型离线训练：已转发的消息为正常样本，人工标注文件提供垃圾样本；保存为JSON文件，运行中文件更新后自动重新加载
+import argparse
+import json
+import math
+import os
+import time
+import zlib
+from array import array
+
+from loguru import logger
+
+from anti_ban_config import AntiBanConfig
+from clock import SystemClock
+from journal import iter_events
+from stats_store import parse_time
+
+HASH_BITS = 18  # 特征空间大小 2^18
+NGRAM_ORDERS = (1, 2, 3)  # 中文单字即是词，二/三字组合覆盖常见词和联系方式片段
+MAX_CHARS = 512  # 只看消息开头（与转发流水保存的文本长度一致）
+DEFAULT_THRESHOLD = 0.9  # 误判会丢掉正常消息，默认偏向精确率
+
+# 训练时额外视为垃圾的跳过原因，默认不使用任何跳过原因：
+# shed/expired 来自队列压力和到达时间（夜间积压），不说明内容是垃圾；
+# spam 是分类器自己的判定，用来训练会放大已有的误判
+SPAM_REASONS = ()
+
+# 数字统一为0，手机号、微信号、价格等按形状而不是具体值计入特征
+_DIGITS = str.maketrans("123456789", "000000000")
+
+
+def normalize(text, max_chars=MAX_CHARS):
+    """小写、数字归一、合并空白，截取开头 max_chars 个字符"""
+    return " ".join(text[:max_chars].lower().translate(_DIGITS).split())
+
+
+def hashed_features(text, bits=HASH_BITS, orders=NGRAM_ORDERS, max_chars=MAX_CHARS):
+    """文本中出现过的 n-gram 的哈希桶编号（只计是否出现，不计次数）"""
+    text = normalize(text, max_chars)
+    mask = (1 << bits) - 1
+    grams = {text[i:i + n] for n in orders for i in range(len(text) - n + 1)}
+    return {zlib.crc32(gram.encode("utf-8")) & mask for gram in grams}
+
+
+class SpamModel:
+    """线性模型：对数几率 = bias + 出现的各特征桶权重之和"""
+
+    def __init__(self, weights, bias, default, bits=HASH_BITS, orders=NGRAM_ORDERS, max_chars=MAX_CHARS,
+                 threshold=DEFAULT_THRESHOLD, meta=None):
+        self.weights = weights  # array('d')，长度 2^bits
+        self.bias = bias
+        self.default = default  # 训练中没出现过的特征桶的权重
+        self.bits = bits
+        self.orders = tuple(orders)
+        self.max_chars = max_chars
+        self.threshold = threshold  # 垃圾概率不低于该值时跳过
+        self.meta = meta or {}
+
+    def score(self, text):
+        """垃圾消息的对数几率"""
+        return self.bias + sum(map(self.weights.__getitem__,
+                                   hashed_features(text or "", self.bits, self.orders, self.max_chars)))
+
+    def score_batch(self, texts):
+        """批量打分（评估命令使用）：权重表和特征参数只取一次
+        耗时几乎全在逐条生成 n-gram 上，纯 Python 下每条耗时与 score() 相同
+        """
+        lookup = self.weights.__getitem__
+        bias, bits, orders, max_chars = self.bias, self.bits, self.orders, self.max_chars
+        return [bias + sum(map(lookup, hashed_features(text or "", bits, orders, max_chars))) for text in texts]
+
+    @staticmethod
+    def probability(log_odds):
+        if log_odds < -30:
+            return 0.0
+        return 1.0 / (1.0 + math.exp(-log_odds))
+
+    def to_dict(self):
+        """只保存训练中出现过的特征桶"""
+        return {
+            'version': 1,
+            'bits': self.bits,
+            'orders': list(self.orders),
+            'max_chars': self.max_chars,
+            'threshold': self.threshold,
+            'bias': self.bias,
+            'default': self.default,
+            'weights': {str(i): round(w, 5) for i, w in enumerate(self.weights) if w != self.default},
+            **self.meta,
+        }
+
+    @classmethod
+    def from_dict(cls, data):
+        bits = data['bits']
+        weights = array('d', [data['default']]) * (1 << bits)
+        for index, weight in data['weights'].items():
+            weights[int(index)] = weight
+        meta = {key: value for key, value in data.items()
+                if key not in ('version', 'bits', 'orders', 'max_chars', 'threshold', 'bias', 'default', 'weights')}
+        return cls(weights, data['bias'], data['default'], bits, data['orders'], data['max_chars'],
+                   data['threshold'], meta)
+
+    def save(self, path):
+        """先写临时文件再替换，运行中的转发器不会读到写了一半的模型"""
+        os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self.to_dict(), f, separators=(",", ":"))
+        os.replace(tmp, path)
+
+    @classmethod
+    def load(cls, path):
+        with open(path, encoding="utf-8") as f:
+            return cls.from_dict(json.load(f))
+
+
+class NaiveBayesTrainer:
+    """二值化多项式朴素贝叶斯：统计每个特征桶在两类消息中出现的次数，导出为线性模型"""
+
+    def __init__(self, bits=HASH_BITS, orders=NGRAM_ORDERS, max_chars=MAX_CHARS, alpha=1.0):
+        self.bits = bits
+        self.orders = tuple(orders)
+        self.max_chars = max_chars
+        self.alpha = alpha  # 拉普拉斯平滑
+        self.counts = ({}, {})  # (正常, 垃圾)：特征桶 -> 出现次数
+        self.totals = [0, 0]  # 各类特征总数
+        self.docs = [0, 0]  # 各类消息数
+
+    def add(self, text, is_spam):
+        label = int(bool(is_spam))
+        counts = self.counts[label]
+        features = hashed_features(text, self.bits, self.orders, self.max_chars)
+        for feature in features:
+            counts[feature] = counts.get(feature, 0) + 1
+        self.totals[label] += len(features)
+        self.docs[label] += 1
+
+    def build(self, threshold=DEFAULT_THRESHOLD):
+        """权重 = log P(特征|垃圾) - log P(特征|正常)，bias 为两类先验的对数比"""
+        if not all(self.docs):
+            raise ValueError(f"两类样本都需要：正常 {self.docs[0]} 条，垃圾 {self.docs[1]} 条")
+        size = 1 << self.bits
+        alpha = self.alpha
+        ham_norm = math.log(self.totals[0] + alpha * size)
+        spam_norm = math.log(self.totals[1] + alpha * size)
+        default = ham_norm - spam_norm  # 两类都没出现过的特征桶
+        weights = array('d', [default]) * size
+        ham, spam = self.counts
+        for feature in ham.keys() | spam.keys():
+            weights[feature] = (math.log(spam.get(feature, 0) + alpha) - spam_norm
+                                - math.log(ham.get(feature, 0) + alpha) + ham_norm)
+        bias = math.log(self.docs[1] / self.docs[0])
+        meta = {'trained_at': round(time.time()), 'samples': {'ham': self.docs[0], 'spam': self.docs[1]}}
+        return SpamModel(weights, bias, default, self.bits, self.orders, self.max_chars, threshold, meta)
+
+
+class SpamClassifier:
+    """转发器使用的分类器：从模型文件加载，文件修改后由定时任务重新加载；没有模型文件时不过滤"""
+
+    def __init__(self, path, clock=None):
+        self.path = path
+        self.clock = clock if clock is not None else SystemClock()
+        self.model = None
+        self._mtime = None
+        self.stats = {'scored': 0, 'spam': 0, 'reloads': 0, 'seconds': 0.0}
+
+    @property
+    def loaded(self):
+        return self.model is not None
+
+    def maybe_reload(self):
+        """模型文件有变化时重新加载，返回是否加载了新模型（加载失败时保留旧模型）"""
+        try:
+            mtime = os.path.getmtime(self.path)
+        except OSError:
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+        try:
+            model = SpamModel.load(self.path)
+        except (OSError, ValueError, KeyError) as e:
+            logger.error(f"加载垃圾消息模型失败: {e}")
+            return False
+        self.model = model
+        self.stats['reloads'] += 1
+        logger.info(f"🧠 已加载垃圾消息模型：训练样本 {model.meta.get('samples')}，阈值 {model.threshold}")
+        return True
+
+    def spam_probability(self, text):
+        """消息是垃圾/无关消息的概率；没有模型或没有文本时为 None"""
+        model = self.model
+        if model is None or not text:
+            return None
+        started = self.clock.monotonic()
+        probability = model.probability(model.score(text))
+        self.stats['seconds'] += self.clock.monotonic() - started
+        self.stats['scored'] += 1
+        if probability >= model.threshold:
+            self.stats['spam'] += 1
+        return probability
+
+    @property
+    def threshold(self):
+        return self.model.threshold if self.model is not None else 1.0
+
+    def snapshot(self):
+        scored = self.stats['scored']
+        return {
+            'loaded': self.loaded,
+            'scored': scored,
+            'spam': self.stats['spam'],
+            'reloads': self.stats['reloads'],
+            'avg_us': round(self.stats['seconds'] / scored * 1e6, 1) if scored else 0.0,
+        }
+
+
+def journal_samples(directory, spam_reasons=SPAM_REASONS, since=None, until=None):
+    """从转发流水生成样本 [(时间, 文本, 是否垃圾)]：已转发的为正常，因 spam_reasons 跳过的为垃圾
+    （默认没有垃圾样本，垃圾样本来自人工标注文件）
+    """
+    texts = {}
+    samples = []
+    for entry in iter_events(directory, since, until):
+        key = (entry.get('ch'), entry.get('id'))
+        event = entry['ev']
+        if event == 'received':
+            if entry.get('text'):
+                texts[key] = (entry['ts'], entry['text'])
+            continue
+        received = texts.pop(key, None)
+        if received is None:
+            continue
+        if event == 'sent':
+            samples.append((received[0], received[1], False))
+        elif event == 'skipped' and entry.get('reason') in spam_reasons:
+            samples.append((received[0], received[1], True))
+    return samples
+
+
+def load_labels(path):
+    """人工标注样本：每行 {"text": ..., "spam": true/false}"""
+    samples = []
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            line = line.strip()
+            if line:
+                entry = json.loads(line)
+                samples.append((0.0, entry['text'], bool(entry['spam'])))
+    return samples
+
+
+def train(samples, bits=HASH_BITS, alpha=1.0, threshold=DEFAULT_THRESHOLD):
+    trainer = NaiveBayesTrainer(bits=bits, alpha=alpha)
+    for _, text, is_spam in samples:
+        trainer.add(text, is_spam)
+    return trainer.build(threshold)
+
+
+def keyword_baseline(text, keywords):
+    """原来的规则：命中两个及以上垃圾关键词即判为垃圾"""
+    text = text.lower()
+    return sum(1 for keyword in keywords if keyword in text) >= 2
+
+
+def confusion(predictions, labels):
+    tp = sum(1 for p, y in zip(predictions, labels) if p and y)
+    fp = sum(1 for p, y in zip(predictions, labels) if p and not y)
+    fn = sum(1 for p, y in zip(predictions, labels) if not p and y)
+    tn = len(labels) - tp - fp - fn
+    precision = tp / (tp + fp) if tp + fp else 0.0
+    recall = tp / (tp + fn) if tp + fn else 0.0
+    f1 = 2 * precision * recall / (precision + recall) if precision + recall else 0.0
+    return {'tp': tp, 'fp': fp, 'fn': fn, 'tn': tn, 'precision': round(precision, 4),
+            'recall': round(recall, 4), 'f1': round(f1, 4)}
+
+
+def throughput(model, texts, messages):
+    """单条和批量打分的耗时：texts 循环使用直到打分 messages 条"""
+    texts = (texts * (messages // max(len(texts), 1) + 1))[:messages]
+    started = time.perf_counter()
+    for text in texts:
+        model.score(text)
+    single = time.perf_counter() - started
+    started = time.perf_counter()
+    for start in range(0, len(texts), 256):
+        model.score_batch(texts[start:start + 256])
+    batch = time.perf_counter() - started
+    return {
+        'messages': len(texts),
+        'avg_chars': round(sum(len(text) for text in texts) / len(texts), 1) if texts else 0.0,
+        'single_us': round(single / len(texts) * 1e6, 1) if texts else 0.0,
+        'batch_us': round(batch / len(texts) * 1e6, 1) if texts else 0.0,
+        'batch_per_second': round(len(texts) / batch) if batch else 0,
+    }
+
+
+def evaluate(model, samples, thresholds=(0.5, 0.7, 0.9, 0.95, 0.99), messages=5000):
+    texts = [text for _, text, _ in samples]
+    labels = [is_spam for _, _, is_spam in samples]
+    probabilities = [model.probability(score) for score in model.score_batch(texts)]
+    return {
+        'samples': len(samples),
+        'spam': sum(labels),
+        'threshold': model.threshold,
+        'model': confusion([p >= model.threshold for p in probabilities], labels),
+        'sweep': {str(t): confusion([p >= t for p in probabilities], labels) for t in thresholds},
+        'keywords': confusion([keyword_baseline(text, AntiBanConfig.SPAM_KEYWORDS) for text in texts], labels),
+        'throughput': throughput(model, texts, messages) if texts else {},
+    }
+
+
+def main(argv=None):
+    data_dir = os.getenv("DATA_DIR", "data")
+    parser = argparse.ArgumentParser(description="垃圾/无关消息分类器训练与评估")
+    parser.add_argument("--journal", default=os.path.join(data_dir, "journal"), help="转发流水目录")
+    parser.add_argument("--reasons", default=",".join(SPAM_REASONS),
+                        help="额外视为垃圾的跳过原因，逗号分隔（默认无；shed/expired 是队列压力，不是垃圾）")
+    parser.add_argument("--labels", help="人工标注样本（JSON行），垃圾样本的来源")
+    parser.add_argument("--since", help="开始时间（YYYY-MM-DD[ HH:MM] 北京时间或时间戳）")
+    parser.add_argument("--until", help="结束时间（不含）")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    fit = sub.add_parser("train", help="训练并保存模型（运行中的转发器会自动重新加载）")
+    fit.add_argument("--out", default=os.path.join(data_dir, "spam_model.json"), help="模型文件")
+    fit.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="判为垃圾的最低概率")
+    fit.add_argument("--bits", type=int, default=HASH_BITS, help="特征空间位数")
+    fit.add_argument("--alpha", type=float, default=1.0, help="平滑系数")
+
+    check = sub.add_parser("eval", help="评估精确率、召回率和打分吞吐量")
+    check.add_argument("--model", help="评估已保存的模型（默认按时间先后切分，用较早的样本临时训练）")
+    check.add_argument("--holdout", type=float, default=0.2, help="未指定模型时最新样本中用于评估的比例")
+    check.add_argument("--threshold", type=float, default=DEFAULT_THRESHOLD, help="临时训练模型的阈值")
+    check.add_argument("--messages", type=int, default=5000, help="吞吐量测试的打分条数")
+    check.add_argument("--json", action="store_true", help="输出JSON")
+    args = parser.parse_args(argv)
+
+    reasons = tuple(reason.strip() for reason in args.reasons.split(",") if reason.strip())
+    samples = sorted(journal_samples(args.journal, reasons, parse_time(args.since), parse_time(args.until)))
+    extra = load_labels(args.labels) if args.labels else []
+
+    if args.command == "train":
+        try:
+            model = train(samples + extra, bits=args.bits, alpha=args.alpha, threshold=args.threshold)
+        except ValueError as e:
+            parser.error(f"{e}（用 --labels 提供人工标注的垃圾样本）")
+        model.save(args.out)
+        print(f"已保存模型 {args.out}：正常 {model.meta['samples']['ham']} 条，垃圾 {model.meta['samples']['spam']} 条，"
+              f"非默认权重 {sum(1 for w in model.weights if w != model.default)} 个")
+        return
+
+    if args.model:
+        model, test = SpamModel.load(args.model), samples + extra
+    else:
+        # 流水样本按时间、标注样本按文件顺序，各留出最后 holdout 比例用于评估
+        split = int(len(samples) * (1 - args.holdout))
+        labelled = int(len(extra) * (1 - args.holdout))
+        try:
+            model = train(samples[:split] + extra[:labelled], threshold=args.threshold)
+        except ValueError as e:
+            parser.error(f"{e}（用 --labels 提供人工标注的垃圾样本）")
+        test = samples[split:] + extra[labelled:]
+    report = evaluate(model, test, messages=args.messages)
+    if args.json:
+        print(json.dumps(report, ensure_ascii=False, indent=2))
+        return
+
+    print(f"评估样本 {report['samples']} 条，其中垃圾 {report['spam']} 条")
+    print(f"  {'':<14}{'精确率':>7}{'召回率':>7}{'F1':>8}{'误判':>6}{'漏判':>6}")
+    rows = [(f"模型 p≥{report['threshold']:g}", report['model'])]
+    rows += [(f"  p≥{threshold}", result) for threshold, result in report['sweep'].items()]
+    rows.append(("关键词规则", report['keywords']))
+    for label, result in rows:
+        print(f"  {label:<14}{result['precision']:>10.3f}{result['recall']:>10.3f}{result['f1']:>8.3f}"
+              f"{result['fp']:>8}{result['fn']:>8}")
+    speed = report['throughput']
+    if speed:
+        print(f"打分吞吐量（{speed['messages']} 条，平均 {speed['avg_chars']} 字符）：单条 {speed['single_us']} µs，"
+              f"批量 {speed['batch_us']} µs/条，{speed['batch_per_second']} 条/秒")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,253 @@
+# 历史统计：定期把转发器计数写入本地 SQLite 时间序列表，按分钟 -> 小时 -> 天逐级汇总并按粒度清理，附带查询命令行
+import argparse
+import json
+import os
+import sqlite3
+import time
+from datetime import datetime
+
+import pytz
+
+from clock import SystemClock
+
+beijing_tz = pytz.timezone("Asia/Shanghai")
+
+MINUTE = 60
+HOUR = 3600
+DAY = 86400
+RESOLUTIONS = {'minute': MINUTE, 'hour': HOUR, 'day': DAY}
+
+# 各粒度保留时长（秒）：分钟数据保留2天，小时数据90天，天数据3年
+RETENTION = {MINUTE: 2 * DAY, HOUR: 90 * DAY, DAY: 3 * 365 * DAY}
+
+# 全局指标使用的频道名
+ALL_CHANNELS = "*"
+
+# 时间段按北京时间对齐（天从北京时间0点开始，与转发流水的按天统计一致），北京时间没有夏令时
+TZ_OFFSET = int(beijing_tz.utcoffset(datetime(2024, 1, 1)).total_seconds())
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS series (
+    resolution INTEGER NOT NULL,
+    channel TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    bucket INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    sum REAL NOT NULL,
+    min REAL NOT NULL,
+    max REAL NOT NULL,
+    last REAL NOT NULL,
+    PRIMARY KEY (resolution, channel, metric, bucket)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS rollup_state (
+    resolution INTEGER PRIMARY KEY,
+    rolled_until INTEGER NOT NULL
+);
+"""
+
+# 同一分钟内的多次采样合并为一行
+UPSERT = """
+INSERT INTO series VALUES (?, ?, ?, ?, 1, ?, ?, ?, ?)
+ON CONFLICT (resolution, channel, metric, bucket) DO UPDATE SET
+    count = count + 1, sum = sum + excluded.sum, min = MIN(min, excluded.min), max = MAX(max, excluded.max),
+    last = excluded.last
+"""
+
+# 把细粒度的已完成时间段汇总为粗粒度的一行（last 取时间段内最后一行的 last），:offset 为时区偏移
+ROLLUP = """
+INSERT OR REPLACE INTO series
+SELECT :dst, s.channel, s.metric, ((s.bucket + :offset) / :dst) * :dst - :offset AS b,
+       SUM(s.count), SUM(s.sum), MIN(s.min), MAX(s.max),
+       (SELECT t.last FROM series t
+        WHERE t.resolution = :src AND t.channel = s.channel AND t.metric = s.metric
+          AND t.bucket >= ((s.bucket + :offset) / :dst) * :dst - :offset
+          AND t.bucket < ((s.bucket + :offset) / :dst) * :dst - :offset + :dst
+        ORDER BY t.bucket DESC LIMIT 1)
+FROM series s
+WHERE s.resolution = :src AND s.bucket >= :start AND s.bucket < :end
+GROUP BY b, s.channel, s.metric
+"""
+
+
+class CounterDeltas:
+    """把进程内累计计数转换为每个采样周期的增量（进程启动时计数从0开始）"""
+
+    def __init__(self):
+        self._last = {}
+
+    def deltas(self, counters):
+        """counters: {(频道, 指标): 累计值}，返回 [(频道, 指标, 增量)]，增量为0的不返回（不写无用的行）"""
+        result = []
+        for key, value in counters.items():
+            delta = value - self._last.get(key, 0)
+            if delta:
+                result.append((*key, delta))
+            self._last[key] = value
+        return result
+
+
+class StatsStore:
+    """SQLite 时间序列：每行是 (粒度, 频道, 指标, 时间段) 的采样数、总和、最小、最大和最后值
+    计数类指标记录每个周期的增量（看 sum），状态类指标记录当时的值（看 avg/min/max/last）
+    """
+
+    def __init__(self, path, retention=None, clock=None, tz_offset=TZ_OFFSET, readonly=False):
+        self.path = path
+        self.retention = dict(RETENTION, **(retention or {}))
+        self.clock = clock if clock is not None else SystemClock()
+        self.tz_offset = tz_offset
+        if readonly:
+            # 只读连接（状态接口用）：不建目录、不改日志模式、不建表；由调用方加锁后跨线程复用
+            self.db = sqlite3.connect(f"file:{path}?mode=ro", uri=True, check_same_thread=False)
+            return
+        if path != ":memory:":
+            os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+        self.db = sqlite3.connect(path)
+        if path != ":memory:":
+            # WAL 模式下状态接口的读取不阻塞写入
+            self.db.execute("PRAGMA journal_mode=WAL")
+        self.db.executescript(SCHEMA)
+
+    def record(self, samples, ts=None):
+        """写入一次采样：samples 为 [(频道, 指标, 值)]，写入当前分钟"""
+        ts = self.clock.time() if ts is None else ts
+        bucket = int(ts) // MINUTE * MINUTE
+        with self.db:
+            self.db.executemany(UPSERT, [(MINUTE, channel, metric, bucket, value, value, value, value)
+                                         for channel, metric, value in samples])
+
+    def _align(self, ts, resolution):
+        """ts 所在时间段的开始（按北京时间对齐）"""
+        return (int(ts) + self.tz_offset) // resolution * resolution - self.tz_offset
+
+    def rollup(self, now=None):
+        """汇总已完成的分钟/小时时间段，然后删除超出保留时长的数据，返回各粒度删除的行数"""
+        now = self.clock.time() if now is None else now
+        with self.db:
+            for src, dst in ((MINUTE, HOUR), (HOUR, DAY)):
+                row = self.db.execute("SELECT rolled_until FROM rollup_state WHERE resolution = ?", (dst,)).fetchone()
+                if row:
+                    start = row[0]
+                else:
+                    first = self.db.execute("SELECT MIN(bucket) FROM series WHERE resolution = ?", (src,)).fetchone()
+                    if first[0] is None:
+                        continue
+                    start = self._align(first[0], dst)
+                end = self._align(now, dst)
+                if end <= start:
+                    continue
+                self.db.execute(ROLLUP, {'src': src, 'dst': dst, 'start': start, 'end': end,
+                                         'offset': self.tz_offset})
+                self.db.execute("INSERT OR REPLACE INTO rollup_state VALUES (?, ?)", (dst, end))
+
+            deleted = {}
+            for resolution, keep in self.retention.items():
+                cursor = self.db.execute("DELETE FROM series WHERE resolution = ? AND bucket < ?",
+                                         (resolution, int(now - keep)))
+                deleted[resolution] = cursor.rowcount
+        return deleted
+
+    def resolution_for(self, since, now=None):
+        """能覆盖 since 的最细粒度"""
+        now = self.clock.time() if now is None else now
+        for resolution in sorted(self.retention):
+            if since is None or now - since <= self.retention[resolution]:
+                return resolution
+        return max(self.retention)
+
+    def series(self, channel=ALL_CHANNELS, metric=None, since=None, until=None, resolution=None):
+        """查询一个频道的时间序列：{指标: [{ts, count, sum, avg, min, max, last}]}
+        粗粒度只包含已完成的时间段，最近一段需用更细的粒度查看
+        """
+        resolution = resolution or self.resolution_for(since)
+        query = "SELECT metric, bucket, count, sum, min, max, last FROM series WHERE resolution = ? AND channel = ?"
+        params = [resolution, channel]
+        if metric:
+            query += " AND metric = ?"
+            params.append(metric)
+        if since is not None:
+            query += " AND bucket >= ?"
+            params.append(self._align(since, resolution))
+        if until is not None:
+            query += " AND bucket < ?"
+            params.append(int(until))
+        result = {}
+        for name, bucket, count, total, low, high, last in self.db.execute(query + " ORDER BY metric, bucket", params):
+            result.setdefault(name, []).append({
+                'ts': bucket, 'count': count, 'sum': round(total, 4), 'avg': round(total / count, 4),
+                'min': low, 'max': high, 'last': last})
+        return result
+
+    def channels(self):
+        """已记录的频道和指标"""
+        rows = self.db.execute("SELECT DISTINCT channel, metric FROM series ORDER BY channel, metric")
+        result = {}
+        for channel, metric in rows:
+            result.setdefault(channel, []).append(metric)
+        return result
+
+    def size(self):
+        """各粒度的行数"""
+        return dict(self.db.execute("SELECT resolution, COUNT(*) FROM series GROUP BY resolution").fetchall())
+
+    def close(self):
+        self.db.close()
+
+
+def parse_time(value):
+    """YYYY-MM-DD、YYYY-MM-DD HH:MM（北京时间）或 Unix 时间戳"""
+    if value is None:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    for fmt in ("%Y-%m-%d %H:%M", "%Y-%m-%d"):
+        try:
+            return beijing_tz.localize(datetime.strptime(value, fmt)).timestamp()
+        except ValueError:
+            continue
+    raise ValueError(f"无法解析时间: {value}")
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description="历史统计查询")
+    parser.add_argument("--db", default=os.path.join(os.getenv("DATA_DIR", "data"), "stats.sqlite3"),
+                        help="统计数据库文件")
+    sub = parser.add_subparsers(dest="command", required=True)
+
+    sub.add_parser("metrics", help="列出已记录的频道和指标")
+    query = sub.add_parser("series", help="输出一个频道的时间序列")
+    query.add_argument("--channel", default=ALL_CHANNELS, help="频道，例如 @remote_cn（默认全局指标）")
+    query.add_argument("--metric", help="只看某个指标，例如 sent")
+    query.add_argument("--since", help="开始时间（YYYY-MM-DD[ HH:MM] 北京时间或时间戳）")
+    query.add_argument("--until", help="结束时间（不含）")
+    query.add_argument("--resolution", choices=list(RESOLUTIONS), help="粒度（默认按开始时间自动选择）")
+    query.add_argument("--json", action="store_true", help="输出JSON")
+    args = parser.parse_args(argv)
+
+    store = StatsStore(args.db)
+    try:
+        if args.command == "metrics":
+            for channel, metrics in store.channels().items():
+                print(f"{channel}: {', '.join(metrics)}")
+            return
+
+        since = parse_time(args.since) if args.since else time.time() - DAY
+        series = store.series(args.channel, args.metric, since, parse_time(args.until),
+                              RESOLUTIONS.get(args.resolution))
+        if args.json:
+            print(json.dumps(series, ensure_ascii=False, indent=2))
+            return
+        for metric, points in series.items():
+            print(f"{metric}:")
+            for point in points:
+                stamp = datetime.fromtimestamp(point['ts'], beijing_tz).strftime("%Y-%m-%d %H:%M")
+                print(f"  {stamp}  sum {point['sum']:>10g}  avg {point['avg']:>10g}  "
+                      f"min {point['min']:>8g}  max {point['max']:>8g}  last {point['last']:>8g}")
+    finally:
+        store.close()
+
+
+if __name__ == "__main__":
+    main()
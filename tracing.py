@@ -0,0 +1,100 @@
+# 单条消息的分阶段耗时追踪：记录每个阶段的单调时钟耗时，慢消息输出明细，并统计各阶段分位数
+import threading
+import time
+from collections import defaultdict, deque
+
+from loguru import logger
+
+# 排队等待发送时隙/摘要窗口的阶段，按设计会持续数分钟到数小时，不计入慢消息判断
+WAIT_STAGES = frozenset({"queue_wait", "digest_wait"})
+
+
+def _percentile(sorted_values, q):
+    if not sorted_values:
+        return 0.0
+    index = min(len(sorted_values) - 1, max(0, int(round(q * (len(sorted_values) - 1)))))
+    return sorted_values[index]
+
+
+class MessageTrace:
+    """一条消息的处理过程，mark(stage) 记录从上一个标记到现在的耗时"""
+
+    __slots__ = ("key", "started", "last", "spans")
+
+    def __init__(self):
+        self.key = None
+        self.started = self.last = time.monotonic()
+        self.spans = []
+
+    def mark(self, stage):
+        """结束当前阶段并记为 stage"""
+        now = time.monotonic()
+        self.spans.append((stage, now - self.last))
+        self.last = now
+
+    def mark_at(self, stage, at):
+        """以单调时钟时间 at 结束当前阶段并记为 stage（at 早于上一个标记时记为 0 秒）"""
+        at = max(at, self.last)
+        self.spans.append((stage, at - self.last))
+        self.last = at
+
+    @property
+    def total(self):
+        return self.last - self.started
+
+    def active(self, wait_stages=WAIT_STAGES):
+        """除去排队等待阶段的处理耗时"""
+        return self.total - sum(duration for stage, duration in self.spans if stage in wait_stages)
+
+    def breakdown(self):
+        return ", ".join(f"{stage}={duration:.2f}s" for stage, duration in self.spans)
+
+
+class StageTracer:
+    """收集已完成的追踪（有界缓冲），提供慢消息告警和各阶段 p50/p95/p99"""
+
+    def __init__(self, slow_threshold=120, capacity=500, wait_stages=WAIT_STAGES):
+        self.slow_threshold = slow_threshold  # 处理耗时（不含排队等待）超过该秒数的消息输出阶段明细
+        self.wait_stages = frozenset(wait_stages)
+        self.capacity = capacity
+        self.slow_messages = deque(maxlen=50)
+        self._samples = defaultdict(lambda: deque(maxlen=capacity))
+        self._lock = threading.Lock()  # 状态接口在Flask线程中读取
+
+    def start(self):
+        return MessageTrace()
+
+    def finish(self, trace, key):
+        """记录一条完成的追踪"""
+        trace.key = key
+        trace.mark("finish")
+        active = trace.active(self.wait_stages)
+        slow = active >= self.slow_threshold
+        with self._lock:
+            for stage, duration in trace.spans:
+                self._samples[stage].append(duration)
+            self._samples["total"].append(trace.total)
+            if slow:
+                self.slow_messages.append((key, round(active, 2), trace.breakdown()))
+        if slow:
+            logger.warning(f"🐢 慢消息 {key} 处理耗时 {active:.1f} 秒（不含排队）: {trace.breakdown()}")
+
+    def percentiles(self):
+        """各阶段耗时分位数（秒）"""
+        with self._lock:
+            samples = {stage: sorted(values) for stage, values in self._samples.items()}
+        return {
+            stage: {
+                'count': len(values),
+                'p50': round(_percentile(values, 0.50), 3),
+                'p95': round(_percentile(values, 0.95), 3),
+                'p99': round(_percentile(values, 0.99), 3),
+            }
+            for stage, values in samples.items()
+        }
+
+    def report_lines(self):
+        """状态报告中的阶段耗时行"""
+        return [f"  • {stage}: p50 {stats['p50']:.2f}s / p95 {stats['p95']:.2f}s / p99 {stats['p99']:.2f}s "
+                f"({stats['count']})"
+                for stage, stats in sorted(self.percentiles().items())]